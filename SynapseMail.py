@@ -4,26 +4,52 @@
 Auto Mail Center — CustomTkinter Full App (B - Full-featured)
 Author: Apiwish Anutarvanichkul (Boon)
 Version: 4.1.0 - Full feature set + safe logout + thread/event management + phone input
-Requirements: customtkinter
-Run: python auto_mail_ctk_full.py
+Requirements: customtkinter (GUI only)
+Run: python SynapseMail.py                                  (GUI)
+     python SynapseMail.py --headless --config accounts.json (no Tk; see synapse_daemon.py)
 """
 
 import threading
-import imaplib
-import smtplib
-import email
-import email.utils
-import webbrowser
 import re
 from datetime import datetime
 import time
 import sys
+import os
+from functools import cached_property
+
+from synapse_startup import STARTUP  # first: the startup profile's clock starts here
+
+if __name__ == "__main__":
+    if "--profile-startup" in sys.argv[1:]:
+        STARTUP.enable()  # before anything else is imported (parse_args below documents the flag)
+    from synapse_daemon import parse_args, run_headless
+    ARGS = parse_args(sys.argv[1:])
+    if ARGS.headless:
+        STARTUP.disable()  # the profile covers the GUI start
+        # server / container / systemd mode: exit before Tk is ever imported
+        sys.exit(run_headless(ARGS))
 
 import tkinter as tk
 import customtkinter as ctk
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from tkinter import messagebox
+from tkinter import messagebox, filedialog, ttk
+
+# only what the window needs; the IMAP / SMTP / storage / template modules (imaplib, smtplib,
+# email.mime, sqlite3, asyncio) are imported where they are first used, after the login dialog is up
+from synapse_config import (
+    AUTO_REPLIED_KEYWORD, DEFAULT_BULK_WORKERS, DEFAULT_COALESCE_SECONDS, DEFAULT_FETCH_CHUNK_SIZE,
+    DEFAULT_MAX_IMAP_CONNECTIONS, DEFAULT_REPLY_COOLDOWN_SECONDS, DEFAULT_SEND_LIMITS, DEFAULT_SMTP_POOL_SIZE, IMAP_HOST, IMAP_PORT, SEEN_FLAG, SMTP_HOST, SMTP_PORT,
+    client_ssl_context, data_path,
+)
+from synapse_folders import DEFAULT_FOLDERS, FolderWatch, dedicated_sessions, parse_folders
+from synapse_pipeline import (
+    ALREADY_REPLIED, COALESCED, FAILED, NO_REPLY_RULE, PIPELINE_QUEUE_SIZE, REPLIED, SUPPRESSED, InboundMessage,
+    Pipeline, Stage, UidTracker,
+)
+from synapse_metrics import METRICS, PHASES, MetricsFileWriter, MetricsServer
+from synapse_scheduler import SCHEDULER_MAX_INTERVAL, SCHEDULER_MIN_INTERVAL, WAKE_MANUAL, CheckScheduler, parse_interval_bounds
+from synapse_log import LOG_FLUSH_MS, LOG_MAX_LINES, LogBuffer
+
+STARTUP.mark("imports done")
 
 # -----------------------
 # Appearance
@@ -38,33 +64,17 @@ EMAIL_ADDRESS = None
 EMAIL_PASSWORD = None
 
 DEFAULT_CHECK_INTERVAL = 60  # seconds
-
-GREETING_TEMPLATES = {
-    "Friendly 🌈": "Hi {name}! 🎉\nJust wanted to drop in and say hello! Hope you're having an amazing day.\n\n",
-    "Professional 📄": "Greetings {name},\nThank you for contacting us. We appreciate your time.\n\n",
-    "Tech Nerd 🤖": "[SYSTEM ONLINE] Greetings, {name} 🤖\n$ ssh connection@established\nQuantum entanglement confirmed. Handshake protocol: SUCCESS ✓\n\n",
-    "Casual ☕": "What's up {name}? ☕\nJust checking in! Hope everything's going well on your end.\n\n",
-    "Enthusiastic 🚀": "HELLO {name}!! 🚀\nSuper excited to connect with you! Let's make something awesome happen!\n\n",
-    "Funny 😄": "Yo {name}! 😄\n*Dramatically enters inbox* Hello there! Just sliding into your emails like a pro.\n\n",
-    "AI Assistant 🤖": "[AI] Hello {name}! 🤖\n*beep boop* Human detected! My neural networks are pleased to make your acquaintance.\n\n",
-    "Sci-Fi Commander 🛸": "Commander {name}, 🛸\n[INCOMING TRANSMISSION]\nThis is Starship Alpha-7. We've detected your signal.\n\n",
-}
-
-# Template for auto-reply HTML; {phone} will be replaced with user phone
-AUTO_REPLY_HTML_TEMPLATE = """\
-<!DOCTYPE html>
-<html>
-  <body style="margin:0; padding:0; background: linear-gradient(to bottom right, #111827, #0f172a); font-family: Inter, Arial, sans-serif; color:#f8fafc">
-    <div style="max-width:560px; margin:60px auto; background:#0b1220; padding:20px; border-radius:12px; box-shadow: 0 8px 30px rgba(0,0,0,0.6);">
-      <h3 style="color:#60a5fa; margin-top:0;">Thanks for reaching out 👋</h3>
-      <p>We received your message. This is an automatic reply to confirm receipt. We'll get back to you as soon as possible.</p>
-      <p style="font-size:13px; color:#9ca3af;">If it's urgent, please call: <strong>{phone}</strong></p>
-      <hr style="border:none; border-top:1px solid rgba(255,255,255,0.04); margin:10px 0;">
-      <p style="font-size:12px; color:#94a3b8;">Automated system message — no action required.</p>
-    </div>
-  </body>
-</html>
-"""
+APP_PASSWORD_HELP_URL = "https://support.google.com/accounts/answer/185833"
+
+# worker threads per auto-responder pipeline stage (each watched folder has its own
+# fetch thread and IMAP session; the flag commit shares one session, single-threaded)
+DEFAULT_STAGE_WORKERS = {"classify": 1, "render": 2, "send": 3}
+# how often the commit stage persists the sync checkpoint while busy
+CHECKPOINT_SAVE_INTERVAL = 1.0  # seconds
+# the commit stage flags handled messages in one UID STORE per batch (flushed when its queue drains)
+COMMIT_BATCH_SIZE = 500
+# the History tab searches once typing has paused this long
+HISTORY_SEARCH_DELAY_MS = 250
 
 # -----------------------
 # Helpers
@@ -86,6 +96,22 @@ def format_phone_dashed(digits: str) -> str:
         return f"{d[:3]}-{d[3:]}"
     return f"{d[:3]}-{d[3:6]}-{d[6:10]}"
 
+def format_latency(seconds) -> str:
+    if seconds is None:
+        return ""
+    seconds = max(0, int(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    if seconds < 86400:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 86400}d{seconds % 86400 // 3600:02d}h"
+
+def open_app_password_help():
+    import webbrowser  # imported on first click: loading it probes for installed browsers
+    webbrowser.open(APP_PASSWORD_HELP_URL)
+
 # -----------------------
 # CTK Login Dialog
 # -----------------------
@@ -156,7 +182,7 @@ class CTKLoginDialog:
 
         help_link = ctk.CTkLabel(card, text="Need help with App Passwords?", cursor="hand2", text_color="#60a5fa", font=ctk.CTkFont(size=10))
         help_link.pack(padx=16, pady=(0, 12), anchor="w")
-        help_link.bind("<Button-1>", lambda e: webbrowser.open("https://support.google.com/accounts/answer/185833"))
+        help_link.bind("<Button-1>", lambda e: open_app_password_help())
 
         # Buttons
         btn_frame = ctk.CTkFrame(self.top, fg_color="transparent")
@@ -192,8 +218,9 @@ class CTKLoginDialog:
 
         # Short network test in background
         def test_credentials():
+            import smtplib  # loaded off the UI thread, while the dialog waits for the server
             try:
-                with smtplib.SMTP_SSL("smtp.gmail.com", 465, timeout=10) as smtp:
+                with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=10, context=client_ssl_context()) as smtp:
                     smtp.login(email_val, pw_val)
                 # call success on main thread and pass phone_formatted
                 self.top.after(0, lambda: self._finish_success(email_val, pw_val, phone_formatted))
@@ -220,11 +247,113 @@ class CTKLoginDialog:
         self.top.wait_window()
         return self.result
 
+# -----------------------
+# History table (virtualized)
+# -----------------------
+class HistoryTable:
+    """
+    Search results of the MessageIndex in a Treeview that only ever holds the
+    rows on screen: scrolling asks the index for that page (LIMIT / OFFSET), so
+    hundreds of thousands of matches cost no more than a screenful.
+    """
+
+    COLUMNS = (("received", "Received", 130), ("sender", "Sender", 220), ("subject", "Subject", 280),
+               ("outcome", "Outcome", 110), ("latency", "Reply after", 80), ("folder", "Folder", 120))
+    ROW_HEIGHT = 22
+    HEADER_HEIGHT = 26
+
+    def __init__(self, parent, index, on_select=None):
+        self.index = index
+        self.on_select = on_select or (lambda row: None)
+        self.query = ""
+        self.total = 0
+        self.offset = 0
+        self.visible = 20
+        self.rows = {}  # Treeview item id -> HistoryRow on screen
+
+        style = ttk.Style(parent)
+        style.configure("History.Treeview", rowheight=self.ROW_HEIGHT, background="#07101a",
+                        fieldbackground="#07101a", foreground="#dbeafe", borderwidth=0)
+        style.configure("History.Treeview.Heading", background="#1f2937", foreground="#dbeafe")
+        self.frame = ctk.CTkFrame(parent)
+        self.frame.grid_columnconfigure(0, weight=1)
+        self.frame.grid_rowconfigure(0, weight=1)
+        self.tree = ttk.Treeview(self.frame, columns=[name for name, _, _ in self.COLUMNS], show="headings",
+                                 height=self.visible, selectmode="browse", style="History.Treeview")
+        for name, title, width in self.COLUMNS:
+            self.tree.heading(name, text=title, anchor="w")
+            self.tree.column(name, width=width, minwidth=60, stretch=name == "subject", anchor="w")
+        self.tree.grid(row=0, column=0, sticky="nswe")
+        self.scrollbar = ctk.CTkScrollbar(self.frame, command=self._on_scrollbar)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll_by(-1 if e.delta > 0 else 1, "units"))
+        self.tree.bind("<Button-4>", lambda e: self.scroll_by(-1, "units"))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_by(1, "units"))
+        self.tree.bind("<Prior>", lambda e: self.scroll_by(-1, "pages"))
+        self.tree.bind("<Next>", lambda e: self.scroll_by(1, "pages"))
+        self.tree.bind("<<TreeviewSelect>>", self._on_tree_select)
+        self.frame.bind("<Configure>", self._on_resize)
+
+    def search(self, query):
+        """Show the matches of `query` (see MessageIndex), newest first."""
+        self.query = query
+        self.offset = 0
+        self.refresh()
+
+    def refresh(self):
+        """Re-count and re-read the page on screen (new mail shows up at the top)."""
+        self.total = self.index.count(self.query)
+        self._render()
+
+    def scroll_by(self, amount, what="units"):
+        step = 3 if what == "units" else max(1, self.visible - 1)
+        self._scroll_to(self.offset + int(amount) * step)
+        return "break"
+
+    def _scroll_to(self, offset):
+        offset = max(0, min(int(offset), self.total - self.visible))
+        if offset != self.offset:
+            self.offset = offset
+            self._render()
+
+    def _on_scrollbar(self, *args):
+        if args and args[0] == "moveto":
+            self._scroll_to(float(args[1]) * self.total)
+        elif args and args[0] == "scroll":
+            self.scroll_by(int(args[1]), args[2] if len(args) > 2 else "units")
+
+    def _on_resize(self, event):
+        visible = max(1, (event.height - self.HEADER_HEIGHT) // self.ROW_HEIGHT)
+        if visible != self.visible:
+            self.visible = visible
+            self.tree.configure(height=visible)
+            self._render()
+
+    def _render(self):
+        self.offset = max(0, min(self.offset, self.total - self.visible))
+        rows = self.index.search(self.query, limit=self.visible, offset=self.offset) if self.total else []
+        self.tree.delete(*self.tree.get_children())
+        self.rows = {}
+        for row in rows:
+            received = datetime.fromtimestamp(row.received).strftime('%Y-%m-%d %H:%M')
+            iid = self.tree.insert("", tk.END, values=(received, row.sender, row.subject, row.outcome,
+                                                       format_latency(row.latency), row.folder))
+            self.rows[iid] = row
+        if self.total:
+            self.scrollbar.set(self.offset / self.total, min(1.0, (self.offset + len(rows)) / self.total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _on_tree_select(self, _event):
+        selected = self.tree.selection()
+        if selected and selected[0] in self.rows:
+            self.on_select(self.rows[selected[0]])
+
 # -----------------------
 # Main App
 # -----------------------
 class AutoMailCTKApp(ctk.CTk):
-    def __init__(self):
+    def __init__(self, accounts_path=None, metrics_port=None, metrics_file=None):
         super().__init__()
         self.title("Auto Mail Center — V4.1.0")
         self.geometry("1100x760")
@@ -235,13 +364,87 @@ class AutoMailCTKApp(ctk.CTk):
         self.email_password = None
         self.phone_number = None
         self.check_interval_seconds = DEFAULT_CHECK_INTERVAL
-        self.replied_to = set()
+        self.use_idle = True  # push mode; falls back to polling if the server lacks IDLE
+        self.fetch_chunk_size = DEFAULT_FETCH_CHUNK_SIZE  # UIDs per header FETCH
+        self.smtp_pool_size = DEFAULT_SMTP_POOL_SIZE
+        self.reply_cooldown_seconds = DEFAULT_REPLY_COOLDOWN_SECONDS  # None: one reply per sender, ever
+        self._replied = None  # RepliedStore for the logged-in account; survives restarts
+        self.send_limits = dict(DEFAULT_SEND_LIMITS)  # per minute / hour / day, shared by replies, greetings, bulk
+        self.coalesce_seconds = DEFAULT_COALESCE_SECONDS  # a sender answered this recently gets no second reply
+        self._governor = None  # SendGovernor of the logged-in account
+        self.replies_sent = 0  # this session, for the Dashboard
         self._worker_thread = None
+        self.folders = list(DEFAULT_FOLDERS)  # folders / labels the auto-responder watches
+        self.max_imap_connections = DEFAULT_MAX_IMAP_CONNECTIONS  # per account, fetch and commit sessions together
+        self._watches = []  # FolderWatch per folder: own session, schedule and fetch thread
+        self._imap_commit = None  # session owned by the flag-commit stage, re-SELECTs per folder
+        self._pipeline = None
+        self._inflight_senders = set()  # senders with a reply somewhere in the pipeline
+        self._inflight_lock = threading.Lock()
+        self._checkpoint_saved_at = 0.0
+        self.reply_flag = SEEN_FLAG  # or AUTO_REPLIED_KEYWORD to leave the user's read state alone
+        # SEARCH-side filtering (see synapse_filter); lists / auto-mail are also suppressed after the header fetch
+        self.reply_since_days = None  # only answer mail from the last N days
+        self.ignore_senders = ()  # glob patterns, e.g. "*@notifications.example.com"
+        self.filter_server_side = True
+        self._filter = None  # MailFilter for the current run
+        self._rules = None  # RuleSet: routing rules (rules.json in the data directory), reloaded each run
+        self._commit_batch = []  # handled items waiting for one ranged UID STORE
+        self._keyword_warned = False
+        self.stage_workers = dict(DEFAULT_STAGE_WORKERS)
+        self.stage_queue_size = PIPELINE_QUEUE_SIZE
+        self._checkpoint = None  # SyncCheckpoint, loaded on first start (see _sync_checkpoint)
+        self._smtp_pool = None  # shared by auto-replies and the Composer; created at login
+        self._spool = None  # OutboundSpool: replies and greetings are written here first
+        self._outbox = None  # SpoolSender draining self._spool through self._smtp_pool
+        self._outbox_counts = None
+        self.bulk_workers = DEFAULT_BULK_WORKERS
+        self._bulk_job = None
+        self._bulk_path = None
+        self._accounts = []  # AccountConfig list for the multi-account engine
+        self._accounts_path = accounts_path or data_path("accounts.json")
+        self._engine = None  # AsyncEngine serving self._accounts
         self._stop_event = threading.Event()
-        self._lock = threading.Lock()
-
-        self._build_ui()
-        self.after(120, self._do_login)
+        self.log_max_lines = LOG_MAX_LINES
+        self._log = LogBuffer(data_path("synapsemail.log"))
+        self.metrics = METRICS
+        self.adaptive_checks = True  # each folder's CheckScheduler adapts to its own mail volume
+        self.check_interval_bounds = (SCHEDULER_MIN_INTERVAL, SCHEDULER_MAX_INTERVAL)  # the range it adapts within
+        self._metrics_exporters = []
+        try:
+            if metrics_port:
+                self._metrics_exporters.append(MetricsServer(self.metrics, port=metrics_port))
+            if metrics_file:
+                self._metrics_exporters.append(MetricsFileWriter(metrics_file, self.metrics))
+        except OSError as e:
+            self._push_log(f"⚠ Metrics export disabled: {e}")
+
+        with STARTUP.section("main window"):
+            self._build_ui()
+        STARTUP.mark("main window built")
+        self.after_idle(self._do_login)  # as soon as the window is mapped
+        self.after(1000, self._refresh_session_stats)
+        self.after(LOG_FLUSH_MS, self._flush_log)
+        if os.path.exists(self._accounts_path):
+            self.after(200, lambda: self._load_accounts(self._accounts_path, quiet=True))
+
+    @cached_property
+    def _templates(self):
+        """TemplateLibrary over TEMPLATES_DIR (files reloaded when they change); created on first use."""
+        from synapse_templates import TemplateLibrary
+        return TemplateLibrary(log=self._push_log)
+
+    @cached_property
+    def _history(self):
+        """MessageIndex of every handled message (History tab); opened on first use."""
+        from synapse_history import MessageIndex
+        return MessageIndex(data_path("history.sqlite3"), log=self._push_log)
+
+    @cached_property
+    def _reply_cache(self):
+        """Encoded auto-reply bodies, keyed by template + phone."""
+        from synapse_templates import AutoReplyCache
+        return AutoReplyCache()
 
     def _build_ui(self):
         self.grid_columnconfigure(1, weight=1)
@@ -270,9 +473,35 @@ class AutoMailCTKApp(ctk.CTk):
         self.interval_slider.pack(pady=(6, 8))
         self.interval_value_label = ctk.CTkLabel(sidebar, text=str(self.check_interval_seconds))
         self.interval_value_label.pack()
+        self.adaptive_var = tk.BooleanVar(value=self.adaptive_checks)
+        ctk.CTkSwitch(sidebar, text="🧠 Adapt to mail volume", variable=self.adaptive_var, command=self._on_adaptive_toggled).pack(pady=(6, 0))
+        self.entry_interval_bounds = ctk.CTkEntry(sidebar, width=240, placeholder_text="adapt within: shortest, longest (sec)")
+        self.entry_interval_bounds.insert(0, ", ".join(str(b) for b in self.check_interval_bounds))
+        self.entry_interval_bounds.pack(pady=(6, 0))
+        ctk.CTkButton(sidebar, text="🔄 Check Now", width=240, command=self._on_check_now).pack(pady=(8, 0))
+
+        # Watched folders (applied on the next start)
+        ctk.CTkLabel(sidebar, text="Folders / labels (comma-separated)", font=ctk.CTkFont(size=11)).pack(pady=(10, 0))
+        self.entry_folders = ctk.CTkEntry(sidebar, width=240, placeholder_text="inbox, Support/Billing")
+        self.entry_folders.insert(0, ", ".join(self.folders))
+        self.entry_folders.pack(pady=(6, 0))
+
+        # Outgoing quota (applied on the next start)
+        ctk.CTkLabel(sidebar, text="Send limits per minute / hour / day", font=ctk.CTkFont(size=11)).pack(pady=(10, 0))
+        self.entry_send_limits = ctk.CTkEntry(sidebar, width=240, placeholder_text="20, 200, 500 (0: no limit)")
+        self.entry_send_limits.insert(0, ", ".join(str(self.send_limits.get(name) or 0)
+                                                   for name in ("minute", "hour", "day")))
+        self.entry_send_limits.pack(pady=(6, 0))
+
+        # Push mode toggle
+        self.idle_var = tk.BooleanVar(value=self.use_idle)
+        ctk.CTkSwitch(sidebar, text="⚡ Push mode (IMAP IDLE)", variable=self.idle_var, command=self._on_idle_toggled).pack(pady=(10, 0))
+        self.keyword_var = tk.BooleanVar(value=self.reply_flag != SEEN_FLAG)
+        ctk.CTkSwitch(sidebar, text=f"🔖 Keep unread (tag {AUTO_REPLIED_KEYWORD})", variable=self.keyword_var,
+                      command=self._on_keyword_toggled).pack(pady=(10, 0))
 
         # Buttons
-        ctk.CTkButton(sidebar, text="App Password Help", width=240, command=lambda: webbrowser.open("https://support.google.com/accounts/answer/185833")).pack(pady=(12, 4))
+        ctk.CTkButton(sidebar, text="App Password Help", width=240, command=open_app_password_help).pack(pady=(12, 4))
         ctk.CTkButton(sidebar, text="Logout", width=240, fg_color="#ef4444", hover_color="#f87171", command=self._logout).pack(pady=(6, 4))
 
         # Right content
@@ -293,14 +522,23 @@ class AutoMailCTKApp(ctk.CTk):
         last_replied_lbl = ctk.CTkLabel(top_bar, textvariable=self.last_replied_var, font=ctk.CTkFont(size=11))
         last_replied_lbl.grid(row=0, column=1, sticky="e", padx=6)
 
-        # Tabs
-        tabs = ctk.CTkTabview(content, width=600)
+        # Tabs: the Dashboard is built now, the others when first opened (see _ensure_tab)
+        tabs = self._tabs = ctk.CTkTabview(content, width=600, command=self._on_tab_changed)
         tabs.grid(row=1, column=0, sticky="nswe")
         tabs.add("Dashboard")
         tabs.add("Composer")
+        tabs.add("Outbox")
+        tabs.add("History")
         tabs.add("Templates")
         tabs.add("System Log")
         tabs.set("Dashboard")
+        self._tab_builders = {
+            "Composer": self._build_composer_tab,
+            "Outbox": self._build_outbox_tab,
+            "History": self._build_history_tab,
+            "Templates": self._build_templates_tab,
+            "System Log": self._build_log_tab,
+        }
 
         # Dashboard
         dash = tabs.tab("Dashboard")
@@ -316,8 +554,59 @@ class AutoMailCTKApp(ctk.CTk):
         self.lbl_last_check = ctk.CTkLabel(info_frame, text="Last check: N/A", font=ctk.CTkFont(size=12))
         self.lbl_last_check.grid(row=0, column=1, padx=12, pady=12, sticky="e")
 
-        # Composer
-        composer = tabs.tab("Composer")
+        self.lbl_imap_reconnects = ctk.CTkLabel(info_frame, text="IMAP reconnects: 0", font=ctk.CTkFont(size=12))
+        self.lbl_imap_reconnects.grid(row=1, column=0, padx=12, pady=(0, 12), sticky="w")
+
+        self.lbl_session_age = ctk.CTkLabel(info_frame, text="IMAP session: not connected", font=ctk.CTkFont(size=12))
+        self.lbl_session_age.grid(row=1, column=1, padx=12, pady=(0, 12), sticky="e")
+
+        self.lbl_smtp_pool = ctk.CTkLabel(info_frame, text="SMTP connections opened: 0", font=ctk.CTkFont(size=12))
+        self.lbl_smtp_pool.grid(row=2, column=0, padx=12, pady=(0, 12), sticky="w")
+
+        self.lbl_quota = ctk.CTkLabel(info_frame, text="Send quota: not logged in", font=ctk.CTkFont(size=12))
+        self.lbl_quota.grid(row=2, column=1, padx=12, pady=(0, 12), sticky="e")
+
+        self.lbl_pipeline = ctk.CTkLabel(info_frame, text="Pipeline: idle", font=ctk.CTkFont(size=12))
+        self.lbl_pipeline.grid(row=3, column=0, columnspan=2, padx=12, pady=(0, 12), sticky="w")
+
+        # Metrics (per-phase latency)
+        ctk.CTkLabel(dash, text="Metrics", font=ctk.CTkFont(size=14, weight="bold")).pack(anchor="w", pady=(12, 4), padx=12)
+        metrics_frame = ctk.CTkFrame(dash)
+        metrics_frame.pack(padx=12, pady=6, fill="x")
+        self.lbl_metrics = ctk.CTkLabel(metrics_frame, text="No activity yet", font=ctk.CTkFont(family="Courier", size=11), justify="left")
+        self.lbl_metrics.pack(anchor="w", padx=12, pady=8)
+
+        # Accounts (multi-account asyncio engine)
+        ctk.CTkLabel(dash, text="Accounts", font=ctk.CTkFont(size=14, weight="bold")).pack(anchor="w", pady=(12, 4), padx=12)
+        acct_frame = ctk.CTkFrame(dash)
+        acct_frame.pack(padx=12, pady=6, fill="x")
+        acct_frame.grid_columnconfigure(2, weight=1)
+
+        ctk.CTkButton(acct_frame, text="📂 Load Accounts…", width=160, command=self._on_accounts_pick_file).grid(row=0, column=0, padx=12, pady=(12, 6), sticky="w")
+        self.btn_accounts = ctk.CTkButton(acct_frame, text="▶ Start Accounts", width=160, command=self._on_accounts_toggle)
+        self.btn_accounts.grid(row=0, column=1, padx=(0, 12), pady=(12, 6), sticky="w")
+        self.account_var = tk.StringVar(value="No accounts loaded")
+        self.account_optionmenu = ctk.CTkOptionMenu(acct_frame, variable=self.account_var, values=["No accounts loaded"],
+                                                    width=260, command=lambda val: self._refresh_accounts(reschedule=False))
+        self.account_optionmenu.grid(row=0, column=2, padx=12, pady=(12, 6), sticky="e")
+
+        self.lbl_account_stats = ctk.CTkLabel(acct_frame, text="", font=ctk.CTkFont(size=12), justify="left")
+        self.lbl_account_stats.grid(row=1, column=0, columnspan=3, padx=12, pady=(0, 12), sticky="w")
+
+    def _on_tab_changed(self):
+        self._ensure_tab(self._tabs.get())
+
+    def _ensure_tab(self, name):
+        """Builds tab `name` the first time it is opened (only the Dashboard is built with the window)."""
+        build = self._tab_builders.pop(name, None)
+        if build is not None:
+            with STARTUP.section(f"{name} tab"):
+                build(self._tabs.tab(name))
+
+    def _tab_built(self, name) -> bool:
+        return name not in self._tab_builders
+
+    def _build_composer_tab(self, composer):
         ctk.CTkLabel(composer, text="Send Greeting", font=ctk.CTkFont(size=13, weight="bold")).pack(anchor="w", padx=12, pady=(8, 6))
 
         form = ctk.CTkFrame(composer)
@@ -332,34 +621,127 @@ class AutoMailCTKApp(ctk.CTk):
         self.entry_recipient_email.grid(row=3, column=0, padx=12, pady=(0, 8), sticky="w")
 
         ctk.CTkLabel(form, text="Template", font=ctk.CTkFont(size=11)).grid(row=4, column=0, padx=12, pady=(6, 4), sticky="w")
-        self.template_optionmenu = ctk.CTkOptionMenu(form, values=list(GREETING_TEMPLATES.keys()), width=520)
-        self.template_optionmenu.set(list(GREETING_TEMPLATES.keys())[0])
+        greeting_names = self._templates.greeting_names()
+        self.template_optionmenu = ctk.CTkOptionMenu(form, values=greeting_names, width=520)
+        self.template_optionmenu.set(greeting_names[0])
         self.template_optionmenu.grid(row=5, column=0, padx=12, pady=(0, 8), sticky="w")
 
         send_btn = ctk.CTkButton(form, text="📧 Send Greeting", width=220, command=self._on_send_greeting)
         send_btn.grid(row=6, column=0, padx=12, pady=(8, 16), sticky="w")
 
-        # Templates
-        templates = tabs.tab("Templates")
+        # Bulk (mail merge)
+        ctk.CTkLabel(composer, text="Bulk Send (CSV / JSONL: email, name, template)", font=ctk.CTkFont(size=13, weight="bold")).pack(anchor="w", padx=12, pady=(12, 6))
+        bulk = ctk.CTkFrame(composer)
+        bulk.pack(padx=12, pady=6, fill="x")
+        bulk.grid_columnconfigure(1, weight=1)
+
+        ctk.CTkButton(bulk, text="📂 Load Recipients…", width=180, command=self._on_bulk_pick_file).grid(row=0, column=0, padx=12, pady=(12, 6), sticky="w")
+        self.lbl_bulk_file = ctk.CTkLabel(bulk, text="No file loaded", font=ctk.CTkFont(size=11))
+        self.lbl_bulk_file.grid(row=0, column=1, padx=12, pady=(12, 6), sticky="w")
+
+        self.btn_bulk = ctk.CTkButton(bulk, text="🚀 Start Bulk Send", width=180, command=self._on_bulk_toggle)
+        self.btn_bulk.grid(row=1, column=0, padx=12, pady=6, sticky="w")
+        self.bulk_progress = ctk.CTkProgressBar(bulk)
+        self.bulk_progress.set(0)
+        self.bulk_progress.grid(row=1, column=1, padx=12, pady=6, sticky="we")
+
+        self.lbl_bulk_stats = ctk.CTkLabel(bulk, text="", font=ctk.CTkFont(size=11))
+        self.lbl_bulk_stats.grid(row=2, column=0, columnspan=2, padx=12, pady=(0, 12), sticky="w")
+
+        # Bind template selection
+        self.template_optionmenu.configure(command=lambda val: self._update_template_preview(val))
+
+    def _build_outbox_tab(self, outbox):
+        # spooled mail, dead letters
+        ctk.CTkLabel(outbox, text="Outbox", font=ctk.CTkFont(size=13, weight="bold")).pack(anchor="w", padx=12, pady=(8, 6))
+        outbox_bar = ctk.CTkFrame(outbox)
+        outbox_bar.pack(padx=12, pady=6, fill="x")
+        self.lbl_outbox = ctk.CTkLabel(outbox_bar, text="Not logged in", font=ctk.CTkFont(size=12))
+        self.lbl_outbox.grid(row=0, column=0, columnspan=2, padx=12, pady=(12, 6), sticky="w")
+        ctk.CTkButton(outbox_bar, text="🔁 Retry Dead Letters", width=180, command=self._on_retry_dead_letters).grid(row=1, column=0, padx=12, pady=(0, 12), sticky="w")
+        ctk.CTkButton(outbox_bar, text="🗑 Discard Dead Letters", width=180, fg_color="#ef4444", hover_color="#f87171", command=self._on_discard_dead_letters).grid(row=1, column=1, padx=(0, 12), pady=(0, 12), sticky="w")
+        self.txt_dead_letters = tk.Text(outbox, height=14, wrap="none", bg="#07101a", fg="#dbeafe", insertbackground="#dbeafe")
+        self.txt_dead_letters.pack(padx=12, pady=8, fill="both", expand=True)
+        self._refresh_outbox(force=True)
+
+    def _build_history_tab(self, history):
+        # every handled message, searchable (synapse_history)
+        ctk.CTkLabel(history, text="History", font=ctk.CTkFont(size=13, weight="bold")).pack(anchor="w", padx=12, pady=(8, 6))
+        search_bar = ctk.CTkFrame(history, fg_color="transparent")
+        search_bar.pack(padx=12, pady=(0, 6), fill="x")
+        search_bar.grid_columnconfigure(0, weight=1)
+        self.entry_history_search = ctk.CTkEntry(search_bar, placeholder_text="Search sender, subject, Message-ID, outcome… "
+                                                                              "(bob@exa finds addresses starting with it)")
+        self.entry_history_search.grid(row=0, column=0, sticky="we")
+        self.entry_history_search.bind("<KeyRelease>", lambda e: self._schedule_history_search())
+        self.lbl_history_count = ctk.CTkLabel(search_bar, text="", font=ctk.CTkFont(size=11))
+        self.lbl_history_count.grid(row=0, column=1, padx=(12, 0))
+        self.history_table = HistoryTable(history, self._history, on_select=self._show_history_row)
+        self.history_table.frame.pack(padx=12, pady=6, fill="both", expand=True)
+        self.lbl_history_row = ctk.CTkLabel(history, text="Select a message for its details", font=ctk.CTkFont(size=11),
+                                            justify="left", anchor="w", wraplength=760)
+        self.lbl_history_row.pack(anchor="w", padx=12, pady=(0, 8))
+        self._history_search_job = None
+        self._history_last_id = None
+        self._refresh_history()
+
+    def _schedule_history_search(self):
+        # search once typing pauses, not on every key
+        if self._history_search_job is not None:
+            self.after_cancel(self._history_search_job)
+        self._history_search_job = self.after(HISTORY_SEARCH_DELAY_MS, self._run_history_search)
+
+    def _run_history_search(self):
+        self._history_search_job = None
+        self.history_table.search(self.entry_history_search.get())
+        self._show_history_count()
+
+    def _refresh_history(self):
+        """Re-read the History tab if a new batch was indexed since it was last shown."""
+        last_id = self._history.last_id()
+        if last_id == self._history_last_id:
+            return
+        self._history_last_id = last_id
+        self.history_table.refresh()
+        self._show_history_count()
+
+    def _show_history_count(self):
+        total = self.history_table.total
+        self.lbl_history_count.configure(text=f"{total:,} message{'s' if total != 1 else ''}")
+
+    def _show_history_row(self, row):
+        def stamp(t):
+            return datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S') if t else "—"
+        text = (f"{row.sender} → {row.account} / {row.folder} (UID {row.uid})\n"
+                f"Subject: {row.subject or '(none)'}\nMessage-ID: {row.message_id or '(none)'}\n"
+                f"Received {stamp(row.received)} · replied {stamp(row.replied)}"
+                f"{' after ' + format_latency(row.latency) if row.latency is not None else ''} · {row.outcome}")
+        if row.detail:
+            text += f" — {row.detail}"
+        self.lbl_history_row.configure(text=text)
+
+    def _build_templates_tab(self, templates):
         ctk.CTkLabel(templates, text="Templates", font=ctk.CTkFont(size=13, weight="bold")).pack(anchor="w", padx=12, pady=(8, 6))
+        ctk.CTkLabel(templates, text=f"Edit live in {self._templates.directory} — greetings/<Name>.txt (.html), auto_reply.html; "
+                                     "placeholders: {name} {email} {sender} {phone} {subject} {excerpt} {date} {time}",
+                     font=ctk.CTkFont(size=11), wraplength=700, justify="left").pack(anchor="w", padx=12)
+        ctk.CTkButton(templates, text="🔄 Reload Templates", width=180, command=self._on_reload_templates).pack(anchor="w", padx=12, pady=(6, 0))
         self.txt_template_preview = tk.Text(templates, height=16, wrap="word", bg="#07101a", fg="#dbeafe", insertbackground="#dbeafe")
         self.txt_template_preview.pack(padx=12, pady=8, fill="both", expand=True)
         self._update_template_preview()
 
-        # System Log
-        syslog = tabs.tab("System Log")
+    def _build_log_tab(self, syslog):
         ctk.CTkLabel(syslog, text="System Log", font=ctk.CTkFont(size=13, weight="bold")).pack(anchor="w", padx=12, pady=(8, 6))
         self.txt_log = tk.Text(syslog, height=18, wrap="none", bg="#05060a", fg="#d6e3ff", insertbackground="#d6e3ff")
         self.txt_log.pack(padx=12, pady=8, fill="both", expand=True)
 
-        # Bind template selection
-        self.template_optionmenu.configure(command=lambda val: self._update_template_preview(val))
-
     # -------------------
     # Login
     # -------------------
     def _do_login(self):
         dlg = CTKLoginDialog(self)
+        if STARTUP.enabled:
+            self._report_startup()
         creds = dlg.show()
         if not creds:
             # user cancelled -> quit app cleanly
@@ -368,11 +750,38 @@ class AutoMailCTKApp(ctk.CTk):
 
         # creds is (email, password, phone)
         self.email_address, self.email_password, self.phone_number = creds
+        from synapse_quota import governor_for
+        from synapse_smtp import SmtpPool
+        from synapse_spool import OutboundSpool, SpoolSender
+        from synapse_store import RepliedStore
+        self._smtp_pool = SmtpPool(SMTP_HOST, SMTP_PORT, self.email_address, self.email_password,
+                                   size=self.smtp_pool_size, metrics=self.metrics, ssl_context=client_ssl_context())
+        self._replied = RepliedStore(data_path("replied.sqlite3"), self.email_address,
+                                     default_cooldown=self.reply_cooldown_seconds)
+        self._spool = OutboundSpool(data_path("outbox.sqlite3"), self.email_address)
+        self._governor = governor_for(self.email_address, self.send_limits, log=self._push_log, metrics=self.metrics)
+        self._outbox = SpoolSender(self._spool, self._smtp_pool.send, workers=self.smtp_pool_size,
+                                   log=self._push_log, metrics=self.metrics, on_sent=self._on_spool_sent,
+                                   governor=self._governor)
+        self._outbox.start()
+        waiting = self._spool.counts()
         phone_display = f"\nPhone: {self.phone_number}" if self.phone_number else ""
         self.lbl_logged_in.configure(text=f"Logged in as:\n{self.email_address}{phone_display}")
         self._push_log("✓ Login successful")
+        if waiting["queued"]:
+            self._push_log(f"📤 {waiting['queued']} message(s) left in the outbox — sending")
+        if waiting["dead"]:
+            self._push_log(f"⚠ {waiting['dead']} dead letter(s) in the outbox (see the Outbox tab)")
         self._push_log("Ready. Start the auto-responder when ready.")
 
+    def _report_startup(self):
+        self.update_idletasks()  # the dialog is on screen once pending geometry / map events are handled
+        STARTUP.mark("login dialog shown")
+        report = STARTUP.report()
+        print(report, flush=True)
+        for line in report.splitlines():
+            self._push_log(line)
+
     # -------------------
     # Interval change
     # -------------------
@@ -381,8 +790,39 @@ class AutoMailCTKApp(ctk.CTk):
             self.check_interval_seconds = int(float(val))
         except Exception:
             self.check_interval_seconds = DEFAULT_CHECK_INTERVAL
+        for watch in self._watches:
+            watch.scheduler.set_interval(self.check_interval_seconds)
         self.interval_value_label.configure(text=str(self.check_interval_seconds))
 
+    def _on_adaptive_toggled(self):
+        self.adaptive_checks = bool(self.adaptive_var.get())
+        for watch in self._watches:
+            watch.scheduler.set_adaptive(self.adaptive_checks)
+
+    def _on_check_now(self):
+        if not self._worker_thread or not self._worker_thread.is_alive():
+            messagebox.showinfo("Not running", "Start the auto-responder first.")
+            return
+        polling = [watch for watch in self._watches if not watch.pushing]
+        if not polling:
+            self._push_log("ℹ Push mode is active — new mail is handled as soon as it arrives")
+            return
+        for watch in polling:
+            watch.scheduler.check_now()
+
+    def _wake_watches(self):
+        """Let every folder thread notice the stop event right away."""
+        for watch in self._watches:
+            watch.scheduler.wake()
+
+    def _on_idle_toggled(self):
+        # takes effect the next time the worker (re)opens its session
+        self.use_idle = bool(self.idle_var.get())
+
+    def _on_keyword_toggled(self):
+        self.reply_flag = AUTO_REPLIED_KEYWORD if self.keyword_var.get() else SEEN_FLAG
+        self._keyword_warned = False
+
     # -------------------
     # Start / Stop
     # -------------------
@@ -393,6 +833,21 @@ class AutoMailCTKApp(ctk.CTk):
                 messagebox.showerror("Not logged in", "Please login first.")
                 return
 
+            folders = parse_folders(self.entry_folders.get())
+            if folders != self.folders:
+                self.folders = folders
+                self._push_log(f"📁 Watching {', '.join(folders)}")
+            if not self._apply_send_limits():
+                return
+            try:
+                bounds = parse_interval_bounds(self.entry_interval_bounds.get())
+            except ValueError as e:
+                messagebox.showerror("Invalid adaptive range", str(e))
+                return
+            if bounds != self.check_interval_bounds:
+                self.check_interval_bounds = bounds
+                self._push_log(f"🧠 Check interval adapts within {bounds[0]}–{bounds[1]}s")
+
             # clear stop event and start thread
             self._stop_event.clear()
             self._worker_thread = threading.Thread(target=self._worker_loop, daemon=True)
@@ -402,9 +857,26 @@ class AutoMailCTKApp(ctk.CTk):
         else:
             # request stop
             self._stop_event.set()
+            self._wake_watches()
             self._set_status_running(False)
             self._push_log("⏸ Stop requested — waiting for worker to exit")
 
+    def _apply_send_limits(self) -> bool:
+        """Read the sidebar's send limits into the account's governor; False (and an error box) if invalid."""
+        from synapse_quota import parse_send_limits
+        try:
+            limits = parse_send_limits(self.entry_send_limits.get() or None)
+        except ValueError as e:
+            messagebox.showerror("Invalid send limits", str(e))
+            return False
+        if limits != self.send_limits:
+            self.send_limits = limits
+            shown = ", ".join(f"{limit or 'no limit'} per {name}" for name, limit in limits.items())
+            self._push_log(f"⏳ Send limits: {shown}")
+        if self._governor is not None:
+            self._governor.set_limits(limits)
+        return True
+
     def _set_status_running(self, running: bool):
         if running:
             self.status_label.configure(text="Status: RUNNING", text_color="#34d399")
@@ -421,21 +893,51 @@ class AutoMailCTKApp(ctk.CTk):
     # -------------------
     def _worker_loop(self):
         """
-        Worker that periodically checks inbox. Uses _stop_event to exit cleanly.
+        Worker that watches every configured folder concurrently: one thread per
+        folder waits for new mail (IDLE push, or periodic polling as fallback)
+        on the folder's own session, all feeding the shared pipeline.
+        Uses _stop_event to exit cleanly.
         """
-        while not self._stop_event.is_set():
-            # schedule logging onto main thread (safe)
-            self._push_log("🔍 Checking inbox…")
-            try:
-                self._check_inbox_once()
-            except Exception as e:
-                self._push_log(f"❌ Worker error: {e}")
-            # wait with early exit ability
-            total = max(1, int(getattr(self, "check_interval_seconds", DEFAULT_CHECK_INTERVAL)))
-            for _ in range(total):
-                if self._stop_event.is_set():
-                    break
-                time.sleep(1)
+        # every IMAP connection of the account counts against the provider's limit; the commit
+        # session keeps one outside the folders' budget so flagging never waits behind a fetch
+        # that is itself waiting for the pipeline to drain
+        from synapse_filter import MailFilter
+        from synapse_imap import ConnectionBudget
+
+        self._sync_checkpoint()
+        budget = ConnectionBudget(max(1, self.max_imap_connections - 1))
+        folders = list(self.folders)
+        self._imap_commit = self._new_session(folders[0], None, self._push_log)
+        dedicated = dedicated_sessions(len(folders), budget.limit, reserved=0)
+        watches = []
+        for index, mailbox in enumerate(folders):
+            prefix = f"[{mailbox}] " if len(folders) > 1 else ""
+            log = (lambda text, prefix=prefix: self._push_log(prefix + text))
+            scheduler = CheckScheduler(self.check_interval_seconds, *self.check_interval_bounds,
+                                       adaptive=self.adaptive_checks, stop_event=self._stop_event, metrics=self.metrics)
+            watches.append(FolderWatch(mailbox, self._new_session(mailbox, budget, log), scheduler,
+                                       dedicated=index < dedicated, log=log))
+        self._watches = watches
+        if dedicated < len(folders):
+            self._push_log(f"⚠ {len(folders)} folders but only {self.max_imap_connections} IMAP connections — "
+                           f"{len(folders) - dedicated} folder(s) take turns polling on a shared one")
+        self._commit_batch = []
+        self._filter = MailFilter([self.email_address], since_days=self.reply_since_days,
+                                  ignore_senders=self.ignore_senders, server_side=self.filter_server_side)
+        self._load_rules()
+        self._pipeline = self._build_pipeline()
+        self._pipeline.start()
+        try:
+            for watch in watches:
+                watch.thread = threading.Thread(target=self._watch_folder, args=(watch,), daemon=True,
+                                                name=f"folder-{watch.mailbox}")
+                watch.thread.start()
+            for watch in watches:
+                watch.thread.join()
+        finally:
+            # queued items are dropped; their UIDs stay above the checkpoint and are retried next run
+            self._pipeline.stop()
+            self._imap_commit.close()
         # worker exiting
         self._push_log("🛑 Worker exited cleanly")
         # ensure UI shows stopped (schedule on main thread)
@@ -443,108 +945,583 @@ class AutoMailCTKApp(ctk.CTk):
         # clear worker reference
         self._worker_thread = None
 
+    def _new_session(self, mailbox, budget, log):
+        from synapse_imap import ImapSession
+        return ImapSession(IMAP_HOST, self.email_address, self.email_password, mailbox=mailbox,
+                           stop_event=self._stop_event, log=log, metrics=self.metrics,
+                           port=IMAP_PORT, ssl_context=client_ssl_context(), budget=budget)
+
+    def _watch_folder(self, watch):
+        """One folder's loop (its own thread): IDLE on a dedicated session, otherwise poll on its schedule."""
+        from synapse_imap import CONNECTION_ERRORS
+        idle_ok = self.use_idle and watch.dedicated
+        try:
+            while not self._stop_event.is_set():
+                if idle_ok and self.use_idle:
+                    try:
+                        idle_ok = self._idle_session(watch)
+                    except CONNECTION_ERRORS as e:
+                        watch.session.invalidate(str(e))
+                    except Exception as e:
+                        watch.log(f"❌ IDLE session error: {e}")
+                        watch.session.invalidate()
+                        idle_ok = False
+                    finally:
+                        watch.pushing = False
+                    continue
+
+                # schedule logging onto main thread (safe)
+                watch.log(f"🔍 Checking {watch.mailbox}…")
+                found = 0
+                watch.throttled = False
+                try:
+                    found = self._check_inbox_once(watch)
+                except Exception as e:
+                    watch.log(f"❌ Worker error: {e}")
+                if not watch.dedicated:
+                    watch.session.close()  # hand the shared connection to the next folder
+                if watch.throttled:
+                    watch.log("🐢 Server is throttling — checking less often")
+                watch.scheduler.record(found, throttled=watch.throttled)
+                # sleeps until the next check is due, "Check Now", an interval change or stop
+                if watch.scheduler.wait() == WAKE_MANUAL:
+                    watch.log("🔄 Manual check requested")
+        finally:
+            watch.session.close()
+
+    # -------------------
+    # IDLE push session
+    # -------------------
+    def _idle_session(self, watch):
+        """
+        Idle on the folder's session and process mail as soon as the server pushes
+        EXISTS/RECENT. Returns False when the server does not advertise IDLE so
+        the folder falls back to polling; returns True on stop or mode switch.
+        Connection errors propagate so the caller can drop the session.
+        """
+        from synapse_imap import IDLE_REFRESH_SECONDS, has_new_mail, idle_wait, supports_idle
+        if not self.email_address or not self.email_password:
+            return True
+        mail = watch.session.ensure()
+        if mail is None:
+            return True
+        if not supports_idle(mail):
+            watch.log("ℹ Server does not support IDLE — falling back to polling")
+            return False
+        watch.log("⚡ Push mode active — waiting for new mail")
+        watch.pushing = True
+
+        # catch up on anything that arrived while we were not idling
+        self._process_new_mail(watch, mail)
+        while not self._stop_event.is_set() and self.use_idle:
+            if mail.untagged_responses.pop("EXISTS", None):
+                # announced in a SEARCH/FETCH response during the last pass; IDLE will not repeat it
+                self._process_new_mail(watch, mail)
+                continue
+            responses = idle_wait(mail, IDLE_REFRESH_SECONDS, self._stop_event)
+            watch.session.touch()
+            if self._stop_event.is_set():
+                break
+            if has_new_mail(responses):
+                watch.log("📬 New mail pushed by server")
+                self._process_new_mail(watch, mail)
+        return True
+
     # -------------------
     # Check inbox once
     # -------------------
-    def _check_inbox_once(self):
+    def _check_inbox_once(self, watch):
         """
-        One-shot inbox check. Runs inside worker thread.
+        One-shot check of one folder. Runs inside the folder's thread.
+        Returns the number of new messages found (for the scheduler).
         """
-        with self._lock:
-            try:
-                mail = imaplib.IMAP4_SSL("imap.gmail.com")
-                # if credentials were cleared mid-check, bail out early
-                if not self.email_address or not self.email_password:
-                    try:
-                        mail.logout()
-                    except Exception:
-                        pass
-                    return
-                mail.login(self.email_address, self.email_password)
-                mail.select("inbox")
-                status, data = mail.search(None, "UNSEEN")
-                if status != 'OK':
-                    self.after(0, lambda: self._push_log(f"⚠ IMAP search failed: {status}"))
-                    mail.logout()
-                    return
-
-                id_list = data[0].split()
-                if not id_list:
-                    self.after(0, lambda: self._push_log("📭 No new messages"))
-                    mail.logout()
-                    self.after(0, lambda: self.lbl_last_check.configure(text=f"Last check: {datetime.now().strftime('%H:%M:%S')}"))
-                    return
-
-                for eid in id_list:
-                    if self._stop_event.is_set():
-                        break
-                    try:
-                        status, msg_data = mail.fetch(eid, "(RFC822)")
-                        if status != 'OK':
-                            self.after(0, lambda eid=eid: self._push_log(f"⚠ Failed to fetch id {eid}"))
-                            continue
-
-                        raw_msg = email.message_from_bytes(msg_data[0][1])
-                        sender_hdr = raw_msg.get("From", "")
-                        sender_email = email.utils.parseaddr(sender_hdr)[1]
-
-                        if sender_email:
-                            if sender_email in self.replied_to:
-                                self.after(0, lambda se=sender_email: self._push_log(f"⏭ Already replied to {se}"))
-                            else:
-                                # send reply synchronously in worker (so we don't spawn too many threads)
-                                self._send_auto_reply_internal(sender_email)
-                        else:
-                            self.after(0, lambda: self._push_log(f"⚠ Could not parse sender from: {sender_hdr}"))
-
-                        mail.store(eid, '+FLAGS', '\\Seen')
-                    except Exception as e:
-                        self.after(0, lambda e=e: self._push_log(f"⚠ Error processing message: {e}"))
-                try:
-                    mail.close()
-                except Exception:
-                    pass
-                mail.logout()
-                self.after(0, lambda: self.lbl_last_check.configure(text=f"Last check: {datetime.now().strftime('%H:%M:%S')}"))
-            except Exception as e:
-                # Log on main thread
-                self.after(0, lambda: self._push_log(f"❌ Inbox error: {e}"))
+        from synapse_imap import CONNECTION_ERRORS, is_throttled
+        session = watch.session
+        try:
+            # if credentials were cleared mid-check, bail out early
+            if not self.email_address or not self.email_password:
+                return 0
+            mail = session.ensure()
+            if mail is None:
+                return 0
+            found = self._process_new_mail(watch, mail)
+            session.touch()
+            return found
+        except CONNECTION_ERRORS as e:
+            # session is dead; the next cycle reconnects with backoff
+            watch.throttled = watch.throttled or is_throttled(e)
+            session.invalidate(str(e))
+        except Exception as e:
+            # Log on main thread
+            watch.throttled = watch.throttled or is_throttled(e)
+            watch.log(f"❌ Folder error: {e}")
+        return 0
+
+    def _load_rules(self):
+        from synapse_rules import RuleSet, load_rules
+        try:
+            self._rules = load_rules()
+        except (OSError, ValueError) as e:
+            self._push_log(f"⚠ Routing rules not loaded: {e}")
+            self._rules = RuleSet()
+            return
+        if self._rules:
+            scanned = f", {self._rules.unindexed} checked one by one" if self._rules.unindexed else ""
+            self._push_log(f"🧭 {len(self._rules)} routing rules loaded{scanned}")
+            for name in self._rules.templates:
+                if not self._templates.has_reply(name):
+                    self._push_log(f"⚠ Rule template '{name}' not found in replies/ — using the default reply")
+
+    def _wants_excerpt(self) -> bool:
+        templates = [self._templates.auto_reply()] + [self._templates.reply(n) for n in self._rules.templates]
+        return any("excerpt" in t.fields for t in templates)
+
+    def _process_new_mail(self, watch, mail):
+        """
+        Fetch stage: find new messages in the watched folder and feed their
+        headers into the pipeline (blocks while the pipeline is full).
+        Incremental: only UIDs above the persisted checkpoint / in-run cursor are
+        searched (UID n+1:*), so a cycle costs O(new mail) and restarts resume where
+        they stopped. Without a valid checkpoint (first run, UIDVALIDITY change) the
+        UNSEEN messages are handled once and the checkpoint starts at UIDNEXT.
+        Only the relevant header fields are fetched, fetch_chunk_size UIDs per round trip;
+        body text only when the reply template uses {excerpt} (see synapse_body).
+        Returns the number of new messages found.
+        """
+        from synapse_body import fetch_text_previews
+        from synapse_imap import HEADER_FETCH_ITEMS, chunked, compress_uid_set, is_throttled, parse_header_fetch
+        session = watch.session
+        mail.untagged_responses.pop("EXISTS", None)  # this pass covers everything announced so far
+        cp_key = f"{self.email_address}:{session.mailbox}"
+        cp = self._checkpoint.get(cp_key)
+        tracker = watch.tracker
+        if tracker is not None and tracker.uidvalidity != session.uidvalidity:
+            tracker = None
+        if cp is not None and cp.get("uidvalidity") != session.uidvalidity:
+            watch.log("⚠ UIDVALIDITY changed — resyncing from unread messages")
+            self._checkpoint.reset(cp_key)
+            cp = None
+            tracker = None
+
+        fresh_select, session.fresh_select = session.fresh_select, False
+        if (cp is not None and fresh_select and session.highestmodseq is not None
+                and cp.get("highestmodseq") == session.highestmodseq
+                and (tracker is None or tracker.settled())):
+            # CONDSTORE: nothing at all changed since we were last caught up
+            watch.log("📭 No new messages (mailbox unchanged)")
+            self.after(0, lambda: self.lbl_last_check.configure(text=f"Last check: {datetime.now().strftime('%H:%M:%S')}"))
+            return 0
+
+        first_sync = tracker is None and cp is None
+        if tracker is None:
+            tracker = UidTracker(cp["last_uid"] if cp is not None else 0, key=cp_key, mailbox=session.mailbox,
+                                 uidvalidity=session.uidvalidity, partial_ok=not first_sync)
+            watch.tracker = tracker
+
+        if first_sync:
+            # answered mail stays unread in keyword mode, so skip what already carries the keyword
+            base = "UNSEEN" if self.reply_flag == SEEN_FLAG else f"UNSEEN UNKEYWORD {self.reply_flag}"
+        else:
+            base = f"UID {tracker.cursor + 1}:*"
+        self.metrics.inc("sync_cycles")
+        with self.metrics.timer("imap_search"):
+            status, data = mail.uid("SEARCH", None, self._filter.search_criteria(base))
+        if status != 'OK' and self._filter.server_side and not is_throttled(data):
+            watch.log("⚠ Server rejected the filtered SEARCH — filtering headers locally")
+            self._filter.server_side = False
+            with self.metrics.timer("imap_search"):
+                status, data = mail.uid("SEARCH", None, self._filter.search_criteria(base))
+        if status != 'OK':
+            watch.log(f"⚠ IMAP search failed: {status}")
+            watch.throttled = watch.throttled or is_throttled(data)
+            return 0
+
+        # "n:*" always matches the highest UID, even when it is below n
+        new_uids = [uid for uid in (int(u) for u in data[0].split()) if first_sync or uid > tracker.cursor]
+        uid_list = sorted(set(tracker.retries()) | set(new_uids))
+        complete = True  # every listed message handed to the pipeline
+        for chunk in chunked(uid_list, self.fetch_chunk_size):
+            if self._stop_event.is_set():
+                complete = False
+                break
+            uid_set = compress_uid_set(chunk)
+            with self.metrics.timer("imap_fetch"):
+                status, fetch_data = mail.uid("FETCH", uid_set, HEADER_FETCH_ITEMS)
+            if status != 'OK':
+                watch.log(f"⚠ Failed to fetch UIDs {uid_set}")
+                watch.throttled = watch.throttled or is_throttled(fetch_data)
+                complete = False
+                break
+
+            with self.metrics.timer("parse"):
+                fetched = parse_header_fetch(fetch_data)
+            self.metrics.inc("messages_fetched", len(fetched))
+            previews = {}
+            if self._wants_excerpt():
+                # the reply quotes the message: read its text part only, capped, never the attachments
+                with self.metrics.timer("imap_fetch_body"):
+                    previews = fetch_text_previews(mail, [uid for uid, _ in fetched], metrics=self.metrics)
+            for uid in set(chunk) - {uid for uid, _ in fetched}:
+                tracker.forget(uid)  # expunged since the search
+            for uid, headers in fetched:
+                tracker.submitted(uid)
+                item = InboundMessage(uid, headers, tracker, previews.get(uid, ""))
+                if not self._pipeline.submit(item, self._stop_event):
+                    complete = False
+                    break
+            if not complete:
+                break
+
+        if complete:
+            if first_sync:
+                # everything below UIDNEXT at SELECT time is now accounted for
+                tracker.advance_cursor((session.uidnext or 1) - 1)
+            tracker.modseq = session.highestmodseq
+            if not uid_list:
+                self._save_checkpoint(tracker, force=True)
+
+        if not uid_list:
+            watch.log("📭 No new messages")
+        self.after(0, lambda: self.lbl_last_check.configure(text=f"Last check: {datetime.now().strftime('%H:%M:%S')}"))
+        return len(new_uids)
 
     # -------------------
-    # Send auto-reply internal (called from worker thread)
+    # Pipeline stages (pipeline worker threads)
     # -------------------
-    def _send_auto_reply_internal(self, to_address):
-        if to_address in self.replied_to:
-            self.after(0, lambda: self._push_log(f"⏭ Already replied to {to_address}"))
+    def _build_pipeline(self):
+        workers = self.stage_workers
+        size = self.stage_queue_size
+        return Pipeline([
+            Stage("classify", self._stage_classify, workers.get("classify", 1), size),
+            Stage("render", self._stage_render, workers.get("render", 1), size),
+            Stage("send", self._stage_send, workers.get("send", 1), size),
+            Stage("commit", self._stage_commit, 1, size),
+        ], on_error=self._on_stage_error, name="responder")
+
+    def _stage_classify(self, item):
+        from email.utils import parseaddr
+        sender_hdr = item.headers.get("From", "")
+        item.sender = parseaddr(sender_hdr)[1]
+        if not item.sender:
+            self._push_log(f"⚠ Could not parse sender from: {sender_hdr}")
+            item.suppressed = True
+            item.outcome, item.detail = SUPPRESSED, "no sender address"
+            return item
+        reason = self._filter.suppress_reason(item.headers, item.sender)
+        if reason:
+            self.metrics.inc("messages_suppressed")
+            self._push_log(f"🚫 Not replying to {item.sender}: {reason}")
+            item.suppressed = True
+            item.outcome, item.detail = SUPPRESSED, reason
+            return item
+        item.rule = self._rules.match_message(item.headers, item.sender)
+        if item.rule is not None:
+            self.metrics.inc("rule_matches")
+            if not item.rule.reply:
+                self._push_log(f"🚫 Not replying to {item.sender}: {item.rule.describe()}")
+                item.suppressed = True
+                item.outcome, item.detail = NO_REPLY_RULE, item.rule.describe()
+                return item
+        key = item.sender.lower()
+        with self._inflight_lock:
+            if key in self._inflight_senders:
+                # a burst from one sender gets one reply: the one already on its way
+                self.metrics.inc("replies_coalesced")
+                self._push_log(f"🔗 {item.sender} wrote again — covered by the reply already queued")
+                item.outcome = COALESCED
+                return item
+            if self._replied.recently_replied(item.sender):
+                self._push_log(f"⏭ Already replied to {item.sender}")
+                item.outcome = ALREADY_REPLIED
+                return item
+            last = self._replied.last_replied(item.sender) if self.coalesce_seconds else None
+            if last is not None and time.time() - last < self.coalesce_seconds:
+                self.metrics.inc("replies_coalesced")
+                self._push_log(f"🔗 {item.sender} wrote again — answered {int(time.time() - last)}s ago, not replying twice")
+                item.outcome, item.detail = COALESCED, f"answered {int(time.time() - last)}s earlier"
+                return item
+            self._inflight_senders.add(key)
+        item.reply = True
+        return item
+
+    def _stage_render(self, item):
+        if item.reply:
+            item.msg = self._render_auto_reply(item.sender, item.headers, item.excerpt, item.rule)
+        return item
+
+    def _stage_send(self, item):
+        if item.reply:
+            try:
+                item.ok = self._send_auto_reply_internal(item.sender, item.msg,
+                                                         item.rule.cooldown if item.rule is not None else None)
+                item.outcome = REPLIED if item.ok else FAILED
+                item.replied_at = time.time() if item.ok else None
+            finally:
+                with self._inflight_lock:
+                    self._inflight_senders.discard(item.sender.lower())
+        return item
+
+    def _stage_commit(self, item):
+        # gather until the queue drains (or the batch is full), then flag them all in one round trip
+        self._commit_batch.append(item)
+        if len(self._commit_batch) >= COMMIT_BATCH_SIZE or self._pipeline.stages[-1].queue.empty():
+            self._flush_commits()
+        return None
+
+    def _flush_commits(self):
+        """
+        Flag every handled message of the batch with one ranged UID STORE per
+        folder. Items only get here after their reply was sent and recorded, so
+        a crash can leave answered mail unflagged (retried, then skipped as
+        already replied) but never flags unanswered mail. Suppressed
+        (bulk/automatic) mail is left as it was.
+        """
+        batch, self._commit_batch = self._commit_batch, []
+        by_tracker = {}
+        for item in batch:
+            by_tracker.setdefault(item.tracker, []).append(item)
+        for tracker, items in by_tracker.items():
+            stored = self._store_replied(tracker, [item.uid for item in items if item.ok and not item.suppressed])
+            for item in items:
+                tracker.finished(item.uid, item.ok and stored)
+                self._record_history(tracker, item)
+            self._save_checkpoint(tracker)
+
+    def _record_history(self, tracker, item):
+        self._history.record(self.email_address or "", tracker.mailbox or "", item.uid, item.sender, item.headers,
+                             item.outcome or FAILED, item.detail, item.replied_at)
+
+    def _store_replied(self, tracker, uids) -> bool:
+        """Flag `uids` in the tracker's folder; False if they stay unflagged (retried next cycle)."""
+        from synapse_imap import CONNECTION_ERRORS, store_flag
+        if not uids:
+            return True
+        session = self._imap_commit
+        try:
+            mail = session.switch(tracker.mailbox)
+            if mail is None:
+                return False
+            if session.uidvalidity != tracker.uidvalidity:
+                # the folder was rebuilt since the fetch: these UIDs may name other messages now
+                self._push_log(f"⚠ UIDVALIDITY of {tracker.mailbox} changed — not flagging {len(uids)} message(s)")
+                return False
+            with self.metrics.timer("imap_store"):
+                store_flag(mail, uids, self._effective_reply_flag())
+            session.touch()
+            return True
+        except CONNECTION_ERRORS as e:
+            session.invalidate(str(e))
+        except Exception as e:
+            self._push_log(f"⚠ Error flagging {len(uids)} message(s) in {tracker.mailbox}: {e}")
+        return False
+
+    def _effective_reply_flag(self):
+        flag = self.reply_flag
+        if flag != SEEN_FLAG and not self._imap_commit.accepts_keywords():
+            if not self._keyword_warned:
+                self._keyword_warned = True
+                self._push_log(f"⚠ Mailbox does not accept keywords — marking replies \\Seen instead of {flag}")
+            return SEEN_FLAG
+        return flag
+
+    def _on_stage_error(self, stage, item, exc):
+        self._push_log(f"⚠ Error processing message ({stage}): {exc}")
+        if item.reply:
+            with self._inflight_lock:
+                self._inflight_senders.discard(item.sender.lower())
+        item.tracker.finished(item.uid, ok=False)
+        item.outcome, item.detail = FAILED, f"{stage}: {exc}"
+        self._record_history(item.tracker, item)
+
+    def _sync_checkpoint(self):
+        """The SyncCheckpoint shared by the worker and the accounts engine, loaded on first use."""
+        with self._inflight_lock:
+            if self._checkpoint is None:
+                from synapse_imap import SyncCheckpoint
+                self._checkpoint = SyncCheckpoint(data_path("sync_checkpoint.json"))
+            return self._checkpoint
+
+    def _save_checkpoint(self, tracker, force=False):
+        """Persist the tracker's watermark (throttled unless `force`)."""
+        settled = tracker.settled()
+        if not settled and not tracker.partial_ok:
             return
+        now = time.monotonic()
+        if not force and not settled and now - self._checkpoint_saved_at < CHECKPOINT_SAVE_INTERVAL:
+            return
+        watermark = tracker.watermark()
+        if watermark == tracker.saved and not settled:
+            return
+        # HIGHESTMODSEQ is only meaningful once fully caught up
+        modseq = tracker.modseq if settled else None
+        self._checkpoint.update(tracker.key, uidvalidity=tracker.uidvalidity, last_uid=watermark, highestmodseq=modseq)
+        tracker.saved = watermark
+        if settled:
+            tracker.partial_ok = True
+        self._checkpoint_saved_at = now
+
+    # -------------------
+    # Auto-reply render / send (pipeline threads)
+    # -------------------
+    def _render_auto_reply(self, to_address, headers=None, excerpt="", rule=None):
+        from synapse_templates import reply_values
+        values = reply_values(headers, excerpt) if headers is not None else None
+        if rule is not None and rule.template:
+            template = self._templates.reply(rule.template)
+        else:
+            template = self._templates.auto_reply()
+        return self._reply_cache.render(self.email_address, to_address, self.phone_number, template, values, headers)
 
-        msg = MIMEMultipart("alternative")
-        msg['Subject'] = "Auto Reply"
-        msg['From'] = self.email_address
-        msg['To'] = to_address
+    def _send_auto_reply_internal(self, to_address, msg=None, cooldown=None):
+        """
+        Queue (and record) one auto-reply in the outbound spool; the SpoolSender
+        delivers it. Returns False if it could not be spooled and the message
+        should be retried, True if it is queued or not needed. `cooldown` (a
+        routing rule's) overrides the default before the sender is answered again.
+        """
+        from smtplib import SMTPServerDisconnected
+        if self._replied is None or self._replied.recently_replied(to_address):
+            self._push_log(f"⏭ Already replied to {to_address}")
+            return True
 
-        plain_text = ("Hi,\n\nThanks for your message – this is an automated reply "
-                      "to confirm we've received it.\n\nBest,\nA.Apiwish")
-        msg.attach(MIMEText(plain_text, "plain"))
-        # Use phone number in HTML reply; fallback to default if not set
-        phone_for_reply = self.phone_number or "000-000-0000"
-        html = AUTO_REPLY_HTML_TEMPLATE.format(phone=phone_for_reply)
-        msg.attach(MIMEText(html, "html"))
+        if msg is None:
+            msg = self._render_auto_reply(to_address)
 
         try:
-            with smtplib.SMTP_SSL("smtp.gmail.com", 465, timeout=20) as smtp:
-                smtp.login(self.email_address, self.email_password)
-                smtp.send_message(msg)
-            self.replied_to.add(to_address)
-            self.after(0, lambda: self._push_log(f"✓ Auto-reply sent to {to_address}"))
-            self.after(0, lambda: self.lbl_total_replies.configure(text=f"Replies sent: {len(self.replied_to)}"))
-            self.after(0, lambda: self.last_replied_var.set(f"Last replied: {to_address}"))
+            outbox = self._outbox
+            if outbox is None:
+                raise SMTPServerDisconnected("not logged in")
+            outbox.enqueue(msg, kind="reply")
+            self._replied.mark_replied(to_address, cooldown=cooldown)
+            self._push_log(f"📤 Auto-reply to {to_address} queued")
+            return True
         except Exception as e:
-            self.after(0, lambda: self._push_log(f"❌ ERROR auto-reply to {to_address}: {e}"))
+            self.metrics.inc("reply_errors")
+            self._push_log(f"❌ ERROR queueing auto-reply to {to_address}: {e}")
+            return False
+
+    def _on_spool_sent(self, entry):
+        # SpoolSender thread
+        to_address = ", ".join(entry.rcpts)
+        if entry.kind != "reply":
+            self._push_log(f"✓ {entry.kind.capitalize()} sent to {to_address}")
+            return
+        self.metrics.inc("replies_sent")
+        with self._inflight_lock:
+            self.replies_sent += 1
+            count = self.replies_sent
+        self._push_log(f"✓ Auto-reply sent to {to_address}")
+        self.after(0, lambda: self.lbl_total_replies.configure(text=f"Replies sent: {count}"))
+        self.after(0, lambda: self.last_replied_var.set(f"Last replied: {to_address}"))
+
+    # -------------------
+    # Session stats (UI thread, periodic)
+    # -------------------
+    def _refresh_session_stats(self):
+        watches = self._watches
+        if watches:
+            sessions = [watch.session for watch in watches]
+            self.lbl_imap_reconnects.configure(text=f"IMAP reconnects: {sum(s.reconnects for s in sessions)}")
+            ages = [int(s.session_age()) for s in sessions]
+            if len(sessions) > 1:
+                self.lbl_session_age.configure(text=f"IMAP folders connected: {sum(1 for age in ages if age)}/{len(ages)}")
+            elif ages[0]:
+                h, rem = divmod(ages[0], 3600)
+                self.lbl_session_age.configure(text=f"IMAP session age: {h}:{rem // 60:02d}:{rem % 60:02d}")
+            else:
+                self.lbl_session_age.configure(text="IMAP session: not connected")
+        pool = self._smtp_pool
+        if pool is not None:
+            stats = pool.stats()
+            self.lbl_smtp_pool.configure(text=f"SMTP connections opened: {stats['connects']} ({stats['open']} open)")
+        governor = self._governor
+        if governor is not None:
+            self.lbl_quota.configure(text=f"Send quota: {governor.describe()}")
+        self._refresh_outbox()
+        if self._tab_built("History") and self._tabs.get() == "History":
+            self._refresh_history()
+        intervals = sorted({int(watch.scheduler.interval) for watch in watches if watch.scheduler.adaptive})
+        base = int(watches[0].scheduler.base) if watches else self.check_interval_seconds
+        if intervals and intervals != [base]:
+            adapted = f"{intervals[0]}s" if len(intervals) == 1 else f"{intervals[0]}–{intervals[-1]}s"
+            self.interval_value_label.configure(text=f"{base} (adapted: {adapted})")
+        else:
+            self.interval_value_label.configure(text=str(base))
+        pipeline = self._pipeline
+        if pipeline is not None:
+            depths = " · ".join(f"{name}: {depth}" for name, depth in pipeline.depths().items())
+            self.lbl_pipeline.configure(text=f"Pipeline queues — {depths} · in flight: {pipeline.in_flight()}")
+        self._refresh_metrics()
+        self.after(1000, self._refresh_session_stats)
+
+    def _refresh_outbox(self, force=False):
+        if not self._tab_built("Outbox"):
+            return  # filled in when the tab is first opened
+        spool = self._spool
+        counts = spool.counts() if spool is not None else None
+        if counts == self._outbox_counts and not force:
+            return
+        self._outbox_counts = counts
+        if counts is None:
+            self.lbl_outbox.configure(text="Not logged in")
+            dead = []
+        else:
+            self.lbl_outbox.configure(text=f"Queued: {counts['queued']} · Sending: {counts['sending']} · "
+                                           f"Dead letters: {counts['dead']}")
+            dead = spool.dead_letters()
+        lines = [f"{'#':>6}  {'queued':<17}{'kind':<10}{'to':<32}{'tries':>5}  last error"]
+        for entry in dead:
+            queued = datetime.fromtimestamp(entry.queued).strftime('%Y-%m-%d %H:%M')
+            lines.append(f"{entry.id:>6}  {queued:<17}{entry.kind:<10}{', '.join(entry.rcpts):<32}"
+                         f"{entry.attempts:>5}  {entry.last_error}")
+        if not dead:
+            lines.append("No dead letters")
+        self.txt_dead_letters.delete("1.0", tk.END)
+        self.txt_dead_letters.insert(tk.END, "\n".join(lines))
+
+    def _on_retry_dead_letters(self):
+        if self._spool is None:
+            return
+        n = self._spool.requeue_dead()
+        if n:
+            self._outbox.resume()
+            self._push_log(f"🔁 {n} dead letter(s) queued again")
+        self._refresh_outbox(force=True)
+
+    def _on_discard_dead_letters(self):
+        if self._spool is None or not self._spool.counts()["dead"]:
+            return
+        if not messagebox.askyesno("Discard", "Delete every dead letter? They will not be sent."):
+            return
+        n = self._spool.discard_dead()
+        self._push_log(f"🗑 Discarded {n} dead letter(s)")
+        self._refresh_outbox(force=True)
+
+    def _refresh_metrics(self):
+        snap = self.metrics.snapshot()
+        phases = snap["phases"]
+        if not phases:
+            return
+        rows = [f"{'phase':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}"]
+        for name in PHASES + tuple(sorted(set(phases) - set(PHASES))):
+            p = phases.get(name)
+            if p is None:
+                continue
+            rows.append(f"{name:<14}{p['count']:>8}{p['p50'] * 1000:>10.1f}{p['p95'] * 1000:>10.1f}"
+                        f"{p['p99'] * 1000:>10.1f}{p['error_rate'] * 100:>8.1f}%")
+        counters = {**snap["counters"], **{k: round(v, 1) for k, v in snap["gauges"].items()}}
+        if counters:
+            rows.append("  ".join(f"{k}: {v}" for k, v in sorted(counters.items())))
+        self.lbl_metrics.configure(text="\n".join(rows))
 
     # -------------------
     # Manual greeting sender (UI thread triggers background worker)
     # -------------------
+    def _build_greeting_message(self, to_addr, recipient_name, template_name):
+        from synapse_templates import build_greeting
+        return build_greeting(self.email_address, to_addr, recipient_name, template_name,
+                              phone=self.phone_number or "", templates=self._templates)
+
     def _on_send_greeting(self):
         to_addr = self.entry_recipient_email.get().strip()
         if not to_addr:
@@ -556,65 +1533,244 @@ class AutoMailCTKApp(ctk.CTk):
 
         recipient_name = self.entry_recipient_name.get().strip() or "there"
         template_name = self.template_optionmenu.get()
-        template = GREETING_TEMPLATES.get(template_name, GREETING_TEMPLATES[list(GREETING_TEMPLATES.keys())[0]])
-        html_content = template.replace("\n", "<br>").format(name=recipient_name)
-        plain_content = template.format(name=recipient_name)
 
         def worker():
+            from smtplib import SMTPServerDisconnected
             try:
-                msg = MIMEMultipart("alternative")
-                msg['Subject'] = "Greeting from A.Apiwish"
-                msg['From'] = self.email_address
-                msg['To'] = to_addr
-                msg.attach(MIMEText(plain_content, "plain"))
-                msg.attach(MIMEText(html_content, "html"))
-
-                with smtplib.SMTP_SSL("smtp.gmail.com", 465, timeout=20) as smtp:
-                    smtp.login(self.email_address, self.email_password)
-                    smtp.send_message(msg)
-
-                self.after(0, lambda: self._push_log(f"✓ Greeting sent to {to_addr} ({recipient_name})"))
-                self.after(0, lambda: messagebox.showinfo("Success", f"Greeting email sent to {to_addr}!"))
+                msg = self._build_greeting_message(to_addr, recipient_name, template_name)
+
+                outbox = self._outbox
+                if outbox is None:
+                    raise SMTPServerDisconnected("not logged in")
+                outbox.enqueue(msg, kind="greeting")
+
+                self._push_log(f"📤 Greeting to {to_addr} ({recipient_name}) queued")
+                self.after(0, lambda: messagebox.showinfo("Queued", f"Greeting email to {to_addr} is on its way!"))
             except Exception as e:
-                self.after(0, lambda: self._push_log(f"❌ ERROR sending greeting: {e}"))
-                self.after(0, lambda: messagebox.showerror("Error", f"Failed to send email:\n{e}"))
+                self._push_log(f"❌ ERROR queueing greeting: {e}")
+                self.after(0, lambda err=e: messagebox.showerror("Error", f"Failed to queue email:\n{err}"))
 
         threading.Thread(target=worker, daemon=True).start()
 
+    # -------------------
+    # Bulk greetings (mail merge)
+    # -------------------
+    def _on_bulk_pick_file(self):
+        if self._bulk_job is not None and self._bulk_job.is_running():
+            return
+        path = filedialog.askopenfilename(
+            title="Recipients file",
+            filetypes=[("Recipient lists", "*.csv *.jsonl *.ndjson"), ("All files", "*.*")],
+        )
+        if not path:
+            return
+        from synapse_bulk import load_recipients
+        try:
+            recipients = load_recipients(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Invalid file", f"Could not read recipients:\n{e}")
+            return
+        self._bulk_path = path
+        self._bulk_job = self._new_bulk_job(recipients)
+        remaining = self._bulk_job.remaining()
+        self.lbl_bulk_file.configure(text=f"{os.path.basename(path)} — {len(recipients)} rows, {remaining} not yet sent")
+        self.bulk_progress.set(0)
+        self.lbl_bulk_stats.configure(text="")
+
+    def _new_bulk_job(self, recipients):
+        from smtplib import SMTPServerDisconnected
+        from synapse_bulk import BulkSendJob, progress_path_for
+        fallback_template = self.template_optionmenu.get()
+
+        def build(row):
+            if not is_valid_email(row["email"]):
+                raise ValueError(f"invalid email {row['email']!r}")
+            template_name = row["template"] if self._templates.has_greeting(row["template"]) else fallback_template
+            return self._build_greeting_message(row["email"], row["name"] or "there", template_name)
+
+        def send(msg):
+            pool = self._smtp_pool
+            if pool is None:
+                raise SMTPServerDisconnected("not logged in")
+            pool.send(msg)
+
+        return BulkSendJob(recipients, build, send, workers=self.bulk_workers,
+                           progress_path=progress_path_for(self._bulk_path, data_path("bulk")),
+                           log=self._push_log)
+
+    def _on_bulk_toggle(self):
+        job = self._bulk_job
+        if job is not None and job.is_running():
+            job.stop()
+            self._push_log("⏸ Bulk send stop requested — progress is saved, start again to resume")
+            return
+        if job is None:
+            messagebox.showerror("No recipients", "Load a CSV or JSONL recipients file first.")
+            return
+        if not self.email_address or not self.email_password:
+            messagebox.showerror("Not logged in", "Please login first.")
+            return
+
+        if job.started_at is not None:
+            # a finished or stopped job cannot be restarted; build a fresh one that resumes
+            job = self._bulk_job = self._new_bulk_job(job.recipients)
+        if job.remaining() == 0:
+            if not messagebox.askyesno("Already sent", "Every row in this file was already sent. Send to all of them again?"):
+                return
+            job.reset_progress()
+
+        if not self._apply_send_limits():
+            return
+        job.governor = self._governor
+        job.start()
+        self.btn_bulk.configure(text="⏹ Stop Bulk Send")
+        self._push_log(f"🚀 Bulk send started: {job.total} rows, {self.bulk_workers} workers")
+        self.after(500, self._refresh_bulk_progress)
+
+    def _refresh_bulk_progress(self):
+        job = self._bulk_job
+        if job is None:
+            return
+        snap = job.snapshot()
+        if snap["total"]:
+            self.bulk_progress.set(snap["done"] / snap["total"])
+        self.lbl_bulk_stats.configure(
+            text=(f"{snap['done']}/{snap['total']} done · {snap['sent']} sent · {snap['failed']} failed · "
+                  f"{snap['skipped']} skipped · {snap['resumed']} resumed · {snap['rate']:.1f} msg/s")
+        )
+        if snap["running"]:
+            self.after(500, self._refresh_bulk_progress)
+            return
+        self.btn_bulk.configure(text="🚀 Start Bulk Send")
+        verb = "stopped" if snap["stopped"] else "finished"
+        self._push_log(f"🏁 Bulk send {verb}: {snap['sent']} sent, {snap['failed']} failed, {snap['skipped']} skipped "
+                       f"in {snap['elapsed']:.1f}s")
+
+    # -------------------
+    # Multiple accounts (asyncio engine)
+    # -------------------
+    def _on_accounts_pick_file(self):
+        if self._engine is not None and self._engine.is_running():
+            messagebox.showinfo("Accounts running", "Stop the accounts before loading another file.")
+            return
+        path = filedialog.askopenfilename(title="Accounts file", filetypes=[("JSON", "*.json"), ("All files", "*.*")])
+        if path:
+            self._load_accounts(path)
+
+    def _load_accounts(self, path, quiet=False):
+        from synapse_async import load_accounts
+        try:
+            accounts = load_accounts(path)
+        except (OSError, ValueError) as e:
+            if quiet:
+                self._push_log(f"⚠ Could not load {os.path.basename(path)}: {e}")
+            else:
+                messagebox.showerror("Invalid file", f"Could not read accounts:\n{e}")
+            return
+        self._accounts = accounts
+        self._accounts_path = path
+        names = [a.name for a in accounts]
+        self.account_optionmenu.configure(values=names)
+        self.account_var.set(names[0])
+        self._push_log(f"📇 Loaded {len(accounts)} account(s) from {os.path.basename(path)}")
+        self._refresh_accounts(reschedule=False)
+
+    def _on_accounts_toggle(self):
+        engine = self._engine
+        if engine is not None and engine.is_running():
+            engine.stop()
+            self.btn_accounts.configure(text="▶ Start Accounts")
+            self._push_log("⏹ Stopping account monitors")
+            return
+        if not self._accounts:
+            messagebox.showerror("No accounts", "Load an accounts JSON file first.")
+            return
+        from synapse_async import AsyncEngine
+        self._engine = AsyncEngine(self._accounts, log=self._push_log, checkpoint=self._sync_checkpoint(),
+                                   fetch_chunk_size=self.fetch_chunk_size, history=self._history)
+        self._engine.start_in_thread()
+        self.btn_accounts.configure(text="⏹ Stop Accounts")
+        self._push_log(f"▶ Monitoring {len(self._accounts)} account(s) on one event loop")
+        self.after(1000, self._refresh_accounts)
+
+    def _refresh_accounts(self, reschedule=True):
+        engine = self._engine
+        selected = self.account_var.get()
+        snap = next((a for a in engine.snapshot() if a["name"] == selected), None) if engine is not None else None
+        if snap is None:
+            cfg = next((a for a in self._accounts if a.name == selected), None)
+            self.lbl_account_stats.configure(text=f"{cfg.email} — not running" if cfg else "")
+        else:
+            last = datetime.fromtimestamp(snap["last_check"]).strftime('%H:%M:%S') if snap["last_check"] else "N/A"
+            age = int(snap["session_age"])
+            text = (f"{snap['email']} — {snap['status']} · replies sent: {snap['replies_sent']} · last check: {last}\n"
+                    f"session age: {age // 3600}:{age % 3600 // 60:02d}:{age % 60:02d} · reconnects: {snap['reconnects']}\n"
+                    f"send quota: {snap['quota']}")
+            if snap["last_error"]:
+                text += f" · last error: {snap['last_error']}"
+            self.lbl_account_stats.configure(text=text)
+        if reschedule and engine is not None:
+            if engine.is_running():
+                self.after(1000, self._refresh_accounts)
+            else:
+                self.btn_accounts.configure(text="▶ Start Accounts")
+
     # -------------------
     # Template preview
     # -------------------
     def _update_template_preview(self, val=None):
-        selected = val or self.template_optionmenu.get()
-        text = GREETING_TEMPLATES.get(selected, "")
+        if not self._tab_built("Templates"):
+            return
+        if val:
+            selected = val
+        elif self._tab_built("Composer"):
+            selected = self.template_optionmenu.get()
+        else:
+            selected = self._templates.greeting_names()[0]
+        subject, plain, _ = self._templates.greeting(selected).sources
+        text = f"Subject: {subject}\n\n{plain}"
         self.txt_template_preview.delete("1.0", tk.END)
         self.txt_template_preview.insert(tk.END, text)
 
+    def _on_reload_templates(self):
+        """Pick up added/removed template files; edits to existing ones apply on their own."""
+        names = self._templates.greeting_names()
+        if self._tab_built("Composer"):
+            self.template_optionmenu.configure(values=names)
+            if self.template_optionmenu.get() not in names:
+                self.template_optionmenu.set(names[0])
+        self._update_template_preview()
+        self._push_log(f"📝 {len(names)} greeting templates available")
+
     # -------------------
     # Logging helper (UI thread safe)
     # -------------------
     def _push_log(self, text: str):
         """
-        Thread-aware logging helper. If called from a background thread,
-        schedule the log insertion on the main thread.
+        Thread-safe logging helper. Lines go to a ring buffer (and the log file);
+        the UI thread picks them up in batches in _flush_log.
         """
-        if threading.current_thread() is not threading.main_thread():
-            # schedule to main thread
-            try:
-                self.after(0, lambda: self._push_log(text))
-            except Exception:
-                # fallback if widget destroyed
-                print(f"(fallback) {text}", file=sys.stderr)
-            return
+        self._log.append(text)
 
-        ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        line = f"{ts} | {text}\n"
-        try:
-            self.txt_log.insert(tk.END, line)
-            self.txt_log.see(tk.END)
-        except Exception:
-            # if UI is destroyed, just print to stdout for debugging
-            print(line, file=sys.stderr)
+    def _flush_log(self):
+        if not self._tab_built("System Log"):
+            # lines wait in the buffer (the newest LOG_BUFFER_SIZE) until the tab is first opened
+            self.after(LOG_FLUSH_MS, self._flush_log)
+            return
+        lines, dropped = self._log.drain()
+        if lines:
+            text = "\n".join(lines) + "\n"
+            if dropped:
+                text = f"… {dropped} earlier lines skipped (see synapsemail.log)\n" + text
+            try:
+                self.txt_log.insert(tk.END, text)
+                excess = int(self.txt_log.index("end-1c").split(".")[0]) - 1 - self.log_max_lines
+                if excess > 0:
+                    self.txt_log.delete("1.0", f"{excess + 1}.0")
+                self.txt_log.see(tk.END)
+            except tk.TclError:
+                return  # window is gone
+        self.after(LOG_FLUSH_MS, self._flush_log)
 
     # -------------------
     # Logout (safe)
@@ -622,21 +1778,26 @@ class AutoMailCTKApp(ctk.CTk):
     def _logout(self):
         # Ask user
         if messagebox.askyesno("Logout", "Are you sure you want to logout?"):
-            # 1) Stop worker thread if running
+            # 1) Stop worker thread (and any bulk send) if running
             self._stop_event.set()  # request worker to stop
+            self._wake_watches()
+            if self._bulk_job is not None:
+                self._bulk_job.stop()
             self._push_log("🔒 Logout requested — stopping background worker")
 
             # 2) Clear credentials and in-memory caches (safely)
             self.email_address = None
             self.email_password = None
             self.phone_number = None
-            self.replied_to.clear()
+            self.replies_sent = 0
+            self._reply_cache.invalidate()
 
             # 3) Reset UI state
             self.lbl_logged_in.configure(text="Not logged in")
             self.lbl_total_replies.configure(text="Replies sent: 0")
             self.last_replied_var.set("No replies yet")
             self.lbl_last_check.configure(text="Last check: N/A")
+            self.lbl_quota.configure(text="Send quota: not logged in")
             self._set_status_running(False)
             self._push_log("✓ Logged out (UI reset).")
 
@@ -648,11 +1809,35 @@ class AutoMailCTKApp(ctk.CTk):
                 else:
                     # ensure reference cleared
                     self._worker_thread = None
+                    # worker is gone: only the outbox still uses the old account's SMTP sessions
+                    outbound = (self._outbox, self._spool, self._smtp_pool)
+                    self._outbox = self._spool = self._smtp_pool = None
+                    threading.Thread(target=self._close_outbound, args=outbound, daemon=True).start()
+                    if self._governor is not None:
+                        self._governor.save()
+                        self._governor = None
+                    if self._replied is not None:
+                        self._replied.close()
+                        self._replied = None
                     # now prompt login (on main thread)
                     self.after(0, self._do_login)
 
             self.after(200, _wait_for_worker_exit)
 
+    @staticmethod
+    def _close_outbound(outbox, spool, pool, timeout=None):
+        # let in-flight sends finish (SMTP_TIMEOUT by default); anything cut off stays spooled and is sent
+        # after the next login
+        finished = True
+        if outbox is not None:
+            from synapse_smtp import SMTP_TIMEOUT
+            outbox.stop()
+            finished = outbox.join(SMTP_TIMEOUT if timeout is None else timeout)
+        if spool is not None and finished:
+            spool.close()  # otherwise a worker still in send() records its outcome; the spool goes with it
+        if pool is not None:
+            pool.close()
+
     # -------------------
     # Clean exit on close
     # -------------------
@@ -660,9 +1845,25 @@ class AutoMailCTKApp(ctk.CTk):
         # Request worker exit and give a brief moment
         try:
             self._stop_event.set()
+            self._wake_watches()
             if self._worker_thread and self._worker_thread.is_alive():
                 # allow short wait so worker can clean up
                 self._worker_thread.join(timeout=1.0)
+            self._close_outbound(self._outbox, self._spool, self._smtp_pool, timeout=1.0)
+            if self._replied is not None:
+                self._replied.close()
+            if self._bulk_job is not None:
+                self._bulk_job.stop()
+            if self._governor is not None:
+                self._governor.save()
+            if self._engine is not None:
+                self._engine.stop()
+                self._engine.join(timeout=1.0)
+            if "_history" in self.__dict__:
+                self._history.close()  # writes what is still queued
+            for exporter in self._metrics_exporters:
+                exporter.close()
+            self._log.close()
         except Exception:
             pass
         super().destroy()
@@ -671,5 +1872,5 @@ class AutoMailCTKApp(ctk.CTk):
 # Run
 # -----------------------
 if __name__ == "__main__":
-    app = AutoMailCTKApp()
+    app = AutoMailCTKApp(accounts_path=ARGS.config, metrics_port=ARGS.metrics_port, metrics_file=ARGS.metrics_file)
     app.mainloop()
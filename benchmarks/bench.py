@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks for Auto Mail Center against the local stand-in servers.
+
+    python benchmarks/bench.py responder --accounts 4 --messages 500 --latency-ms 2
+    python benchmarks/bench.py responder --folders 8 --max-connections 10
+    python benchmarks/bench.py bulk --recipients 2000 --workers 3 --tls
+    python benchmarks/bench.py rules --rules 10,100,1000,10000
+    python benchmarks/bench.py startup --runs 10 --gui
+    python benchmarks/bench.py history --rows 300000
+
+responder: seeds each account's INBOX with unread mail from distinct senders,
+  runs the auto-responder engine until every message is answered (backlog
+  throughput), then injects single messages to time new-mail-to-reply latency;
+  with --folders, every folder is seeded and watched, and the latency probes
+  land in the last one.
+bulk: sends a mail-merge list through the Composer's SmtpPool/BulkSendJob path.
+rules: routing-rule dispatch cost per message as the rule set grows, RuleSet
+  indexes vs. a linear scan over the same rules (no servers involved).
+startup: cold-start regression check. Imports SynapseMail in fresh interpreters
+  and reports the import time and any module that must stay deferred until
+  after the login dialog (smtplib, imaplib, email.mime, ...) but was loaded
+  anyway (exit status 1); with --gui, also times launch-to-login-dialog through
+  --profile-startup (needs a display and customtkinter).
+history: fills the processed-message index through record() as the pipeline
+  does, then times what the History tab asks of it: match counts, the first
+  page and the last page of a scroll, for prefix and full-text searches.
+Servers run in a child process so peak RSS reflects the client alone. State
+(checkpoints, replied store) goes to a throwaway data directory.
+"""
+
+import argparse
+import email.utils
+import json
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# -----------------------
+# Server process
+# -----------------------
+def _serve(conn, opts):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from servers import ImapStandIn, SmtpSink, make_self_signed_cert
+
+    cert = key = None
+    if opts["tls"]:
+        cert, key = make_self_signed_cert()
+    faults = {"latency": opts["latency_ms"] / 1000.0, "fail_rate": opts["fail_rate"]}
+    imap = ImapStandIn(certfile=cert, keyfile=key, **faults)
+    smtp = SmtpSink(certfile=cert, keyfile=key, **faults)
+    conn.send({"imap_port": imap.port, "smtp_port": smtp.port, "cert": cert})
+    while True:
+        cmd, *args = conn.recv()
+        if cmd == "seed":
+            conn.send(len(imap.seed(*args[:2], size=opts["size"], attachment_ratio=opts["attachments"],
+                                    attachment_size=opts["attachment_size"],
+                                    noise_ratio=args[2] if len(args) > 2 else 0.0,
+                                    folder=args[3] if len(args) > 3 else "INBOX")))
+        elif cmd == "stats":
+            conn.send({"imap": imap.snapshot(), "smtp": smtp.snapshot(), "mailboxes": imap.mailbox_stats()})
+        elif cmd == "stop":
+            imap.close()
+            smtp.close()
+            conn.send(True)
+            return
+
+
+class ServerProcess:
+    def __init__(self, opts):
+        self._conn, child = multiprocessing.Pipe()
+        self._proc = multiprocessing.Process(target=_serve, args=(child, opts), daemon=True)
+        self._proc.start()
+        self.info = self._conn.recv()
+
+    def call(self, *cmd):
+        self._conn.send(cmd)
+        return self._conn.recv()
+
+    def stop(self):
+        self.call("stop")
+        self._proc.join(5)
+
+
+# -----------------------
+# Helpers
+# -----------------------
+def _peak_rss_mb() -> float:
+    # Linux reports KiB, macOS bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _ssl_context(info):
+    if not info["cert"]:
+        return False
+    import ssl
+    return ssl.create_default_context(cafile=info["cert"])
+
+
+def _wait_for(servers, predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = servers.call("stats")
+        if predicate(stats):
+            return stats, True
+        time.sleep(0.02)
+    return servers.call("stats"), False
+
+
+def _pct(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _phase_table(snapshot):
+    return {name: {k: round(v * 1000, 2) if k in ("p50", "p95", "p99", "mean") else v for k, v in p.items()}
+            for name, p in snapshot["phases"].items()}
+
+
+# -----------------------
+# Scenarios
+# -----------------------
+def bench_responder(args, servers):
+    from synapse_async import AccountConfig, AsyncEngine
+    from synapse_imap import SyncCheckpoint
+    from synapse_metrics import METRICS
+    from synapse_config import TEMPLATES_DIR, data_path
+    from synapse_quota import parse_send_limits
+
+    info = servers.info
+    if args.excerpt:
+        # a reply that quotes the message makes the engine read each text part (capped, attachments skipped)
+        os.makedirs(TEMPLATES_DIR, exist_ok=True)
+        with open(os.path.join(TEMPLATES_DIR, "auto_reply.txt"), "w", encoding="utf-8") as f:
+            f.write("Subject: Re: {subject}\n\nThanks {name}, we got your message:\n\n{excerpt}\n")
+    users = [f"bench{i}@bench.local" for i in range(args.accounts)]
+    folders = ["inbox"] + [f"Support/Queue {i}" for i in range(2, args.folders + 1)]
+    for user in users:
+        for folder in folders:
+            servers.call("seed", user, args.messages, args.noise, folder)
+    total = args.messages * args.accounts * len(folders)
+    # list / bulk / automatic mail is filtered out, not answered
+    expected = (args.messages - int(args.messages * args.noise)) * args.accounts * len(folders)
+    accounts = [AccountConfig(user, "secret", imap_host="127.0.0.1", imap_port=info["imap_port"],
+                              smtp_host="127.0.0.1", smtp_port=info["smtp_port"], use_idle=not args.poll,
+                              check_interval=1, mailboxes=folders, max_connections=args.max_connections,
+                              # unlimited by default: the engine is measured, not the send quota
+                              send_limits=parse_send_limits(args.send_limits), coalesce_seconds=0)
+                for user in users]
+    errors = []
+    engine = AsyncEngine(accounts, log=lambda t: errors.append(t) if t.split("] ", 1)[-1][:1] in "❌⚠" else None,
+                         checkpoint=SyncCheckpoint(data_path("bench_checkpoint.json")),
+                         ssl_context=_ssl_context(info))
+
+    start = time.perf_counter()
+    engine.start_in_thread()
+    stats, done = _wait_for(servers, lambda s: s["smtp"].get("messages", 0) >= expected, args.timeout)
+    backlog_seconds = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(args.rounds if done else 0):
+        before = servers.call("stats")["smtp"].get("messages", 0)
+        t0 = time.perf_counter()
+        servers.call("seed", users[0], 1, 0.0, folders[-1])
+        _, ok = _wait_for(servers, lambda s: s["smtp"].get("messages", 0) > before, 30)
+        if ok:
+            latencies.append(time.perf_counter() - t0)
+
+    engine.stop()
+    engine.join(10)
+    stats = servers.call("stats")
+    return {
+        "scenario": "responder",
+        "accounts": args.accounts,
+        "folders": len(folders),
+        "messages": total,
+        "completed": done,
+        "replies": stats["smtp"].get("messages", 0),
+        "expected_replies": expected,
+        "send_limits": args.send_limits,
+        "messages_fetched": METRICS.snapshot()["counters"].get("messages_fetched", 0),
+        "suppressed_after_fetch": METRICS.snapshot()["counters"].get("messages_suppressed", 0),
+        "imap_literal_bytes": stats["imap"].get("fetch_bytes", 0),
+        "body_bytes_fetched": METRICS.snapshot()["counters"].get("body_bytes_fetched", 0),
+        "backlog_seconds": round(backlog_seconds, 3),
+        "messages_per_sec": round(total / backlog_seconds, 1) if done else None,
+        "new_mail_latency_ms": {"p50": round(_pct(latencies, 0.5) * 1000, 1),
+                                "p95": round(_pct(latencies, 0.95) * 1000, 1),
+                                "mean": round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+                                "samples": len(latencies)},
+        "imap_connections": stats["imap"].get("connections", 0),
+        "peak_imap_connections": stats["imap"].get("peak_connections", 0),
+        "smtp_connections": stats["smtp"].get("connections", 0),
+        "injected_drops": stats["imap"].get("drops", 0) + stats["smtp"].get("drops", 0),
+        "errors_logged": len(errors),
+        "phases_ms": _phase_table(METRICS.snapshot()),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def bench_bulk(args, servers):
+    from synapse_bulk import BulkSendJob
+    from synapse_smtp import SmtpPool
+    from synapse_templates import GREETING_TEMPLATES, build_greeting
+
+    info = servers.info
+    templates = list(GREETING_TEMPLATES)
+    recipients = [{"index": i, "email": f"rcpt{i}@example.net", "name": f"Person {i}",
+                   "template": templates[i % len(templates)]} for i in range(args.recipients)]
+    pool = SmtpPool("127.0.0.1", info["smtp_port"], "bench@bench.local", "secret", size=args.workers,
+                    ssl_context=_ssl_context(info))
+    job = BulkSendJob(recipients,
+                      lambda row: build_greeting("bench@bench.local", row["email"], row["name"], row["template"]),
+                      pool.send, workers=args.workers)
+    job.start()
+    job.join(args.timeout)
+    snap = job.snapshot()
+    pool.close()
+    stats = servers.call("stats")
+    return {
+        "scenario": "bulk",
+        "recipients": args.recipients,
+        "workers": args.workers,
+        "sent": snap["sent"],
+        "failed": snap["failed"],
+        "seconds": round(snap["elapsed"], 3),
+        "messages_per_sec": round(snap["rate"], 1),
+        "smtp_connections": stats["smtp"].get("connections", 0),
+        "injected_drops": stats["smtp"].get("drops", 0),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+_RULE_WORDS = ("invoice", "refund", "order", "urgent", "meeting", "report", "support", "quote", "update", "ticket")
+
+
+def _make_rules(count, rng):
+    from synapse_rules import Rule
+    rules = []
+    for i in range(count):
+        kind = i % 20
+        if kind < 6:
+            rules.append(Rule(i, sender=f"user{i}@d{i % 997}.example", template="vip"))
+        elif kind < 11:
+            rules.append(Rule(i, domain=f"d{i}.example", cooldown=3600))
+        elif kind < 14:
+            rules.append(Rule(i, recipient=f"alias{i}@bench.local", template="sales"))
+        elif kind < 19:
+            rules.append(Rule(i, subject=rf"\b{rng.choice(_RULE_WORDS)}[- #]?{i}\b", template="billing"))
+        else:
+            rules.append(Rule(i, domain=f"d{i % 97}.example", subject=rf"{rng.choice(_RULE_WORDS)} #{i}\b", reply=False))
+    return rules
+
+
+def _linear_match(rules, sender, recipients, subject):
+    sender = sender.lower()
+    domain = sender.rpartition("@")[2]
+    labels = domain.split(".")
+    domains = [".".join(labels[i:]) for i in range(len(labels))]
+    aliases = {r.lower() for r in recipients}
+    for rule in rules:
+        if rule.matches(sender, domains, aliases, subject):
+            return rule
+    return None
+
+
+def bench_rules(args):
+    from synapse_rules import RuleSet
+
+    rng = random.Random(7)
+    sizes = [int(n) for n in args.rules.split(",")]
+    top = max(sizes)
+    messages = [(f"user{rng.randrange(top)}@{'mail.' if rng.random() < 0.3 else ''}d{rng.randrange(top)}.example",
+                 [f"alias{rng.randrange(top)}@bench.local"],
+                 f"Re: {rng.choice(_RULE_WORDS)} {rng.randrange(top)} — {rng.choice(_RULE_WORDS)} follow-up")
+                for _ in range(args.lookups)]
+    results = []
+    for count in sizes:
+        rules = _make_rules(count, rng)
+        t0 = time.perf_counter()
+        ruleset = RuleSet(rules)
+        build = time.perf_counter() - t0
+        matched = 0
+        t0 = time.perf_counter()
+        for sender, recipients, subject in messages:
+            matched += ruleset.match(sender, recipients, subject) is not None
+        indexed = (time.perf_counter() - t0) / len(messages)
+        sample = messages[:max(1, min(len(messages), args.linear_lookups))]
+        t0 = time.perf_counter()
+        expected = [_linear_match(rules, *m) for m in sample]
+        linear = (time.perf_counter() - t0) / len(sample)
+        mismatches = sum(ruleset.match(*m) is not e for m, e in zip(sample, expected))
+        results.append({"rules": count, "build_ms": round(build * 1000, 1), "indexed_us": round(indexed * 1e6, 2),
+                        "linear_us": round(linear * 1e6, 2), "matched": matched, "unindexed": ruleset.unindexed,
+                        "mismatches": mismatches})
+    return {"scenario": "rules", "messages": len(messages), "dispatch": results,
+            "peak_rss_mb": round(_peak_rss_mb(), 1)}
+
+
+_HISTORY_QUERIES = ("", "invoice", "invoice urg", "user42@", "<m123", "failed")
+
+
+def bench_history(args):
+    from email.message import Message
+    from synapse_config import data_path
+    from synapse_history import MessageIndex
+    from synapse_pipeline import FAILED, REPLIED
+
+    rng = random.Random(7)
+    index = MessageIndex(data_path("history.sqlite3"))
+    now = time.time()
+    record = written = 0.0
+    chunk = 10000  # far below HISTORY_MAX_PENDING, so nothing is dropped
+    for start in range(0, args.rows, chunk):
+        headers = []
+        for i in range(start, min(args.rows, start + chunk)):
+            h = Message()
+            h["Subject"] = f"{rng.choice(_RULE_WORDS)} {rng.choice(_RULE_WORDS)} #{i}"
+            h["Message-ID"] = f"<m{i}@host{i % 50}.example>"
+            h["Date"] = email.utils.formatdate(now - rng.uniform(60, 86400))
+            headers.append((i, h))
+        t0 = time.perf_counter()
+        for i, h in headers:
+            index.record("bench@local", "INBOX", i, f"user{i % 5000}@d{i % 300}.example", h,
+                         FAILED if i % 50 == 0 else REPLIED, replied=now)
+        t1 = time.perf_counter()
+        index.flush()
+        record += t1 - t0
+        written += time.perf_counter() - t1
+    queries = []
+    for query in _HISTORY_QUERIES:
+        t1 = time.perf_counter()
+        total = index.count(query)
+        t2 = time.perf_counter()
+        index.search(query, limit=30)
+        t3 = time.perf_counter()
+        index.search(query, limit=30, offset=max(0, total - 30))
+        t4 = time.perf_counter()
+        queries.append({"query": query, "matches": total, "count_ms": round((t2 - t1) * 1000, 2),
+                        "first_page_ms": round((t3 - t2) * 1000, 2), "last_page_ms": round((t4 - t3) * 1000, 2)})
+    rows = index.count()
+    index.close()
+    return {"scenario": "history", "rows": rows, "full_text": index.full_text,
+            "record_us": round(record / args.rows * 1e6, 2), "writer_rows_per_s": round(args.rows / written),
+            "db_mb": round(os.path.getsize(data_path("history.sqlite3")) / 1e6, 1), "searches": queries,
+            "peak_rss_mb": round(_peak_rss_mb(), 1)}
+
+
+# loaded on first use, never before the login dialog (see SynapseMail's imports)
+STARTUP_DEFERRED_MODULES = ("smtplib", "imaplib", "ssl", "email.mime.text", "email.parser", "webbrowser", "asyncio",
+                            "sqlite3", "http.server", "synapse_imap", "synapse_smtp", "synapse_templates",
+                            "synapse_rules", "synapse_async", "synapse_history")
+
+_IMPORT_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import SynapseMail
+ms = (time.perf_counter() - t0) * 1000
+print(json.dumps({"import_ms": ms, "loaded": [m for m in sys.argv[1:] if m in sys.modules]}))
+"""
+
+
+def _time_to_dialog(timeout):
+    """Launch the GUI with --profile-startup; ms from spawn (and in-app) until the login dialog is shown."""
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "SynapseMail.py"), "--profile-startup"], cwd=ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        deadline = t0 + timeout
+        for line in proc.stdout:
+            if line.rstrip().endswith("login dialog shown"):
+                return (time.perf_counter() - t0) * 1000, float(line.split()[0])
+            if time.perf_counter() > deadline:
+                break
+        return None, None
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def bench_startup(args):
+    import_ms, loaded = [], set()
+    for _ in range(args.runs):
+        proc = subprocess.run([sys.executable, "-c", _IMPORT_PROBE, *STARTUP_DEFERRED_MODULES], cwd=ROOT,
+                              capture_output=True, text=True, timeout=args.timeout)
+        if proc.returncode != 0:
+            lines = proc.stderr.strip().splitlines()
+            return {"scenario": "startup", "error": lines[-1] if lines else f"exit status {proc.returncode}"}
+        probe = json.loads(proc.stdout.strip().splitlines()[-1])
+        import_ms.append(probe["import_ms"])
+        loaded.update(probe["loaded"])
+    result = {
+        "scenario": "startup",
+        "runs": args.runs,
+        "import_ms_median": round(statistics.median(import_ms), 1),
+        "import_ms_min": round(min(import_ms), 1),
+        "eagerly_loaded": sorted(loaded),
+    }
+    if args.gui:
+        samples = [_time_to_dialog(args.timeout) for _ in range(args.runs)]
+        wall = [w for w, _ in samples if w is not None]
+        if wall:
+            result["dialog_ms_median"] = round(statistics.median(wall), 1)
+            result["dialog_ms_in_app_median"] = round(statistics.median(a for _, a in samples if a is not None), 1)
+        else:
+            result["dialog_ms_median"] = "no login dialog (display / customtkinter missing?)"
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Auto Mail Center benchmarks")
+    parser.add_argument("scenario", choices=("responder", "bulk", "rules", "startup", "history"))
+    parser.add_argument("--accounts", type=int, default=1, help="responder: mailboxes served at once")
+    parser.add_argument("--messages", type=int, default=200, help="responder: unread messages per mailbox")
+    parser.add_argument("--rounds", type=int, default=10, help="responder: single-message latency samples")
+    parser.add_argument("--poll", action="store_true", help="responder: poll instead of IMAP IDLE")
+    parser.add_argument("--folders", type=int, default=1, help="responder: folders watched per account")
+    parser.add_argument("--max-connections", type=int, default=10, help="responder: IMAP connection cap per account")
+    parser.add_argument("--noise", type=float, default=0.0,
+                        help="responder: fraction of seeded mail that is list/bulk/automatic (never answered)")
+    parser.add_argument("--send-limits", default="0, 0, 0",
+                        help="responder: per minute, hour, day per account (0: no limit, the default)")
+    parser.add_argument("--excerpt", action="store_true",
+                        help="responder: quote {excerpt} in the reply (partial body fetch)")
+    parser.add_argument("--recipients", type=int, default=500, help="bulk: rows in the mail-merge list")
+    parser.add_argument("--workers", type=int, default=3, help="bulk: sender threads / SMTP connections")
+    parser.add_argument("--rules", default="10,100,1000,10000", help="rules: comma-separated rule-set sizes")
+    parser.add_argument("--lookups", type=int, default=5000, help="rules: messages dispatched per size")
+    parser.add_argument("--linear-lookups", type=int, default=200, help="rules: messages timed with the linear scan")
+    parser.add_argument("--runs", type=int, default=10, help="startup: fresh interpreters timed")
+    parser.add_argument("--gui", action="store_true", help="startup: also time launch to login dialog")
+    parser.add_argument("--rows", type=int, default=200000, help="history: messages indexed")
+    parser.add_argument("--size", type=int, default=2048, help="message body size in bytes")
+    parser.add_argument("--attachments", type=float, default=0.0, help="fraction of messages with an attachment")
+    parser.add_argument("--attachment-size", type=int, default=64 * 1024)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="server delay per command")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="probability a command drops the connection")
+    parser.add_argument("--tls", action="store_true", help="serve implicit TLS with a self-signed certificate")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--json", action="store_true", help="print one JSON object instead of a report")
+    args = parser.parse_args(argv)
+
+    # isolate all on-disk state before any synapse module reads the data directory
+    os.environ["SYNAPSEMAIL_HOME"] = tempfile.mkdtemp(prefix="synapse-bench-")
+    sys.path.insert(0, ROOT)
+
+    if args.scenario == "rules":
+        return _report(bench_rules(args), args.json)
+    if args.scenario == "history":
+        return _report(bench_history(args), args.json)
+    if args.scenario == "startup":
+        result = bench_startup(args)
+        _report(result, args.json)
+        return 1 if result.get("eagerly_loaded") or "error" in result else 0
+
+    servers = ServerProcess({"tls": args.tls, "latency_ms": args.latency_ms, "fail_rate": args.fail_rate,
+                             "size": args.size, "attachments": args.attachments,
+                             "attachment_size": args.attachment_size})
+    try:
+        result = bench_responder(args, servers) if args.scenario == "responder" else bench_bulk(args, servers)
+    finally:
+        servers.stop()
+
+    return _report(result, args.json)
+
+
+def _report(result, as_json):
+    if as_json:
+        print(json.dumps(result))
+        return 0
+    for key, value in result.items():
+        if key == "dispatch":
+            print("dispatch per message (µs):")
+            for row in value:
+                print(f"  rules={row['rules']:<7} indexed={row['indexed_us']:<8} linear={row['linear_us']:<10} "
+                      f"build_ms={row['build_ms']:<8} unindexed={row['unindexed']} mismatches={row['mismatches']}")
+        elif key == "searches":
+            print("searches (ms):")
+            for row in value:
+                print(f"  {row['query']!r:<14} matches={row['matches']:<8} count={row['count_ms']:<7} "
+                      f"first page={row['first_page_ms']:<7} last page={row['last_page_ms']}")
+        elif key == "phases_ms":
+            print("phases (ms):")
+            for name, p in value.items():
+                print(f"  {name:<14} n={p['count']:<6} p50={p['p50']:<8} p95={p['p95']:<8} p99={p['p99']:<8} "
+                      f"errors={p['errors']}")
+        else:
+            print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
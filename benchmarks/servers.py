@@ -0,0 +1,670 @@
+# -*- coding: utf-8 -*-
+"""
+Local IMAP and SMTP stand-in servers for benchmarking Auto Mail Center offline.
+- ImapStandIn: multi-user IMAP4rev1 subset (LOGIN, SELECT, UID SEARCH/FETCH/STORE,
+  BODYSTRUCTURE and partial BODY[section]<o.n>, IDLE, CONDSTORE's HIGHESTMODSEQ)
+  over in-memory folders; counts peak concurrent connections
+- SmtpSink: accepts and counts submissions (EHLO, AUTH, MAIL/RCPT/DATA, RSET)
+Both bind to loopback, can wrap connections in TLS with a throwaway self-signed
+certificate, and can inject per-command latency and random connection drops.
+Not a conformant server: just enough protocol for the app's own clients.
+"""
+
+import os
+import random
+import re
+import socket
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from email import message_from_bytes
+from email.message import EmailMessage
+from email.utils import formatdate
+
+IMAP_CAPABILITIES = "IMAP4rev1 IDLE ENABLE CONDSTORE UIDPLUS LITERAL+"
+
+
+def make_self_signed_cert(directory=None):
+    """Create a localhost certificate with the openssl CLI; returns (certfile, keyfile)."""
+    directory = directory or tempfile.mkdtemp(prefix="synapse-bench-tls-")
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "2",
+         "-keyout", key, "-out", cert, "-subj", "/CN=localhost",
+         "-addext", "subjectAltName=IP:127.0.0.1,DNS:localhost"],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return cert, key
+
+
+def make_message(sender, recipient, size=2048, attachment_size=0, subject="Benchmark message", extra_headers=()):
+    """Raw RFC 5322 bytes: a text body of ~`size` bytes plus an optional binary attachment."""
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = recipient
+    msg["Subject"] = subject
+    msg["Date"] = formatdate(localtime=True)
+    msg["Message-ID"] = f"<{random.getrandbits(64):x}@bench.local>"
+    for name, value in extra_headers:
+        msg[name] = value
+    line = "The quick brown fox jumps over the lazy dog. "
+    msg.set_content((line * (max(size, 1) // len(line) + 1))[:max(size, 1)])
+    if attachment_size:
+        msg.add_attachment(os.urandom(attachment_size), maintype="application", subtype="octet-stream",
+                           filename="report.bin")
+    return msg.as_bytes().replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+
+
+class _Faults:
+    """Per-command latency and random disconnects shared by both servers."""
+
+    def __init__(self, latency=0.0, fail_rate=0.0, seed=None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def should_fail(self) -> bool:
+        if not self.fail_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.fail_rate
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _BaseStandIn:
+    def __init__(self, handler, port=0, certfile=None, keyfile=None, latency=0.0, fail_rate=0.0):
+        self.faults = _Faults(latency, fail_rate)
+        self.tls = None
+        if certfile:
+            self.tls = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.tls.load_cert_chain(certfile, keyfile)
+        self.stats = {"connections": 0, "commands": 0, "drops": 0, "peak_connections": 0}
+        self._stats_lock = threading.Lock()
+        self._open = 0
+        owner = self
+
+        class Handler(handler):
+            server_owner = owner
+
+        self._server = _Server(("127.0.0.1", port), Handler)
+        self.host, self.port = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + amount
+
+    def opened(self, amount=1):
+        with self._stats_lock:
+            self._open += amount
+            self.stats["peak_connections"] = max(self.stats["peak_connections"], self._open)
+
+    def snapshot(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _LineHandler(socketserver.StreamRequestHandler):
+    server_owner = None
+
+    def setup(self):
+        owner = self.server_owner
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if owner.tls is not None:
+            self.request = owner.tls.wrap_socket(self.request, server_side=True)
+        super().setup()
+        owner.count("connections")
+        owner.opened()
+
+    def finish(self):
+        self.server_owner.opened(-1)
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+    def send(self, data: bytes):
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def readline(self):
+        line = self.rfile.readline()
+        return line if line else None
+
+
+# -----------------------
+# IMAP stand-in
+# -----------------------
+class _Message:
+    __slots__ = ("uid", "raw", "flags", "modseq", "header_end", "internaldate", "parsed")
+
+    def __init__(self, uid, raw, modseq, parsed):
+        self.uid = uid
+        self.raw = raw
+        self.flags = set()
+        self.modseq = modseq
+        self.internaldate = time.time()
+        end = raw.find(b"\r\n\r\n")
+        self.header_end = len(raw) if end < 0 else end + 4
+        self.parsed = parsed  # for BODYSTRUCTURE / BODY[section]
+
+
+class Mailbox:
+    """One user's INBOX. Thread-safe; wakes IDLE-ing connections on append."""
+
+    def __init__(self, uidvalidity=None):
+        self.uidvalidity = uidvalidity or random.randint(1, 2 ** 31)
+        self.messages = []
+        self.uidnext = 1
+        self.modseq = 1
+        self.changed = threading.Condition()
+
+    def append(self, raw, flags=()):
+        # parsed once up front, as a real server indexes on delivery, so fetches stay cheap
+        parsed = message_from_bytes(raw)
+        with self.changed:
+            self.modseq += 1
+            msg = _Message(self.uidnext, raw, self.modseq, parsed)
+            msg.flags.update(flags)
+            self.messages.append(msg)
+            self.uidnext += 1
+            self.changed.notify_all()
+            return msg.uid
+
+    def flagged(self, flag="\\Seen") -> int:
+        with self.changed:
+            return sum(1 for m in self.messages if flag in m.flags)
+
+
+_TAGGED_RE = re.compile(rb"^(\S+) (\S+)(?: (.*))?$")
+_HEADER_FIELDS_RE = re.compile(r"BODY(\.PEEK)?\[HEADER\.FIELDS \(([^)]*)\)\]", re.I)
+_SECTION_RE = re.compile(r"BODY(?:\.PEEK)?\[(\d+(?:\.\d+)*)\](?:<(\d+)\.(\d+)>)?", re.I)
+
+
+def _in_set(uid, uid_set, max_uid):
+    for part in uid_set.split(","):
+        if ":" in part:
+            lo, hi = part.split(":")
+            lo = max_uid if lo == "*" else int(lo)
+            hi = max_uid if hi == "*" else int(hi)
+            if min(lo, hi) <= uid <= max(lo, hi):
+                return True
+        elif (max_uid if part == "*" else int(part)) == uid:
+            return True
+    return False
+
+
+def _tokens(text):
+    return re.findall(r'"(?:[^"\\]|\\.)*"|\([^)]*\)|\S+', text)
+
+
+def _unquote(token):
+    if token.startswith('"') and token.endswith('"'):
+        return token[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return token
+
+
+_MONTHS = ("JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC")
+
+
+def _search_date(token):
+    day, month, year = _unquote(token).split("-")
+    return time.mktime((int(year), _MONTHS.index(month.upper()) + 1, int(day), 0, 0, 0, 0, 0, -1))
+
+
+def _header_value(msg, name):
+    name = name.lower().encode()
+    for line in msg.raw[:msg.header_end].split(b"\r\n"):
+        key, _, value = line.partition(b":")
+        if key.strip().lower() == name:
+            return value.strip().decode("utf-8", "replace")
+    return ""
+
+
+def _raw_payload(part) -> bytes:
+    payload = part.get_payload()
+    return payload.encode("utf-8", "surrogateescape") if isinstance(payload, str) else b""
+
+
+def _bodystructure(part) -> str:
+    """RFC 3501 BODYSTRUCTURE of a parsed message (no extension data beyond disposition)."""
+    if part.is_multipart():
+        children = "".join(_bodystructure(child) for child in part.get_payload())
+        return f'({children} "{part.get_content_subtype().upper()}")'
+    maintype, subtype = part.get_content_maintype(), part.get_content_subtype()
+    params = " ".join(f'"{k.upper()}" "{v}"' for k, v in part.get_params(header="content-type")[1:] if v)
+    encoding = (part.get("Content-Transfer-Encoding") or "7bit").upper()
+    body = _raw_payload(part)
+    text = f'("{maintype.upper()}" "{subtype.upper()}" {"(" + params + ")" if params else "NIL"} NIL NIL "{encoding}" {len(body)}'
+    if maintype == "text":
+        lines = body.count(b"\n")
+        text += f" {lines}"
+    disposition = part.get_content_disposition()
+    return text + (f' NIL ("{disposition.upper()}" NIL) NIL NIL)' if disposition else " NIL NIL NIL NIL)")
+
+
+def _section(part, section) -> bytes:
+    for number in section.split("."):
+        index = int(number) - 1
+        if part.is_multipart():
+            children = part.get_payload()
+            if not 0 <= index < len(children):
+                return b""
+            part = children[index]
+        elif index != 0:
+            return b""
+    return _raw_payload(part)
+
+
+class _ImapHandler(_LineHandler):
+    def handle(self):
+        owner = self.server_owner
+        self.mailbox = None
+        self.user = None
+        self.reported = 0  # EXISTS count the client has been told about
+        self.send(f"* OK [CAPABILITY {IMAP_CAPABILITIES}] stand-in ready\r\n".encode())
+        while True:
+            line = self.readline()
+            if line is None:
+                return
+            m = _TAGGED_RE.match(line.rstrip(b"\r\n"))
+            if not m:
+                self.send(b"* BAD parse error\r\n")
+                continue
+            tag, cmd, arg = m.group(1), m.group(2).upper().decode(), (m.group(3) or b"").decode("utf-8", "replace")
+            owner.count("commands")
+            owner.faults.delay()
+            if owner.faults.should_fail() and cmd not in ("LOGOUT", "CAPABILITY"):
+                owner.count("drops")
+                self.send(b"* BYE injected failure\r\n")
+                return
+            handler = getattr(self, f"cmd_{cmd.lower()}", None)
+            if handler is None:
+                self.send(tag + b" BAD unknown command\r\n")
+                continue
+            if handler(tag, arg) is False:
+                return
+
+    def ok(self, tag, text="done"):
+        out = b""
+        box = self.mailbox
+        if box is not None:
+            count = len(box.messages)
+            if count != self.reported:
+                # like real servers: report new mail in any command's response
+                self.reported = count
+                out = f"* {count} EXISTS\r\n".encode()
+        self.send(out + tag + b" OK " + text.encode() + b"\r\n")
+
+    def cmd_capability(self, tag, arg):
+        self.send(f"* CAPABILITY {IMAP_CAPABILITIES}\r\n".encode())
+        self.ok(tag)
+
+    def cmd_login(self, tag, arg):
+        user, _password = [_unquote(t) for t in _tokens(arg)[:2]]
+        self.user = user
+        self.server_owner.count("logins")
+        self.ok(tag, "logged in")
+
+    def cmd_enable(self, tag, arg):
+        self.send(b"* ENABLED CONDSTORE\r\n")
+        self.ok(tag)
+
+    def cmd_select(self, tag, arg):
+        if self.user is None:
+            self.send(tag + b" NO not authenticated\r\n")
+            return
+        names = _tokens(arg)
+        box = self.mailbox = self.server_owner.mailbox(self.user, _unquote(names[0]) if names else "INBOX")
+        with box.changed:
+            exists = self.reported = len(box.messages)
+            text = (f"* {exists} EXISTS\r\n* 0 RECENT\r\n* OK [UIDVALIDITY {box.uidvalidity}] ok\r\n"
+                    f"* OK [UIDNEXT {box.uidnext}] ok\r\n* OK [HIGHESTMODSEQ {box.modseq}] ok\r\n"
+                    "* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)\r\n"
+                    "* OK [PERMANENTFLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft \\*)] ok\r\n")
+        self.send(text.encode())
+        self.ok(tag, "[READ-WRITE] selected")
+
+    cmd_examine = cmd_select
+
+    def cmd_noop(self, tag, arg):
+        self.ok(tag)
+
+    cmd_check = cmd_noop
+
+    def cmd_close(self, tag, arg):
+        self.mailbox = None
+        self.ok(tag)
+
+    def cmd_logout(self, tag, arg):
+        self.send(b"* BYE logging out\r\n")
+        self.ok(tag)
+        return False
+
+    def cmd_idle(self, tag, arg):
+        box = self.mailbox
+        self.send(b"+ idling\r\n")
+        stop = threading.Event()
+
+        def pusher():
+            while not stop.is_set():
+                with box.changed:
+                    count = len(box.messages)
+                    if count == self.reported:
+                        box.changed.wait(0.2)
+                        continue
+                if not stop.is_set():
+                    self.reported = count
+                    try:
+                        self.send(f"* {count} EXISTS\r\n".encode())
+                    except OSError:
+                        return
+
+        t = threading.Thread(target=pusher, daemon=True)
+        t.start()
+        line = self.readline()
+        stop.set()
+        with box.changed:
+            box.changed.notify_all()
+        t.join()
+        if line is None:
+            return False
+        self.ok(tag, "IDLE terminated")
+
+    def cmd_uid(self, tag, arg):
+        sub, _, rest = arg.partition(" ")
+        sub = sub.upper()
+        box = self.mailbox
+        if box is None:
+            self.send(tag + b" NO no mailbox selected\r\n")
+            return
+        if sub == "SEARCH":
+            self._search(tag, rest)
+        elif sub == "FETCH":
+            self._fetch(tag, rest)
+        elif sub == "STORE":
+            self._store(tag, rest)
+        else:
+            self.send(tag + b" BAD unsupported UID command\r\n")
+
+    # ---- UID SEARCH ----
+    def _search(self, tag, criteria):
+        tokens = _tokens(criteria)
+        if tokens and tokens[0].upper() == "CHARSET":
+            tokens = tokens[2:]
+        box = self.mailbox
+        with box.changed:
+            messages = list(box.messages)
+            max_uid = messages[-1].uid if messages else 0
+        try:
+            hits = [m.uid for m in messages if self._match(m, list(tokens), max_uid)]
+        except (ValueError, IndexError):
+            self.send(tag + b" BAD unsupported search\r\n")
+            return
+        if max_uid and re.search(r"UID \d+:\*", criteria, re.I) and not hits and criteria.strip().upper().startswith("UID"):
+            hits = [max_uid]  # RFC 3501: "n:*" always includes the highest UID
+        self.send(("* SEARCH " + " ".join(map(str, hits))).rstrip().encode() + b"\r\n")
+        self.ok(tag)
+
+    def _match(self, msg, tokens, max_uid):
+        while tokens:
+            if not self._match_one(msg, tokens, max_uid):
+                return False
+        return True
+
+    def _match_one(self, msg, tokens, max_uid):
+        key = tokens.pop(0).upper()
+        if key == "ALL":
+            return True
+        if key == "UNSEEN":
+            return "\\Seen" not in msg.flags
+        if key == "SEEN":
+            return "\\Seen" in msg.flags
+        if key == "KEYWORD":
+            return tokens.pop(0) in msg.flags
+        if key == "UNKEYWORD":
+            return tokens.pop(0) not in msg.flags
+        if key == "NOT":
+            return not self._match_one(msg, tokens, max_uid)
+        if key == "OR":
+            a = self._match_one(msg, tokens, max_uid)
+            b = self._match_one(msg, tokens, max_uid)
+            return a or b
+        if key == "UID":
+            return _in_set(msg.uid, tokens.pop(0), max_uid)
+        if key in ("FROM", "TO", "SUBJECT"):
+            return _unquote(tokens.pop(0)).lower() in _header_value(msg, key).lower()
+        if key == "SINCE":
+            return msg.internaldate >= _search_date(tokens.pop(0))
+        if key == "BEFORE":
+            return msg.internaldate < _search_date(tokens.pop(0))
+        if key == "HEADER":
+            name, value = _unquote(tokens.pop(0)), _unquote(tokens.pop(0)).lower()
+            header = _header_value(msg, name)
+            return bool(header) and value in header.lower()
+        if key.startswith("(") and key.endswith(")"):
+            return self._match(msg, _tokens(key[1:-1]), max_uid)
+        raise ValueError(key)
+
+    # ---- UID FETCH ----
+    def _fetch(self, tag, rest):
+        uid_set, _, items = rest.partition(" ")
+        items_u = items.upper()
+        box = self.mailbox
+        with box.changed:
+            messages = list(enumerate(box.messages, 1))
+            max_uid = box.messages[-1].uid if box.messages else 0
+        fields = _HEADER_FIELDS_RE.search(items)
+        out = []
+        for seq, msg in messages:
+            if not _in_set(msg.uid, uid_set, max_uid):
+                continue
+            parts = [f"UID {msg.uid}".encode()]
+            if "FLAGS" in items_u:
+                parts.append(f"FLAGS ({' '.join(sorted(msg.flags))})".encode())
+            if "RFC822.SIZE" in items_u:
+                parts.append(f"RFC822.SIZE {len(msg.raw)}".encode())
+            if "BODYSTRUCTURE" in items_u:
+                parts.append(f"BODYSTRUCTURE {_bodystructure(msg.parsed)}".encode())
+            literal = None
+            section = _SECTION_RE.search(items)
+            if section:
+                data = _section(msg.parsed, section.group(1))
+                name = f"BODY[{section.group(1)}]"
+                if section.group(2) is not None:
+                    start = int(section.group(2))
+                    data = data[start:start + int(section.group(3))]
+                    name += f"<{start}>"
+                literal = (name, data)
+            elif fields:
+                wanted = {f.lower() for f in fields.group(2).split()}
+                keep = []
+                for line in re.split(rb"\r\n(?![ \t])", msg.raw[:msg.header_end - 4]):
+                    if line.partition(b":")[0].strip().lower().decode("ascii", "replace") in wanted:
+                        keep.append(line)
+                literal = (f"BODY[HEADER.FIELDS ({fields.group(2).upper()})]", b"\r\n".join(keep) + b"\r\n\r\n")
+            elif "HEADER" in items_u:
+                literal = ("BODY[HEADER]", msg.raw[:msg.header_end])
+            elif "BODY[]" in items_u or "BODY.PEEK[]" in items_u or "RFC822" in items_u.split():
+                literal = ("BODY[]", msg.raw)
+            if literal is not None:
+                name, data = literal
+                self.server_owner.count("fetch_bytes", len(data))
+                out.append(f"* {seq} FETCH (".encode() + b" ".join(parts)
+                           + f" {name} {{{len(data)}}}\r\n".encode() + data + b")\r\n")
+            else:
+                out.append(f"* {seq} FETCH (".encode() + b" ".join(parts) + b")\r\n")
+        self.server_owner.count("fetched", len(out))
+        self.send(b"".join(out))
+        self.ok(tag)
+
+    # ---- UID STORE ----
+    def _store(self, tag, rest):
+        uid_set, _, rest = rest.partition(" ")
+        action, _, flag_text = rest.partition(" ")
+        action = action.upper()
+        flags = set(flag_text.strip("()").split())
+        box = self.mailbox
+        out = []
+        with box.changed:
+            max_uid = box.messages[-1].uid if box.messages else 0
+            box.modseq += 1
+            for seq, msg in enumerate(box.messages, 1):
+                if not _in_set(msg.uid, uid_set, max_uid):
+                    continue
+                if action.startswith("+"):
+                    msg.flags |= flags
+                elif action.startswith("-"):
+                    msg.flags -= flags
+                else:
+                    msg.flags = set(flags)
+                msg.modseq = box.modseq
+                if not action.endswith(".SILENT"):
+                    out.append(f"* {seq} FETCH (UID {msg.uid} FLAGS ({' '.join(sorted(msg.flags))}))\r\n".encode())
+        self.server_owner.count("stores")
+        self.send(b"".join(out))
+        self.ok(tag)
+
+
+# (sender prefix, extra headers) of mail that must never get an auto-reply
+NOISE_KINDS = (
+    (None, (("List-Id", "<announce.lists.example.net>"), ("Precedence", "list"))),
+    (None, (("Precedence", "bulk"),)),
+    (None, (("Auto-Submitted", "auto-replied"), ("X-Autoreply", "yes"))),
+    (None, (("Return-Path", "<>"),)),
+    ("no-reply+", ()),
+)
+
+
+class ImapStandIn(_BaseStandIn):
+    """In-memory IMAP server; a user's folders (INBOX and any other name) appear on first SELECT/seed()."""
+
+    def __init__(self, port=0, certfile=None, keyfile=None, latency=0.0, fail_rate=0.0):
+        self._boxes = {}
+        self._boxes_lock = threading.Lock()
+        super().__init__(_ImapHandler, port, certfile, keyfile, latency, fail_rate)
+
+    def mailbox(self, user, folder="INBOX") -> Mailbox:
+        key = (user.lower(), "INBOX" if folder.upper() == "INBOX" else folder)
+        with self._boxes_lock:
+            box = self._boxes.get(key)
+            if box is None:
+                box = self._boxes[key] = Mailbox()
+            return box
+
+    def seed(self, user, count, size=2048, attachment_ratio=0.0, attachment_size=64 * 1024, sender_prefix="sender",
+             noise_ratio=0.0, folder="INBOX"):
+        """
+        Append `count` unread messages from distinct senders to `folder`; returns
+        their UIDs. Exactly int(count * noise_ratio) of them, spread evenly, are
+        mail an auto-responder must not answer (lists, bulk, bounces, auto-replies, no-reply).
+        """
+        box = self.mailbox(user, folder)
+        if folder.upper() != "INBOX":
+            sender_prefix = f"{sender_prefix}-{re.sub(r'[^a-z0-9]', '', folder.lower())}-"
+        uids = []
+        for i in range(count):
+            attach = attachment_size if attachment_ratio and random.random() < attachment_ratio else 0
+            sender = f"{sender_prefix}{box.uidnext}-{i}@example.net"
+            extra = ()
+            if int((i + 1) * noise_ratio) > int(i * noise_ratio):
+                prefix, extra = NOISE_KINDS[int(i * noise_ratio) % len(NOISE_KINDS)]
+                if prefix:
+                    sender = f"{prefix}{box.uidnext}@example.net"
+            raw = make_message(sender, user, size, attach, extra_headers=extra)
+            uids.append(box.append(raw))
+        return uids
+
+    def mailbox_stats(self):
+        with self._boxes_lock:
+            boxes = dict(self._boxes)
+        return {user if folder == "INBOX" else f"{user}/{folder}": {"messages": len(box.messages), "seen": box.flagged()}
+                for (user, folder), box in boxes.items()}
+
+
+# -----------------------
+# SMTP sink
+# -----------------------
+class _SmtpHandler(_LineHandler):
+    def handle(self):
+        owner = self.server_owner
+        self.send(b"220 stand-in ESMTP ready\r\n")
+        rcpts = []
+        while True:
+            line = self.readline()
+            if line is None:
+                return
+            verb = line.split(b" ", 1)[0].strip().upper()
+            owner.count("commands")
+            owner.faults.delay()
+            if verb in (b"EHLO", b"HELO"):
+                self.send(b"250-stand-in\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n250 SIZE 52428800\r\n")
+            elif verb == b"AUTH":
+                if line.split()[1].upper() == b"LOGIN" and len(line.split()) == 2:
+                    self.send(b"334 VXNlcm5hbWU6\r\n")
+                    self.readline()
+                    self.send(b"334 UGFzc3dvcmQ6\r\n")
+                    self.readline()
+                elif len(line.split()) == 2:
+                    self.send(b"334 \r\n")
+                    self.readline()
+                self.send(b"235 authenticated\r\n")
+            elif verb == b"MAIL":
+                if owner.faults.should_fail():
+                    owner.count("drops")
+                    self.send(b"421 injected failure, closing\r\n")
+                    return
+                rcpts = []
+                self.send(b"250 sender ok\r\n")
+            elif verb == b"RCPT":
+                rcpts.append(line.split(b":", 1)[1].strip().strip(b"<>").decode("utf-8", "replace"))
+                self.send(b"250 recipient ok\r\n")
+            elif verb == b"DATA":
+                self.send(b"354 end with .\r\n")
+                size = 0
+                while True:
+                    data = self.readline()
+                    if data is None:
+                        return
+                    if data == b".\r\n":
+                        break
+                    size += len(data)
+                owner.delivered(rcpts, size)
+                self.send(b"250 queued\r\n")
+            elif verb == b"QUIT":
+                self.send(b"221 bye\r\n")
+                return
+            else:  # RSET, NOOP, ...
+                self.send(b"250 ok\r\n")
+
+
+class SmtpSink(_BaseStandIn):
+    """Counts accepted messages, bytes and recipients; drops the message content."""
+
+    def __init__(self, port=0, certfile=None, keyfile=None, latency=0.0, fail_rate=0.0):
+        self.recipients = []
+        super().__init__(_SmtpHandler, port, certfile, keyfile, latency, fail_rate)
+
+    def delivered(self, rcpts, size):
+        with self._stats_lock:
+            self.stats["messages"] = self.stats.get("messages", 0) + 1
+            self.stats["bytes"] = self.stats.get("bytes", 0) + size
+            self.recipients.extend(rcpts)
@@ -0,0 +1,906 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio engine for Auto Mail Center: one event loop drives many mailboxes.
+- AsyncImap / AsyncSmtp: small non-blocking IMAP4rev1 and SMTP clients (implicit TLS)
+- load_accounts(): account list from a JSON config file
+- AsyncEngine: per-account auto-responder tasks sharing the sync checkpoint,
+  replied-to store, outbound spool and history index with the threaded GUI worker
+Each extra account costs one coroutine per watched folder, one IMAP socket per
+folder (within the account's max_connections), one SMTP socket and a little state.
+"""
+
+import asyncio
+import base64
+import email.utils
+import json
+import os
+import random
+import re
+import smtplib
+import socket
+import sqlite3
+import threading
+import time
+from email.policy import SMTP as SMTP_POLICY
+
+from synapse_config import (
+    DEFAULT_COALESCE_SECONDS, IMAP_HOST, IMAP_PORT, SMTP_HOST, SMTP_PORT, client_ssl_context, data_path,
+)
+from synapse_metrics import METRICS
+from synapse_imap import (
+    SEEN_FLAG, DEFAULT_FETCH_CHUNK_SIZE, DEFAULT_MAX_IMAP_CONNECTIONS, HEADER_FETCH_ITEMS, IDLE_REFRESH_SECONDS,
+    IMAP_TIMEOUT, RECONNECT_BACKOFF_BASE, RECONNECT_BACKOFF_CAP, STABLE_SESSION_SECONDS, SyncCheckpoint,
+    chunked, compress_uid_set, encode_mailbox, is_throttled, parse_header_fetch,
+)
+from synapse_body import BODYSTRUCTURE_FETCH_ITEMS, collect_previews, plan_text_fetch
+from synapse_smtp import SMTP_MAX_IDLE_SECONDS, SMTP_MAX_MESSAGES_PER_CONN, SMTP_TIMEOUT, connection_lost, quota_exceeded
+from synapse_quota import PRIORITY_BY_KIND, PRIORITY_REPLY, governor_for, parse_send_limits
+from synapse_spool import SPOOL_POLL_SECONDS, OutboundSpool, permanent_failure, retry_delay
+from synapse_store import DEFAULT_REPLY_COOLDOWN_SECONDS, RepliedStore
+from synapse_templates import AutoReplyCache, TemplateLibrary, reply_values
+from synapse_filter import MailFilter
+from synapse_rules import RuleSet, load_rules
+from synapse_folders import dedicated_sessions, parse_folders
+from synapse_pipeline import ALREADY_REPLIED, COALESCED, FAILED, NO_REPLY_RULE, REPLIED, SUPPRESSED
+
+DEFAULT_ACCOUNT_CHECK_INTERVAL = 60  # seconds, when the server has no IDLE
+
+_LITERAL_RE = re.compile(rb"\{(\d+)\+?\}$")
+_CODE_RE = re.compile(rb"^\[([A-Z0-9-]+)(?: ([^\]]*))?\]")
+
+
+class ImapError(Exception):
+    """IMAP command answered NO/BAD, or the server said something unexpected."""
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+# -----------------------
+# Non-blocking IMAP client
+# -----------------------
+class AsyncImap:
+    """
+    Just enough IMAP4rev1 for the auto-responder. Responses are returned in the
+    same shape imaplib uses (untagged data keyed by response name, literals as
+    (prefix, bytes) tuples), so the parsing helpers in synapse_imap apply.
+    """
+
+    def __init__(self, host, port=993, ssl_context=None, timeout=IMAP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context if ssl_context is not None else client_ssl_context()
+        self.timeout = timeout
+        self.capabilities = ()
+        self.untagged = {}
+        self._reader = None
+        self._writer = None
+        self._tagnum = 0
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl_context or None), self.timeout)
+        greeting = await self._readline()
+        if not greeting.startswith(b"* OK") and not greeting.startswith(b"* PREAUTH"):
+            raise ImapError(f"unexpected greeting: {greeting!r}")
+        await self.refresh_capabilities()
+
+    async def refresh_capabilities(self):
+        await self.command("CAPABILITY")
+        caps = self.untagged.pop("CAPABILITY", [b""])[-1]
+        self.capabilities = tuple(caps.decode("ascii", "replace").upper().split())
+        return self.capabilities
+
+    async def login(self, user, password):
+        await self.command("LOGIN", _quote(user), _quote(password))
+        # most servers only advertise extensions once authenticated
+        await self.refresh_capabilities()
+
+    async def select(self, mailbox):
+        self.untagged.clear()
+        await self.command("SELECT", _quote(encode_mailbox(mailbox)))
+        selected = {code: self._pop_int(code) for code in ("EXISTS", "UIDVALIDITY", "UIDNEXT", "HIGHESTMODSEQ")}
+        flags = self.untagged.pop("PERMANENTFLAGS", [b""])[-1]
+        selected["PERMANENTFLAGS"] = tuple(flags.decode("ascii", "replace").strip("()").split())
+        return selected
+
+    async def uid(self, *args):
+        await self.command("UID", *args)
+        name = args[0].upper()
+        return self.untagged.pop(name, [])
+
+    async def idle(self, timeout, stop_event):
+        """IDLE until the server pushes something, `timeout` passes or `stop_event` is set."""
+        tag = self._next_tag()
+        await self._send(f"{tag} IDLE")
+        line = await self._readline()
+        if not line.startswith(b"+"):
+            raise ImapError(f"IDLE rejected: {line!r}")
+        pushed = []
+        # no per-read timeout here: an idle connection is quiet by design
+        read = asyncio.ensure_future(self._reader.readline())
+        stop = asyncio.ensure_future(stop_event.wait())
+        try:
+            done, _ = await asyncio.wait({read, stop}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if read in done:
+                line = read.result()
+                if not line:
+                    raise ConnectionResetError("IMAP server closed the connection")
+                pushed.append(line.rstrip(b"\r\n"))
+        finally:
+            stop.cancel()
+            if not read.done():
+                read.cancel()
+                try:
+                    await read
+                except asyncio.CancelledError:
+                    pass
+        await self._send("DONE")
+        await self._read_response(tag)
+        return pushed
+
+    async def logout(self):
+        try:
+            await asyncio.wait_for(self.command("LOGOUT"), 5)
+        except Exception:
+            pass
+        self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    # ---- protocol ----
+    def _next_tag(self) -> str:
+        self._tagnum += 1
+        return f"S{self._tagnum:05d}"
+
+    async def _send(self, line: str):
+        self._writer.write(line.encode("utf-8") + b"\r\n")
+        await self._writer.drain()
+
+    async def _readline(self) -> bytes:
+        line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+        if not line:
+            raise ConnectionResetError("IMAP server closed the connection")
+        return line.rstrip(b"\r\n")
+
+    async def command(self, *parts):
+        tag = self._next_tag()
+        await self._send(f"{tag} " + " ".join(parts))
+        return await self._read_response(tag)
+
+    async def _read_response(self, tag):
+        tag_b = tag.encode("ascii")
+        while True:
+            line = await self._readline()
+            if line.startswith(tag_b + b" "):
+                status, _, text = line[len(tag_b) + 1:].partition(b" ")
+                if status.upper() != b"OK":
+                    raise ImapError(f"{status.decode()} {text.decode('utf-8', 'replace')}")
+                return text
+            if line.startswith(b"* "):
+                await self._store_untagged(line[2:])
+            elif line.startswith(b"+"):
+                raise ImapError(f"unexpected continuation: {line!r}")
+
+    async def _store_untagged(self, line):
+        m = _LITERAL_RE.search(line)
+        data = [line]
+        while m:
+            literal = await asyncio.wait_for(self._reader.readexactly(int(m.group(1))), self.timeout)
+            data[-1] = (data[-1], literal)
+            tail = await self._readline()
+            data.append(tail)
+            m = _LITERAL_RE.search(tail)
+
+        head = data[0][0] if isinstance(data[0], tuple) else data[0]
+        first, _, rest = head.partition(b" ")
+        if first.isdigit():
+            # "* 12 FETCH (...)" / "* 3 EXISTS": imaplib keeps "12 (...)" under FETCH
+            name, _, rest = rest.partition(b" ")
+            value = first + (b" " + rest if rest else b"")
+        else:
+            name, value = first, rest
+            code = _CODE_RE.match(rest)
+            if name in (b"OK", b"NO", b"BAD") and code:
+                self.untagged.setdefault(code.group(1).decode(), []).append(code.group(2) or b"")
+        if isinstance(data[0], tuple):
+            data[0] = (value, data[0][1])
+        else:
+            data[0] = value
+        bucket = self.untagged.setdefault(name.decode("ascii", "replace").upper(), [])
+        bucket.extend(data if len(data) > 1 else data[:1])
+
+    def _pop_int(self, name):
+        values = self.untagged.pop(name, None)
+        if not values:
+            return None
+        value = values[-1]
+        try:
+            return int((value if isinstance(value, bytes) else value[0]).split()[0])
+        except (ValueError, IndexError):
+            return None
+
+
+# -----------------------
+# Non-blocking SMTP client
+# -----------------------
+class AsyncSmtp:
+    """Implicit-TLS SMTP submission with AUTH PLAIN; errors use smtplib's exception types."""
+
+    def __init__(self, host, port=465, ssl_context=None, timeout=SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context if ssl_context is not None else client_ssl_context()
+        self.timeout = timeout
+        self.sent = 0
+        self.last_used = 0.0
+        self._reader = None
+        self._writer = None
+        self._in_transaction = False  # MAIL FROM accepted, message not yet accepted
+
+    async def connect(self, user, password):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl_context or None), self.timeout)
+        await self._expect(220)
+        await self._cmd(f"EHLO {socket.getfqdn() or 'localhost'}", 250)
+        token = base64.b64encode(f"\0{user}\0{password}".encode("utf-8")).decode("ascii")
+        await self._cmd(f"AUTH PLAIN {token}", 235)
+        self.last_used = time.monotonic()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    async def rset(self):
+        await self._cmd("RSET", 250)
+        self._in_transaction = False
+
+    async def send_message(self, msg):
+        if hasattr(msg, "envelope"):
+            from_addr, rcpts, body = msg.envelope()
+        else:
+            from_addr = email.utils.parseaddr(msg["From"])[1]
+            rcpts = [addr for _, addr in email.utils.getaddresses(msg.get_all("To", []) + msg.get_all("Cc", []))]
+            body = msg.as_bytes(policy=SMTP_POLICY)
+        if self._in_transaction:
+            await self.rset()  # the last send failed part-way; otherwise MAIL FROM gets 503 "nested MAIL"
+        self._in_transaction = True
+        await self._cmd(f"MAIL FROM:<{from_addr}>", 250)
+        for rcpt in rcpts:
+            await self._cmd(f"RCPT TO:<{rcpt}>", (250, 251))
+        await self._cmd("DATA", 354)
+        # dot-stuffing (RFC 5321 4.5.2)
+        body = re.sub(rb"(?m)^\.", b"..", body)
+        if not body.endswith(b"\r\n"):
+            body += b"\r\n"
+        self._writer.write(body + b".\r\n")
+        await self._writer.drain()
+        await self._expect(250)
+        self._in_transaction = False
+        self.sent += 1
+        self.last_used = time.monotonic()
+
+    async def quit(self):
+        if self._writer is None:
+            return
+        try:
+            await asyncio.wait_for(self._cmd("QUIT", 221), 5)
+        except Exception:
+            pass
+        self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._in_transaction = False
+
+    async def _cmd(self, line, expect):
+        self._writer.write(line.encode("utf-8") + b"\r\n")
+        await self._writer.drain()
+        return await self._expect(expect)
+
+    async def _expect(self, expect):
+        expected = expect if isinstance(expect, tuple) else (expect,)
+        lines = []
+        while True:
+            raw = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            if not raw:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("SMTP server closed the connection")
+            lines.append(raw[4:].rstrip(b"\r\n"))
+            if raw[3:4] != b"-":
+                break
+        try:
+            code = int(raw[:3])
+        except ValueError:
+            raise smtplib.SMTPServerDisconnected(f"garbled SMTP reply: {raw!r}") from None
+        if code not in expected:
+            raise smtplib.SMTPResponseException(code, b"\n".join(lines))
+        return code
+
+
+# -----------------------
+# Accounts
+# -----------------------
+class AccountConfig:
+    """One monitored account and the folders watched in it. Built from a JSON object; see load_accounts()."""
+
+    def __init__(self, email_address, password, name=None, phone="", reply_template=None,
+                 imap_host=IMAP_HOST, imap_port=IMAP_PORT, smtp_host=SMTP_HOST, smtp_port=SMTP_PORT,
+                 mailbox="inbox", check_interval=DEFAULT_ACCOUNT_CHECK_INTERVAL, use_idle=True,
+                 reply_cooldown=DEFAULT_REPLY_COOLDOWN_SECONDS, reply_flag=SEEN_FLAG, since_days=None,
+                 ignore_senders=(), server_filter=True, rules=None, mailboxes=None,
+                 max_connections=DEFAULT_MAX_IMAP_CONNECTIONS, send_limits=None,
+                 coalesce_seconds=DEFAULT_COALESCE_SECONDS):
+        self.email = email_address
+        self.password = password
+        self.name = name or email_address
+        self.phone = phone
+        self.reply_template = reply_template  # HTML file (plus an optional .txt beside it), reloaded when edited
+        self.rules = rules  # routing rules file; None: rules.json in the data directory
+        self.imap_host = imap_host
+        self.imap_port = int(imap_port)
+        self.smtp_host = smtp_host
+        self.smtp_port = int(smtp_port)
+        # folders / labels watched concurrently, each on its own IMAP session
+        self.mailboxes = parse_folders(mailboxes if mailboxes is not None else mailbox)
+        self.mailbox = self.mailboxes[0]
+        self.max_connections = max(1, int(max_connections))  # IMAP connections for all folders together
+        self.check_interval = max(1, int(check_interval))
+        self.use_idle = bool(use_idle)
+        self.reply_cooldown = reply_cooldown
+        self.reply_flag = reply_flag  # e.g. "$AutoReplied" to leave the read state alone
+        self.since_days = since_days  # only answer mail received in the last N days
+        self.ignore_senders = tuple(ignore_senders)  # glob patterns never answered
+        self.server_filter = bool(server_filter)  # push list/auto-mail exclusions into SEARCH
+        # {"minute": n, "hour": n, "day": n} or "20, 200, 500", shared with the GUI's sends from this account
+        self.send_limits = parse_send_limits(send_limits)
+        self.coalesce_seconds = coalesce_seconds  # no second reply to a sender answered this recently
+
+    @classmethod
+    def from_dict(cls, raw, base_dir="."):
+        raw = dict(raw)
+        address = raw.pop("email", None)
+        if not address:
+            raise ValueError("account without 'email'")
+        password = raw.pop("password", None)
+        password_env = raw.pop("password_env", None)
+        if password_env:
+            password = os.environ.get(password_env)
+        if not password:
+            raise ValueError(f"account {address}: no 'password' (or 'password_env' is unset)")
+        for key in ("reply_template", "rules"):
+            if raw.get(key):
+                raw[key] = os.path.join(base_dir, os.path.expanduser(raw[key]))
+        known = ("name", "phone", "reply_template", "imap_host", "imap_port", "smtp_host", "smtp_port",
+                 "mailbox", "check_interval", "use_idle", "reply_cooldown", "reply_flag", "since_days",
+                 "ignore_senders", "server_filter", "rules", "mailboxes", "max_connections", "send_limits",
+                 "coalesce_seconds")
+        unknown = set(raw) - set(known)
+        if unknown:
+            raise ValueError(f"account {address}: unknown keys {sorted(unknown)}")
+        return cls(address, password, **raw)
+
+
+def load_accounts(path):
+    """
+    Read the account list:
+        {"accounts": [{"email": "support@example.com", "password_env": "SUPPORT_PW",
+                       "phone": "555-123-4567", "mailboxes": ["inbox", "Support/Billing"]}, ...]}
+    `password` may be given inline instead of `password_env`; "mailbox" names a single folder.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    entries = raw.get("accounts") if isinstance(raw, dict) else raw
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("config has no 'accounts' list")
+    base_dir = os.path.dirname(os.path.abspath(path))
+    accounts = [AccountConfig.from_dict(entry, base_dir) for entry in entries]
+    names = [a.name for a in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError("account names must be unique")
+    return accounts
+
+
+class AccountState:
+    """Live per-account status, read by the UI through AsyncEngine.snapshot()."""
+
+    __slots__ = ("config", "status", "replies_sent", "last_check", "connected_at", "sessions",
+                 "reconnects", "last_error", "mail_filter", "rules", "spool", "outbox_wake", "governor")
+
+    def __init__(self, config):
+        self.config = config
+        self.status = "starting"
+        self.replies_sent = 0
+        self.last_check = None
+        self.connected_at = None  # since when at least one folder session has been up
+        self.sessions = 0  # open IMAP sessions
+        self.reconnects = 0
+        self.last_error = ""
+        self.mail_filter = MailFilter([config.email], since_days=config.since_days,
+                                      ignore_senders=config.ignore_senders, server_side=config.server_filter)
+        self.rules = RuleSet()
+        self.spool = None  # OutboundSpool the folders' tasks queue replies in
+        self.outbox_wake = None  # set when a reply is queued; wakes the account's outbox task
+        self.governor = None  # SendGovernor of the account (set by the engine)
+
+
+# -----------------------
+# Engine
+# -----------------------
+class AsyncEngine:
+    """
+    Runs one auto-responder task per account, and under it one per watched
+    folder, on a single event loop. Each folder task keeps its own IMAP session
+    open (IDLE when available, otherwise polls every check_interval); folders
+    beyond the account's max_connections take turns on one connection. Replies
+    to new senders are queued in the outbound spool, which one more task per
+    account drains over its kept-alive SMTP session (retries, dead letters);
+    progress is recorded in the shared checkpoint / replied-to store.
+    Use start_in_thread()/stop() from a GUI, or run() under asyncio.run().
+    """
+
+    def __init__(self, accounts, log=None, checkpoint=None, ssl_context=None,
+                 fetch_chunk_size=DEFAULT_FETCH_CHUNK_SIZE, metrics=None, templates=None, history=None):
+        self.accounts = [AccountState(cfg) for cfg in accounts]
+        self.log = log or (lambda text: None)
+        self.checkpoint = checkpoint or SyncCheckpoint(data_path("sync_checkpoint.json"))
+        self.ssl_context = ssl_context
+        self.fetch_chunk_size = fetch_chunk_size
+        self.metrics = metrics or METRICS
+        self.reply_cache = AutoReplyCache(max(len(self.accounts), 1) * 2)
+        self.templates = templates or TemplateLibrary(log=self.log)
+        self.history = history  # MessageIndex every handled message is recorded in, if given
+        for st in self.accounts:
+            st.governor = governor_for(st.config.email, st.config.send_limits,
+                                       log=lambda text, st=st: self._log(st, text), metrics=self.metrics)
+        self._loop = None
+        self._stop = None
+        self._stop_requested = False
+        self._thread = None
+
+    # ---- control ----
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if self._stop_requested:
+            self._stop.set()
+        tasks = [asyncio.create_task(self._run_account(st), name=f"account-{st.config.name}") for st in self.accounts]
+        try:
+            await self._stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for st in self.accounts:
+                st.governor.save()  # the quota used so far still counts after a restart
+
+    def start_in_thread(self):
+        self._thread = threading.Thread(target=lambda: asyncio.run(self.run()), name="async-engine", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Thread-safe: ask every account task to finish and the loop to exit."""
+        self._stop_requested = True
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return [{
+            "name": st.config.name,
+            "email": st.config.email,
+            "status": st.status,
+            "folders": len(st.config.mailboxes),
+            "sessions": st.sessions,
+            "replies_sent": st.replies_sent,
+            "last_check": st.last_check,
+            "session_age": (now - st.connected_at) if st.connected_at else 0.0,
+            "reconnects": st.reconnects,
+            "last_error": st.last_error,
+            "quota": st.governor.describe(),
+        } for st in self.accounts]
+
+    # ---- per account ----
+    def _log(self, st, text, mailbox=None):
+        if mailbox is not None and len(st.config.mailboxes) > 1:
+            self.log(f"[{st.config.name} · {mailbox}] {text}")
+        else:
+            self.log(f"[{st.config.name}] {text}")
+
+    async def _run_account(self, st):
+        cfg = st.config
+        if cfg.reply_template and not os.path.isfile(cfg.reply_template):
+            self._log(st, f"⚠ Cannot read reply template, using default: {cfg.reply_template}")
+        try:
+            st.rules = load_rules(cfg.rules)
+        except (OSError, ValueError) as e:
+            self._log(st, f"⚠ Routing rules not loaded: {e}")
+        if st.rules:
+            self._log(st, f"🧭 {len(st.rules)} routing rules loaded")
+        replied = RepliedStore(data_path("replied.sqlite3"), cfg.email, default_cooldown=cfg.reply_cooldown)
+        smtp = AsyncSmtp(cfg.smtp_host, cfg.smtp_port, self.ssl_context)
+        st.spool = OutboundSpool(data_path("outbox.sqlite3"), cfg.email)
+        st.outbox_wake = asyncio.Event()
+        waiting = st.spool.counts()
+        if waiting["queued"]:
+            self._log(st, f"📤 {waiting['queued']} message(s) left in the outbox — sending")
+        if waiting["dead"]:
+            self._log(st, f"⚠ {waiting['dead']} dead letter(s) in the outbox")
+        slots = asyncio.Semaphore(cfg.max_connections)
+        dedicated = dedicated_sessions(len(cfg.mailboxes), cfg.max_connections, reserved=0)
+        if dedicated < len(cfg.mailboxes):
+            self._log(st, f"⚠ {len(cfg.mailboxes)} folders but max_connections is {cfg.max_connections} — "
+                          f"{len(cfg.mailboxes) - dedicated} folder(s) take turns polling on a shared connection")
+        tasks = [asyncio.create_task(self._run_folder(st, mailbox, i < dedicated, slots, replied),
+                                     name=f"folder-{cfg.name}-{mailbox}")
+                 for i, mailbox in enumerate(cfg.mailboxes)]
+        tasks.append(asyncio.create_task(self._drain_outbox(st, smtp), name=f"outbox-{cfg.name}"))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            st.status = "stopped"
+            await smtp.quit()
+            replied.close()
+            st.spool.close()  # anything not sent yet stays queued for the next start
+
+    async def _run_folder(self, st, mailbox, dedicated, slots, replied):
+        """
+        Serve one folder until the engine stops. A `dedicated` folder keeps its
+        session (one of the account's `slots`) open; the others connect, check and
+        hang up, then wait check_interval without holding a connection.
+        """
+        cfg = st.config
+        failures = 0
+        while not self._stop.is_set():
+            imap = AsyncImap(cfg.imap_host, cfg.imap_port, self.ssl_context)
+            started = time.monotonic()
+            ok = False
+            async with slots:
+                try:
+                    await self._serve_session(st, mailbox, imap, replied, dedicated, reconnect=failures > 0)
+                    ok = True
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    st.last_error = str(e)
+                    st.status = "reconnecting"
+                    self._log(st, f"⚠ Session error: {e}", mailbox)
+                finally:
+                    imap.close()
+            if ok and not dedicated:
+                failures = 0
+                if await self._sleep(cfg.check_interval):
+                    break
+                continue
+            if time.monotonic() - started >= STABLE_SESSION_SECONDS:
+                failures = 0
+            failures += 1
+            ceiling = min(RECONNECT_BACKOFF_CAP, RECONNECT_BACKOFF_BASE * (2 ** (failures - 1)))
+            await self._sleep(random.uniform(0, ceiling))
+
+    async def _sleep(self, seconds) -> bool:
+        """Sleep up to `seconds`; True if the engine is stopping."""
+        try:
+            await asyncio.wait_for(self._stop.wait(), seconds)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _serve_session(self, st, mailbox, imap, replied, keep_open=True, reconnect=False):
+        """Connect and sync `mailbox`; with `keep_open`, then wait for new mail until stopped, else log out."""
+        cfg = st.config
+        metrics = self.metrics
+        with metrics.timer("imap_connect"):
+            await imap.connect()
+        with metrics.timer("imap_login"):
+            await imap.login(cfg.email, cfg.password)
+            if "ENABLE" in imap.capabilities and ("CONDSTORE" in imap.capabilities or "QRESYNC" in imap.capabilities):
+                await imap.command("ENABLE", "CONDSTORE")
+        with metrics.timer("imap_select"):
+            selected = await imap.select(mailbox)
+        if reconnect:
+            st.reconnects += 1
+            metrics.inc("imap_reconnects")
+        st.sessions += 1
+        if st.connected_at is None:
+            st.connected_at = time.monotonic()
+        st.last_error = ""
+        use_idle = cfg.use_idle and "IDLE" in imap.capabilities
+        if keep_open:
+            self._log(st, "⚡ Connected (push mode)" if use_idle else "✓ Connected (polling)", mailbox)
+
+        try:
+            fresh = True
+            while not self._stop.is_set():
+                st.status = "checking"
+                await self._sync(st, mailbox, imap, replied, selected, fresh)
+                fresh = False
+                st.last_check = time.time()
+                if "EXISTS" in imap.untagged:
+                    continue  # mail arrived while we were syncing; IDLE would not announce it again
+                st.status = "idle"
+                if not keep_open:
+                    break
+                if use_idle:
+                    await imap.idle(IDLE_REFRESH_SECONDS, self._stop)
+                else:
+                    if await self._sleep(cfg.check_interval):
+                        break
+                    await imap.command("NOOP")
+            await imap.logout()
+        finally:
+            st.sessions -= 1
+            if not st.sessions:
+                st.connected_at = None
+
+    async def _sync(self, st, mailbox, imap, replied, selected, fresh):
+        """Same incremental checkpoint semantics as the GUI worker, sequential per folder."""
+        cfg = st.config
+        key = f"{cfg.email}:{mailbox}"
+        uidvalidity = selected.get("UIDVALIDITY")
+        imap.untagged.clear()  # EXISTS/EXPUNGE noise from IDLE/NOOP; the search below is authoritative
+        cp = self.checkpoint.get(key)
+        if cp is not None and cp.get("uidvalidity") != uidvalidity:
+            self._log(st, "⚠ UIDVALIDITY changed — resyncing from unread messages", mailbox)
+            self.checkpoint.reset(key)
+            cp = None
+        modseq = selected.get("HIGHESTMODSEQ")
+        if cp is not None and fresh and modseq is not None and cp.get("highestmodseq") == modseq:
+            return
+
+        last_uid = cp["last_uid"] if cp is not None else 0
+        flag = cfg.reply_flag
+        if flag != SEEN_FLAG and "\\*" not in selected.get("PERMANENTFLAGS", ()):
+            flag = SEEN_FLAG  # mailbox does not accept keywords
+        if cp is not None:
+            base = f"UID {last_uid + 1}:*"
+        else:
+            base = "UNSEEN" if flag == SEEN_FLAG else f"UNSEEN UNKEYWORD {flag}"
+        mail_filter = st.mail_filter
+        metrics = self.metrics
+        metrics.inc("sync_cycles")
+        try:
+            with metrics.timer("imap_search"):
+                found = await imap.uid("SEARCH", mail_filter.search_criteria(base))
+        except ImapError as e:
+            if not mail_filter.server_side or is_throttled(e):
+                raise
+            self._log(st, "⚠ Server rejected the filtered SEARCH — filtering headers locally", mailbox)
+            mail_filter.server_side = False
+            with metrics.timer("imap_search"):
+                found = await imap.uid("SEARCH", mail_filter.search_criteria(base))
+        uids = [int(u) for u in b" ".join(x for x in found if isinstance(x, bytes)).split()]
+        uids = [u for u in uids if u > last_uid]
+
+        complete = True
+        for chunk in chunked(uids, self.fetch_chunk_size):
+            with metrics.timer("imap_fetch"):
+                data = await imap.uid("FETCH", compress_uid_set(chunk), HEADER_FETCH_ITEMS)
+            with metrics.timer("parse"):
+                fetched = parse_header_fetch(data)
+            metrics.inc("messages_fetched", len(fetched))
+            previews = {}
+            templates = [self.templates.reply(name, cfg.reply_template) for name in st.rules.templates]
+            if any("excerpt" in t.fields for t in [self.templates.auto_reply(cfg.reply_template)] + templates):
+                with metrics.timer("imap_fetch_body"):
+                    previews = await self._fetch_previews(imap, [uid for uid, _ in fetched])
+            handled = []
+            done_uid = None
+            for uid, headers in sorted(fetched, key=lambda pair: pair[0]):
+                if self._stop.is_set():
+                    complete = False
+                    break
+                sender = email.utils.parseaddr(headers.get("From", ""))[1]
+                reason = mail_filter.suppress_reason(headers, sender)
+                if reason:
+                    # bulk/automatic mail is never answered and keeps its flags
+                    metrics.inc("messages_suppressed")
+                    self._log(st, f"🚫 Not replying to {sender or '(no sender)'}: {reason}", mailbox)
+                    self._record(st, mailbox, uid, sender, headers, SUPPRESSED, reason)
+                    done_uid = uid
+                    continue
+                rule = st.rules.match_message(headers, sender)
+                if rule is not None:
+                    metrics.inc("rule_matches")
+                    if not rule.reply:
+                        self._log(st, f"🚫 Not replying to {sender}: {rule.describe()}", mailbox)
+                        self._record(st, mailbox, uid, sender, headers, NO_REPLY_RULE, rule.describe())
+                        done_uid = uid
+                        continue
+                if self._coalesced(st, replied, sender):
+                    # a burst from one sender gets one reply
+                    metrics.inc("replies_coalesced")
+                    self._log(st, f"🔗 {sender} wrote again — covered by the reply already sent", mailbox)
+                    self._record(st, mailbox, uid, sender, headers, COALESCED)
+                elif not replied.recently_replied(sender):
+                    # queued and marked with no await in between, so another folder's task sees it at once
+                    template = self.templates.reply(rule.template, cfg.reply_template) if rule and rule.template else None
+                    if not self._queue_reply(st, sender, reply_values(headers, previews.get(uid, "")), template,
+                                             original=headers):
+                        self._record(st, mailbox, uid, sender, headers, FAILED, "not queued")
+                        complete = False
+                        break
+                    replied.mark_replied(sender, cooldown=rule.cooldown if rule is not None else None)
+                    self._record(st, mailbox, uid, sender, headers, REPLIED, replied_at=time.time())
+                else:
+                    self._record(st, mailbox, uid, sender, headers, ALREADY_REPLIED)
+                handled.append(uid)
+                done_uid = uid
+            if handled:
+                # one ranged STORE per chunk, only for messages whose reply is recorded
+                with metrics.timer("imap_store"):
+                    await imap.uid("STORE", compress_uid_set(handled), "+FLAGS.SILENT", f"({flag})")
+            if done_uid is not None:
+                last_uid = max(last_uid, done_uid)
+            if cp is not None:
+                self.checkpoint.update(key, uidvalidity=uidvalidity, last_uid=last_uid, highestmodseq=None)
+            if not complete:
+                break
+
+        if complete:
+            if cp is None:
+                last_uid = max(last_uid, (selected.get("UIDNEXT") or 1) - 1)
+            self.checkpoint.update(key, uidvalidity=uidvalidity, last_uid=last_uid,
+                                   highestmodseq=modseq if fresh or cp is None else None)
+
+    def _record(self, st, mailbox, uid, sender, headers, outcome, detail="", replied_at=None):
+        if self.history is not None:
+            self.history.record(st.config.email, mailbox, uid, sender, headers, outcome, detail, replied_at)
+
+    @staticmethod
+    def _coalesced(st, replied, sender) -> bool:
+        """True if `sender` was answered less than coalesce_seconds ago (and is due again by cooldown)."""
+        window = st.config.coalesce_seconds
+        if not window or replied.recently_replied(sender):
+            return False
+        last = replied.last_replied(sender)
+        return last is not None and time.time() - last < window
+
+    async def _fetch_previews(self, imap, uids):
+        """{uid: excerpt}: BODYSTRUCTURE, then each message's text part capped at BODY_PREVIEW_BYTES."""
+        if not uids:
+            return {}
+        parts, commands = plan_text_fetch(await imap.uid("FETCH", compress_uid_set(uids), BODYSTRUCTURE_FETCH_ITEMS))
+        previews = {}
+        for uid_set, items in commands:
+            collect_previews(await imap.uid("FETCH", uid_set, items), parts, previews, metrics=self.metrics)
+        return previews
+
+    def _queue_reply(self, st, to_address, values=None, template=None, original=None) -> bool:
+        """
+        Spool the auto-reply to `to_address` for the outbox task; False if it
+        could not be written (the message is then retried next sync).
+        `values`: template values of the message being answered (reply_values()); `template`: a rule's;
+        `original`: the headers of that message.
+        """
+        cfg = st.config
+        template = template or self.templates.auto_reply(cfg.reply_template)
+        msg = self.reply_cache.render(cfg.email, to_address, cfg.phone, template, values, original)
+        try:
+            st.spool.enqueue(msg, kind="reply")
+        except (sqlite3.Error, ValueError) as e:
+            self.metrics.inc("reply_errors")
+            self._log(st, f"❌ ERROR queueing auto-reply to {to_address}: {e}")
+            return False
+        self.metrics.inc("spool_enqueued")
+        st.outbox_wake.set()
+        return True
+
+    async def _drain_outbox(self, st, smtp):
+        """
+        Send the account's spooled mail over its SMTP session, one message at a
+        time, by SpoolSender's rules: each send waits for the account's quota; a
+        permanent failure or the last allowed attempt moves the message to the
+        dead letters, anything else is retried later with backoff while the rest
+        of the outbox keeps going. A lost connection or rejected login pauses the
+        outbox, for longer after each consecutive one.
+        """
+        spool = st.spool
+        outages = 0
+        while not self._stop.is_set():
+            try:
+                entry = spool.claim()
+            except sqlite3.Error as e:
+                self._log(st, f"❌ Outbox error: {e}")
+                if await self._wait_outbox(st, SPOOL_POLL_SECONDS):
+                    break
+                continue
+            if entry is None:
+                due = spool.next_due()
+                if await self._wait_outbox(st, SPOOL_POLL_SECONDS if due is None
+                                           else min(SPOOL_POLL_SECONDS, due - time.time())):
+                    break
+                continue
+            priority = PRIORITY_BY_KIND.get(entry.kind, PRIORITY_REPLY)
+            delay = st.governor.try_acquire(priority)
+            while delay and not await self._sleep(delay):
+                # over the account's send quota: the outbox waits here, the folders keep reading mail
+                delay = st.governor.try_acquire(priority, retry=True)
+            if delay:
+                spool.release(entry)  # stopping; it is sent after the next start
+                break
+
+            to_address = ", ".join(entry.rcpts)
+            error = await self._deliver(st, smtp, entry)
+            if error is None:
+                outages = 0
+                spool.delivered(entry)
+                st.replies_sent += 1
+                self.metrics.inc("replies_sent")
+                self._log(st, f"✓ Auto-reply sent to {to_address}")
+                continue
+            permanent = permanent_failure(error)
+            self.metrics.inc("reply_errors")
+            if spool.failed(entry, error, permanent):
+                self.metrics.inc("spool_dead_letters")
+                why = "rejected" if permanent else f"failed {entry.attempts} times"
+                self._log(st, f"❌ Auto-reply to {to_address} {why} — moved to dead letters: {error}")
+                continue
+            self.metrics.inc("spool_retries")
+            self._log(st, f"⚠ Auto-reply to {to_address} failed (attempt {entry.attempts}), will retry: {error}")
+            if quota_exceeded(error):
+                st.governor.exhausted()
+            elif connection_lost(error) or isinstance(error, smtplib.SMTPAuthenticationError):
+                outages += 1
+                if await self._sleep(retry_delay(outages)):
+                    break
+            else:
+                outages = 0
+
+    async def _wait_outbox(self, st, seconds) -> bool:
+        """Sleep up to `seconds` or until a reply is queued; True if the engine is stopping."""
+        waiters = [asyncio.ensure_future(self._stop.wait()), asyncio.ensure_future(st.outbox_wake.wait())]
+        try:
+            await asyncio.wait(waiters, timeout=max(0.05, seconds), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        st.outbox_wake.clear()
+        return self._stop.is_set()
+
+    async def _deliver(self, st, smtp, entry):
+        """Send one spooled message, reconnecting once if the session was lost; returns the error (None: sent)."""
+        cfg = st.config
+        for attempt in (1, 2):
+            try:
+                stale = smtp.connected and (smtp.sent >= SMTP_MAX_MESSAGES_PER_CONN
+                                            or time.monotonic() - smtp.last_used > SMTP_MAX_IDLE_SECONDS)
+                if stale:
+                    await smtp.quit()
+                    smtp.sent = 0
+                if not smtp.connected:
+                    smtp.sent = 0
+                    with self.metrics.timer("smtp_connect"):
+                        await smtp.connect(cfg.email, cfg.password)
+                with self.metrics.timer("smtp_send"):
+                    await smtp.send_message(entry)
+                return None
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                lost = not isinstance(e, smtplib.SMTPException) or connection_lost(e)
+                if lost:
+                    smtp.close()
+                if lost and attempt == 1:
+                    continue
+                if not isinstance(e, OSError):
+                    e = smtplib.SMTPServerDisconnected(f"SMTP session lost: {e!r}")  # transient, like a socket error
+                return e
+            except Exception as e:  # a message that cannot be sent as it is
+                smtp.close()
+                return e
+        return None
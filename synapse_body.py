@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Partial body fetch for Auto Mail Center: read a message's text without
+downloading its attachments.
+- parse_bodystructure_fetch(): UID FETCH (BODYSTRUCTURE) -> the readable text part
+  of each message (text/plain preferred, text/html otherwise; attachments skipped)
+- text_fetch_items(): BODY.PEEK[<section>]<0.<limit>> so at most `limit` bytes
+  of that part are transferred
+- decode_text(): feeds the (possibly truncated) bytes through BytesFeedParser
+- excerpt(): the first lines the sender wrote, for the {excerpt} placeholder
+"""
+
+import html
+import re
+from email.parser import BytesFeedParser
+
+from synapse_imap import compress_uid_set, fetch_literals
+
+# bytes of the text part fetched per message; enough for the first paragraphs
+BODY_PREVIEW_BYTES = 8192
+# characters kept by excerpt()
+EXCERPT_CHARS = 300
+# BytesFeedParser is fed this much at a time
+FEED_CHUNK_SIZE = 2048
+BODYSTRUCTURE_FETCH_ITEMS = "(UID BODYSTRUCTURE)"
+
+_ATOM_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+_LITERAL_TAIL_RE = re.compile(rb"\{(\d+)\}\s*$")
+_QP_TAIL_RE = re.compile(rb"=[0-9A-Fa-f]?$")
+_HTML_DROP_RE = re.compile(r"(?is)<(script|style|head)\b.*?</\1\s*>")
+_HTML_BREAK_RE = re.compile(r"(?i)<br\s*/?>|</(p|div|li|tr|h[1-6])\s*>")
+_HTML_TAG_RE = re.compile(r"(?s)<[^>]*>")
+# "On Tue, 3 Mar 2026 ... wrote:" starts the quoted original
+_QUOTE_INTRO_RE = re.compile(r"^On .{0,200} wrote:\s*$")
+
+
+class TextPart:
+    """The part of a message worth reading, as located by BODYSTRUCTURE."""
+
+    __slots__ = ("section", "subtype", "encoding", "charset", "size")
+
+    def __init__(self, section, subtype, encoding="7bit", charset="us-ascii", size=0):
+        self.section = section
+        self.subtype = subtype
+        self.encoding = encoding
+        self.charset = charset
+        self.size = size
+
+    def __repr__(self):
+        return f"TextPart({self.section!r}, text/{self.subtype}, {self.encoding}, {self.charset}, {self.size}B)"
+
+
+# -----------------------
+# BODYSTRUCTURE
+# -----------------------
+def _tokens(data):
+    """Atoms, strings and parentheses of a FETCH response; literals arrive as (prefix, bytes) tuples."""
+    for part in data or ():
+        if isinstance(part, tuple):
+            text, literal = part[0], part[1]
+            m = _LITERAL_TAIL_RE.search(text)
+            yield from _text_tokens(text[:m.start()] if m else text)
+            yield ("str", literal)
+        elif isinstance(part, bytes):
+            yield from _text_tokens(part)
+
+
+def _text_tokens(text):
+    pos = 0
+    while pos < len(text):
+        m = _ATOM_RE.match(text, pos)
+        if not m or m.end() == pos:
+            break
+        pos = m.end()
+        if m.group(1):
+            yield ("(", None)
+        elif m.group(2):
+            yield (")", None)
+        elif m.group(3) is not None:
+            yield ("str", re.sub(rb"\\(.)", rb"\1", m.group(3)))
+        elif m.group(4):
+            atom = m.group(4)
+            yield ("str", None) if atom.upper() == b"NIL" else ("atom", atom)
+
+
+def _parse_list(tokens):
+    """Nested lists from the token stream, up to the matching ")"."""
+    items = []
+    for kind, value in tokens:
+        if kind == "(":
+            items.append(_parse_list(tokens))
+        elif kind == ")":
+            return items
+        else:
+            items.append(value)
+    return items
+
+
+def _text(value) -> str:
+    return value.decode("utf-8", "replace") if isinstance(value, bytes) else ""
+
+
+def _walk(node, section, found):
+    if not node:
+        return
+    if isinstance(node[0], list):  # multipart: children, then the subtype
+        number = 0
+        for child in node:
+            if not isinstance(child, list):
+                break
+            number += 1
+            _walk(child, f"{section}.{number}" if section else str(number), found)
+        return
+    if _text(node[0]).lower() != "text" or len(node) < 7:
+        return  # attachments, images, forwarded messages
+    subtype = _text(node[1]).lower()
+    if subtype not in ("plain", "html") or subtype in found:
+        return
+    disposition = node[9] if len(node) > 9 else None
+    if isinstance(disposition, list) and disposition and _text(disposition[0]).lower() == "attachment":
+        return
+    params = node[2] if isinstance(node[2], list) else []
+    params = {_text(k).lower(): _text(v) for k, v in zip(params[::2], params[1::2])}
+    try:
+        size = int(node[6])
+    except (TypeError, ValueError):
+        size = 0
+    found[subtype] = TextPart(section or "1", subtype, _text(node[5]).lower() or "7bit",
+                              params.get("charset") or "us-ascii", size)
+
+
+def find_text_part(structure):
+    """The first text/plain part of a parsed BODYSTRUCTURE, else the first text/html one (or None)."""
+    found = {}
+    _walk(structure, "", found)
+    return found.get("plain") or found.get("html")
+
+
+def parse_bodystructure_fetch(data):
+    """(uid, TextPart or None) for each message in a UID FETCH (UID BODYSTRUCTURE) response."""
+    tokens = _tokens(data)
+    results = []
+    for kind, _ in tokens:
+        if kind != "(":
+            continue  # the message sequence number
+        items = _parse_list(tokens)
+        pairs = {_text(k).upper(): v for k, v in zip(items[::2], items[1::2]) if isinstance(k, bytes)}
+        try:
+            uid = int(pairs.get("UID"))
+        except (TypeError, ValueError):
+            continue
+        structure = pairs.get("BODYSTRUCTURE") or pairs.get("BODY")
+        results.append((uid, find_text_part(structure) if isinstance(structure, list) else None))
+    return results
+
+
+def text_fetch_items(section, limit=BODY_PREVIEW_BYTES) -> str:
+    """FETCH items for the first `limit` bytes of one part; PEEK leaves \\Seen untouched."""
+    return f"(UID BODY.PEEK[{section}]<0.{int(limit)}>)"
+
+
+def plan_text_fetch(bodystructure_data, limit=BODY_PREVIEW_BYTES):
+    """
+    Parts to read and the UID FETCH commands that read them: ({uid: TextPart},
+    [(uid set, fetch items)]). Messages whose text sits in the same section share
+    one command.
+    """
+    parts = {uid: part for uid, part in parse_bodystructure_fetch(bodystructure_data) if part is not None}
+    by_section = {}
+    for uid, part in sorted(parts.items()):
+        by_section.setdefault(part.section, []).append(uid)
+    return parts, [(compress_uid_set(uids), text_fetch_items(section, limit)) for section, uids in by_section.items()]
+
+
+# -----------------------
+# Decoding
+# -----------------------
+def _trim_partial(raw, encoding):
+    """Drop a transfer-encoded unit cut in half by the byte-range limit."""
+    if encoding == "base64":
+        end = raw.rfind(b"\n")
+        if end >= 0:
+            return raw[:end + 1]
+        compact = re.sub(rb"\s+", b"", raw)
+        return compact[:len(compact) // 4 * 4]
+    if encoding == "quoted-printable":
+        return _QP_TAIL_RE.sub(b"", raw)
+    return raw
+
+
+def html_to_text(source: str) -> str:
+    text = _HTML_DROP_RE.sub("", source)
+    text = _HTML_BREAK_RE.sub("\n", text)
+    return html.unescape(_HTML_TAG_RE.sub("", text))
+
+
+def decode_text(raw, part, truncated=True) -> str:
+    """
+    Text of a (possibly truncated) part body. The bytes are fed to BytesFeedParser
+    in FEED_CHUNK_SIZE pieces under a synthetic header carrying the part's type,
+    charset and transfer encoding, so decoding never needs more than the capped fetch.
+    """
+    parser = BytesFeedParser()
+    charset = re.sub(r"[^A-Za-z0-9_.:-]", "", part.charset) or "us-ascii"
+    parser.feed(f"Content-Type: text/{part.subtype}; charset=\"{charset}\"\r\n"
+                f"Content-Transfer-Encoding: {part.encoding}\r\n\r\n".encode("ascii", "replace"))
+    if truncated:
+        raw = _trim_partial(raw, part.encoding)
+    for start in range(0, len(raw), FEED_CHUNK_SIZE):
+        parser.feed(raw[start:start + FEED_CHUNK_SIZE])
+    payload = parser.close().get_payload(decode=True) or b""
+    try:
+        text = payload.decode(charset, "replace")
+    except LookupError:
+        text = payload.decode("utf-8", "replace")
+    if truncated:
+        text = text.rstrip("�")  # a multi-byte character cut at the limit
+    return html_to_text(text) if part.subtype == "html" else text
+
+
+def excerpt(text, limit=EXCERPT_CHARS) -> str:
+    """The sender's own first lines: quoted replies and the signature dropped, whitespace collapsed."""
+    kept = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith(">") or _QUOTE_INTRO_RE.match(stripped):
+            break
+        if line.rstrip() == "--" or line.startswith("-- "):
+            break
+        kept.append(stripped)
+    flat = " ".join(" ".join(kept).split())
+    if len(flat) <= limit:
+        return flat
+    cut = flat[:limit].rsplit(" ", 1)[0] or flat[:limit]
+    return cut + "…"
+
+
+# -----------------------
+# imaplib
+# -----------------------
+def fetch_text_previews(mail, uids, limit=BODY_PREVIEW_BYTES, metrics=None):
+    """
+    {uid: excerpt} for `uids` on an imaplib connection: one BODYSTRUCTURE fetch,
+    then one capped BODY.PEEK fetch per distinct text section. Messages without a
+    readable text part, or whose fetch failed, are left out.
+    """
+    if not uids:
+        return {}
+    status, data = mail.uid("FETCH", compress_uid_set(uids), BODYSTRUCTURE_FETCH_ITEMS)
+    if status != "OK":
+        return {}
+    parts, commands = plan_text_fetch(data, limit)
+    previews = {}
+    for uid_set, items in commands:
+        status, data = mail.uid("FETCH", uid_set, items)
+        if status != "OK":
+            continue
+        collect_previews(data, parts, previews, limit, metrics)
+    return previews
+
+
+def collect_previews(data, parts, previews, limit=BODY_PREVIEW_BYTES, metrics=None):
+    """Decode one capped BODY.PEEK fetch response into `previews` ({uid: excerpt})."""
+    for uid, raw in fetch_literals(data):
+        part = parts.get(uid)
+        if part is None:
+            continue
+        if metrics is not None:
+            metrics.inc("body_bytes_fetched", len(raw))
+        previews[uid] = excerpt(decode_text(raw, part, truncated=len(raw) >= limit))
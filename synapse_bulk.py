@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Mail-merge bulk sending for Auto Mail Center's Composer.
+Recipients come from CSV or JSONL (columns/keys: email, name, template) and are
+sent through a bounded worker pool. Completed rows are appended to a progress
+file so an interrupted run resumes without re-sending.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+from synapse_config import DEFAULT_BULK_WORKERS  # re-exported (see __all__)
+from synapse_quota import PRIORITY_BULK
+from synapse_smtp import quota_exceeded
+
+__all__ = [  # DEFAULT_BULK_WORKERS is re-exported from synapse_config
+    "DEFAULT_BULK_WORKERS", "BULK_QUEUE_DEPTH", "load_recipients", "progress_path_for", "BulkSendJob"
+]
+
+# rows buffered ahead of the workers, per worker
+BULK_QUEUE_DEPTH = 4
+
+
+# -----------------------
+# Recipient loading
+# -----------------------
+def load_recipients(path):
+    """
+    Read a recipient list. `.jsonl`/`.ndjson` files hold one JSON object per line,
+    anything else is read as CSV with a header row. Keys are case-insensitive;
+    missing name/template come back as "".
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        if ext in (".jsonl", ".ndjson"):
+            rows = []
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError as e:
+                    raise ValueError(f"{os.path.basename(path)} line {lineno}: {e}") from None
+        else:
+            rows = list(csv.DictReader(f))
+
+    recipients = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            raise ValueError(f"{os.path.basename(path)} row {index + 1}: expected an object")
+        norm = {str(k).strip().lower(): ("" if v is None else str(v).strip()) for k, v in row.items() if k is not None}
+        recipients.append({
+            "index": index,
+            "email": norm.get("email", ""),
+            "name": norm.get("name", ""),
+            "template": norm.get("template", ""),
+        })
+    return recipients
+
+
+def progress_path_for(recipients_path, directory):
+    """Progress file for a recipient list, keyed by its absolute path."""
+    digest = hashlib.sha1(os.path.abspath(recipients_path).encode("utf-8")).hexdigest()[:16]
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{digest}.done")
+
+
+def _row_key(row) -> str:
+    return f"{row['index']}:{row['email'].lower()}"
+
+
+# -----------------------
+# Bulk job
+# -----------------------
+class BulkSendJob:
+    """
+    Send one message per recipient row using `workers` threads.
+    - build_message(row) -> email.message.Message (raise ValueError to skip a bad row)
+    - send(msg) delivers it (e.g. SmtpPool.send)
+    - governor (optional SendGovernor) paces the sends; rows wait behind auto-replies
+    Rows listed in `progress_path` are skipped; every successful row is appended to
+    it. A bounded queue keeps the feeder at most a few rows ahead of the workers.
+    """
+
+    def __init__(self, recipients, build_message, send, workers=DEFAULT_BULK_WORKERS,
+                 progress_path=None, log=None, governor=None):
+        self.recipients = recipients
+        self.build_message = build_message
+        self.send = send
+        self.workers = max(1, int(workers))
+        self.progress_path = progress_path
+        self.log = log or (lambda text: None)
+        self.governor = governor
+
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=self.workers * BULK_QUEUE_DEPTH)
+        self._threads = []
+        self._active_workers = 0
+        self._progress_file = None
+
+        self.total = len(recipients)
+        self.resumed = 0
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started_at = None
+        self.finished_at = None
+
+    # ---- progress file ----
+    def _load_done(self):
+        if not self.progress_path or not os.path.exists(self.progress_path):
+            return set()
+        with open(self.progress_path, "r", encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+
+    def remaining(self) -> int:
+        done = self._load_done()
+        return sum(1 for row in self.recipients if _row_key(row) not in done)
+
+    def reset_progress(self):
+        if self.progress_path and os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+
+    # ---- lifecycle ----
+    def start(self):
+        done = self._load_done()
+        if self.progress_path:
+            self._progress_file = open(self.progress_path, "a", encoding="utf-8")
+        self.started_at = time.monotonic()
+        self._active_workers = self.workers
+        feeder = threading.Thread(target=self._feed, args=(done,), name="bulk-feeder", daemon=True)
+        self._threads = [feeder] + [
+            threading.Thread(target=self._work, name=f"bulk-worker-{i}", daemon=True) for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def is_running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def join(self, timeout=None):
+        for t in self._threads:
+            t.join(timeout)
+
+    def snapshot(self):
+        with self._lock:
+            end = self.finished_at or time.monotonic()
+            elapsed = (end - self.started_at) if self.started_at else 0.0
+            return {
+                "total": self.total,
+                "done": self.resumed + self.sent + self.failed + self.skipped,
+                "resumed": self.resumed,
+                "sent": self.sent,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "elapsed": elapsed,
+                "rate": (self.sent / elapsed) if elapsed > 0 else 0.0,
+                "running": self.finished_at is None and self.started_at is not None,
+                "stopped": self._stop.is_set(),
+            }
+
+    # ---- threads ----
+    def _feed(self, done):
+        try:
+            for row in self.recipients:
+                if self._stop.is_set():
+                    break
+                if _row_key(row) in done:
+                    with self._lock:
+                        self.resumed += 1
+                    continue
+                while not self._stop.is_set():
+                    try:
+                        self._queue.put(row, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+        finally:
+            for _ in range(self.workers):
+                self._queue.put(None)
+
+    def _work(self):
+        try:
+            while True:
+                row = self._queue.get()
+                if row is None:
+                    break
+                if self._stop.is_set():
+                    continue  # drain quickly so the feeder's sentinels get through
+                try:
+                    self._send_row(row)
+                except Exception as e:  # one bad row must not take the worker (and the job's end) with it
+                    with self._lock:
+                        self.failed += 1
+                    self.log(f"❌ Bulk row {row['index'] + 1} failed: {e!r}")
+        finally:
+            self._worker_done()
+
+    def _send_row(self, row):
+        try:
+            msg = self.build_message(row)
+        except ValueError as e:
+            with self._lock:
+                self.skipped += 1
+            self.log(f"⏭ Row {row['index'] + 1} skipped: {e}")
+            return
+        if self.governor is not None and not self.governor.acquire(PRIORITY_BULK, self._stop):
+            return  # stopped while waiting for send quota; the row is not in the progress file
+        try:
+            self.send(msg)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            if self.governor is not None and quota_exceeded(e):
+                self.governor.exhausted()
+            self.log(f"❌ Bulk send to {row['email']} failed: {e}")
+            return
+        with self._lock:
+            self.sent += 1
+            if self._progress_file is not None:
+                self._progress_file.write(_row_key(row) + "\n")
+                self._progress_file.flush()
+
+    def _worker_done(self):
+        with self._lock:
+            self._active_workers -= 1
+            if self._active_workers == 0:
+                self.finished_at = time.monotonic()
+                if self._progress_file is not None:
+                    self._progress_file.close()
+                    self._progress_file = None
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Shared settings and on-disk locations for Auto Mail Center.
+"""
+
+import os
+
+# local state (checkpoints, stores, logs) lives here; override with SYNAPSEMAIL_HOME
+APP_DATA_DIR = os.environ.get("SYNAPSEMAIL_HOME") or os.path.join(os.path.expanduser("~"), ".synapsemail")
+# greeting / auto-reply templates, edited live (see synapse_templates.TemplateLibrary)
+TEMPLATES_DIR = os.environ.get("SYNAPSEMAIL_TEMPLATES") or os.path.join(APP_DATA_DIR, "templates")
+
+
+# mail servers; override to point at another provider or a local stand-in (see benchmarks/)
+IMAP_HOST = os.environ.get("SYNAPSEMAIL_IMAP_HOST") or "imap.gmail.com"
+IMAP_PORT = int(os.environ.get("SYNAPSEMAIL_IMAP_PORT") or 993)
+SMTP_HOST = os.environ.get("SYNAPSEMAIL_SMTP_HOST") or "smtp.gmail.com"
+SMTP_PORT = int(os.environ.get("SYNAPSEMAIL_SMTP_PORT") or 465)
+# extra CA bundle to trust, e.g. the self-signed certificate of a test server
+CA_FILE = os.environ.get("SYNAPSEMAIL_CA_FILE") or None
+
+
+# defaults the GUI shows before the IMAP/SMTP/storage modules load (they re-export them)
+# flag set on answered mail; the keyword variant leaves the user's read state alone
+SEEN_FLAG = "\\Seen"
+AUTO_REPLIED_KEYWORD = "$AutoReplied"
+# UIDs per UID FETCH round trip
+DEFAULT_FETCH_CHUNK_SIZE = 250
+# simultaneous IMAP connections per account (Gmail allows 15; leave room for the user's other clients)
+DEFAULT_MAX_IMAP_CONNECTIONS = 10
+DEFAULT_SMTP_POOL_SIZE = 3
+# None: answer each sender once, forever (the original replied_to semantics)
+DEFAULT_REPLY_COOLDOWN_SECONDS = None
+DEFAULT_BULK_WORKERS = 3
+# outgoing messages per account and window (None: no limit); Gmail allows about 500 a day
+DEFAULT_SEND_LIMITS = {"minute": 20, "hour": 200, "day": 500}
+# further mail from a sender answered less than this long ago gets no reply of its own
+DEFAULT_COALESCE_SECONDS = 600
+
+
+def client_ssl_context():
+    """TLS context for IMAP/SMTP connections (system CAs plus CA_FILE if set)."""
+    import ssl  # imported here: only connections need it, and it is slow to load
+
+    context = ssl.create_default_context()
+    if CA_FILE:
+        context.load_verify_locations(CA_FILE)
+    return context
+
+
+def data_path(name: str) -> str:
+    """Absolute path of `name` inside APP_DATA_DIR (created on first use)."""
+    os.makedirs(APP_DATA_DIR, exist_ok=True)
+    return os.path.join(APP_DATA_DIR, name)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Headless mode for Auto Mail Center (servers, containers, systemd).
+    python SynapseMail.py --headless --config accounts.json
+Runs AsyncEngine over the configured accounts without importing Tk, logs one
+structured line per event to stdout and stops cleanly on SIGTERM / SIGINT.
+"""
+
+import argparse
+import json
+import re
+import sys
+from datetime import datetime, timezone
+
+from synapse_config import data_path
+
+# exit codes
+EXIT_OK = 0
+EXIT_CONFIG = 2
+
+_ACCOUNT_PREFIX_RE = re.compile(r"^\[([^\]]+)\] ")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="SynapseMail.py", description="Auto Mail Center auto-responder")
+    parser.add_argument("--headless", action="store_true", help="run without the GUI (no Tk required)")
+    parser.add_argument("--config", default=None,
+                        help="accounts JSON file (default: accounts.json in the data directory)")
+    parser.add_argument("--log-format", choices=("logfmt", "json"), default="logfmt",
+                        help="stdout log line format in headless mode")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-file", default=None,
+                        help="rewrite this file with Prometheus metrics every few seconds")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print an import-time and window-construction breakdown once the login dialog is up")
+    return parser.parse_args(argv)
+
+
+# -----------------------
+# Structured stdout logging
+# -----------------------
+def _level_for(text: str) -> str:
+    if text.startswith("❌"):
+        return "error"
+    if text.startswith("⚠"):
+        return "warning"
+    return "info"
+
+
+def _logfmt_value(value) -> str:
+    value = str(value)
+    if value and not any(c in value for c in ' ="\\'):
+        return value
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class StdoutLog:
+    """Callable log sink: engine messages become one logfmt or JSON line each."""
+
+    def __init__(self, fmt="logfmt", stream=None):
+        self.fmt = fmt
+        self.stream = stream or sys.stdout
+
+    def __call__(self, text: str):
+        record = {"ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds")}
+        m = _ACCOUNT_PREFIX_RE.match(text)
+        if m:
+            text = text[m.end():]
+        record["level"] = _level_for(text)  # from the message itself, after the "[account] " prefix
+        if m:
+            record["account"] = m.group(1)
+        record["msg"] = text
+        if self.fmt == "json":
+            line = json.dumps(record, ensure_ascii=False)
+        else:
+            line = " ".join(f"{k}={_logfmt_value(v)}" for k, v in record.items())
+        self.stream.write(line + "\n")
+        self.stream.flush()
+
+
+# -----------------------
+# Entry point
+# -----------------------
+async def _serve(engine, log):
+    import asyncio
+    import signal
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, lambda s=sig: (log(f"🔒 {s.name} received — stopping"), engine.stop()))
+        except (NotImplementedError, RuntimeError):
+            signal.signal(sig, lambda *_: engine.stop())  # Windows: no loop signal handlers
+    await engine.run()
+
+
+def run_headless(args) -> int:
+    """Run the auto-responder until SIGTERM/SIGINT; returns a process exit code."""
+    # imported here so `--help` and the GUI start stay instant
+    import asyncio
+
+    from synapse_async import AsyncEngine, load_accounts
+
+    log = StdoutLog(args.log_format)
+    config = args.config or data_path("accounts.json")
+    try:
+        accounts = load_accounts(config)
+    except (OSError, ValueError) as e:
+        log(f"❌ Cannot load accounts from {config}: {e}")
+        return EXIT_CONFIG
+
+    from synapse_metrics import METRICS, MetricsFileWriter, MetricsServer
+    exporters = []
+    try:
+        if args.metrics_port:
+            exporters.append(MetricsServer(METRICS, port=args.metrics_port))
+        if args.metrics_file:
+            exporters.append(MetricsFileWriter(args.metrics_file, METRICS))
+    except OSError as e:
+        log(f"❌ Cannot start metrics export: {e}")
+        return EXIT_CONFIG
+
+    from synapse_history import MessageIndex
+    history = MessageIndex(data_path("history.sqlite3"), log=log)
+    engine = AsyncEngine(accounts, log=log, metrics=METRICS, history=history)
+    log(f"▶ Headless auto-responder started: {len(accounts)} account(s) from {config}")
+    try:
+        asyncio.run(_serve(engine, log))
+    finally:
+        history.close()
+        for exporter in exporters:
+            exporter.close()
+    log("✓ Stopped")
+    return EXIT_OK
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Who gets an auto-reply, for Auto Mail Center.
+- MailFilter.search_criteria(): narrows the IMAP SEARCH itself (SINCE, NOT FROM
+  our own addresses, NOT HEADER for bulk/automatic mail) so unwanted messages
+  are never fetched
+- MailFilter.suppress_reason(): header-only check on what was fetched, so mailing
+  lists, bounces, no-reply senders and other auto-responders are never answered
+  (RFC 3834 section 2) and two responders cannot loop
+"""
+
+import fnmatch
+import re
+import time
+
+# Precedence values that mark bulk / automatic mail
+SUPPRESS_PRECEDENCE = ("bulk", "list", "junk", "auto_reply")
+# X-Auto-Response-Suppress values (Exchange) that ask responders to stay quiet
+SUPPRESS_RESPONSE_TOKENS = ("all", "autoreply", "oof")
+NO_REPLY_RE = re.compile(r"^(no[-_.]?reply|do[-_.]?not[-_.]?reply|mailer-daemon|postmaster|bounces?)([-+._].*)?@",
+                         re.IGNORECASE)
+# pushed into SEARCH when server_side is on; the local check still covers servers that match loosely
+SERVER_HEADER_CRITERIA = (
+    'NOT HEADER Auto-Submitted "auto-"',
+    'NOT HEADER Precedence "bulk"',
+    'NOT HEADER Precedence "list"',
+    'NOT HEADER Precedence "junk"',
+    'NOT HEADER List-Id ""',
+)
+
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def imap_date(epoch) -> str:
+    """RFC 3501 date (no locale-dependent month names): 07-Mar-2026."""
+    t = time.localtime(epoch)
+    return f"{t.tm_mday:02d}-{_MONTHS[t.tm_mon - 1]}-{t.tm_year}"
+
+
+class MailFilter:
+    """
+    Reply policy for one mailbox.
+    - own_addresses: never answered, and excluded from the SEARCH (NOT FROM)
+    - since_days: only mail received in the last N days (SEARCH SINCE)
+    - ignore_senders: extra glob patterns, e.g. "*@notifications.example.com"
+    - server_side: also push SERVER_HEADER_CRITERIA into the SEARCH; callers turn
+      it off if the server rejects header searches
+    """
+
+    def __init__(self, own_addresses=(), since_days=None, ignore_senders=(), server_side=True):
+        self.own_addresses = {a.lower() for a in own_addresses if a}
+        self.since_days = since_days
+        self.ignore_senders = tuple(p.lower() for p in ignore_senders)
+        self.server_side = server_side
+
+    def search_criteria(self, base, now=None) -> str:
+        """`base` ("UNSEEN", "UID 43:*", ...) narrowed by every server-side filter."""
+        parts = [base]
+        if self.since_days:
+            parts.append(f"SINCE {imap_date((now or time.time()) - self.since_days * 86400)}")
+        parts += [f"NOT FROM {_quote(addr)}" for addr in sorted(self.own_addresses)]
+        if self.server_side:
+            parts += SERVER_HEADER_CRITERIA
+        return " ".join(parts)
+
+    def suppress_reason(self, headers, sender) -> str:
+        """Why a message must not be answered ("" if it may be), from its headers alone."""
+        if not sender:
+            return "no sender address"
+        key = sender.lower()
+        if key in self.own_addresses:
+            return "our own address"
+        auto = (headers.get("Auto-Submitted") or "").strip().lower()
+        if auto and auto != "no":
+            return f"Auto-Submitted: {auto}"
+        precedence = (headers.get("Precedence") or "").strip().lower()
+        if precedence in SUPPRESS_PRECEDENCE:
+            return f"Precedence: {precedence}"
+        if headers.get("List-Id") is not None:
+            return "mailing list"
+        if (headers.get("Return-Path") or "").strip() == "<>":
+            return "bounce (empty Return-Path)"
+        if headers.get("X-Autoreply") is not None or headers.get("X-Autorespond") is not None:
+            return "auto-reply"
+        suppress = (headers.get("X-Auto-Response-Suppress") or "").lower()
+        if any(token in suppress for token in SUPPRESS_RESPONSE_TOKENS):
+            return "X-Auto-Response-Suppress"
+        if NO_REPLY_RE.match(key):
+            return "no-reply sender"
+        for pattern in self.ignore_senders:
+            if fnmatch.fnmatchcase(key, pattern):
+                return "ignored sender"
+        return ""
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-folder monitoring for Auto Mail Center: the auto-responder watches a
+list of folders / Gmail labels, each with its own IMAP session, schedule and
+sync checkpoint, so a busy or slow folder never delays another.
+- parse_folders(): folder list from the sidebar setting or accounts.json
+- dedicated_sessions(): how many folders can keep a connection open within the
+  account's connection cap; the rest take turns on a shared one
+- FolderWatch: per-folder state of the GUI worker
+"""
+
+DEFAULT_FOLDERS = ("inbox",)
+
+
+def parse_folders(value):
+    """
+    Folder names from "inbox, Support/Billing" or a JSON list, in order,
+    without duplicates (INBOX is case-insensitive, other names are not).
+    """
+    if value is None:
+        return list(DEFAULT_FOLDERS)
+    names = value.split(",") if isinstance(value, str) else list(value)
+    folders, seen = [], set()
+    for name in names:
+        if not isinstance(name, str):
+            raise ValueError(f"folder names must be strings, not {name!r}")
+        name = name.strip()
+        key = "inbox" if name.lower() == "inbox" else name
+        if name and key not in seen:
+            seen.add(key)
+            folders.append(key)
+    return folders or list(DEFAULT_FOLDERS)
+
+
+def dedicated_sessions(folders, limit, reserved=1) -> int:
+    """
+    How many of `folders` (a count) keep their own connection when `reserved`
+    of the account's `limit` connections are used elsewhere. If they do not all
+    fit, one connection is left over for the remaining folders to poll in turn.
+    """
+    available = max(1, limit - reserved)
+    if folders <= available:
+        return folders
+    return available - 1
+
+
+class FolderWatch:
+    """
+    One watched folder: its ImapSession, CheckScheduler and UidTracker, and the
+    thread that serves it. `dedicated` folders keep their session open (and may
+    IDLE); the others poll and hang up after each check to free the connection.
+    """
+
+    __slots__ = ("mailbox", "session", "scheduler", "tracker", "dedicated", "log", "thread",
+                 "throttled", "pushing")
+
+    def __init__(self, mailbox, session, scheduler, dedicated=True, log=None):
+        self.mailbox = mailbox
+        self.session = session
+        self.scheduler = scheduler
+        self.tracker = None  # UidTracker of the current run
+        self.dedicated = dedicated
+        self.log = log or (lambda text: None)
+        self.thread = None
+        self.throttled = False  # set when the server pushes back during a check
+        self.pushing = False  # idling: the server announces new mail
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Processed-message history for Auto Mail Center.
+- MessageIndex: every message the auto-responder handled (sender, subject,
+  Message-ID, received / replied time, latency, outcome) in a local SQLite (WAL)
+  index with an FTS5 table beside it, so "did we answer X last Tuesday, and how
+  fast?" is one search in the History tab instead of scrolling the log
+- record() only appends to an in-memory queue; a writer thread parses headers
+  and inserts the rows in one transaction per batch, so indexing never holds up
+  the worker threads or the event loop
+"""
+
+import email.utils
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from email.header import decode_header, make_header
+
+# rows written per transaction, and the longest a recorded message waits for one
+HISTORY_BATCH_SIZE = 500
+HISTORY_FLUSH_SECONDS = 1.0
+# records waiting for the writer; the oldest are dropped beyond this (the writer is far behind)
+HISTORY_MAX_PENDING = 50000
+# rows older than this are pruned (checked hourly by the writer)
+HISTORY_RETENTION_DAYS = 365
+HISTORY_PRUNE_SECONDS = 3600
+# rows per page fetched by the History tab
+HISTORY_PAGE_SIZE = 100
+# stored subjects are cut to this many characters
+HISTORY_SUBJECT_CHARS = 200
+
+# words as FTS5's unicode61 tokenizer splits them (it breaks on "_", so "john_doe" is two)
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_COLUMNS = ("id, account, folder, uid, sender, subject, message_id, received, replied, "
+            "MAX(replied - received, 0), outcome, detail")
+
+
+class HistoryRow:
+    """One indexed message; `latency` is replied - received in seconds (None without a reply)."""
+
+    __slots__ = ("id", "account", "folder", "uid", "sender", "subject", "message_id", "received", "replied",
+                 "latency", "outcome", "detail")
+
+    def __init__(self, id, account, folder, uid, sender, subject, message_id, received, replied, latency,
+                 outcome, detail):
+        self.id = id
+        self.account = account
+        self.folder = folder
+        self.uid = uid
+        self.sender = sender
+        self.subject = subject
+        self.message_id = message_id
+        self.received = received
+        self.replied = replied
+        self.latency = latency
+        self.outcome = outcome
+        self.detail = detail
+
+
+def _header_text(headers, name) -> str:
+    value = headers.get(name) if headers is not None else None
+    if value is None:
+        return ""
+    value = str(value)
+    if "=?" not in value:
+        return value.strip()  # no RFC 2047 encoded words: nothing to decode
+    try:
+        return str(make_header(decode_header(value))).strip()
+    except (ValueError, LookupError, UnicodeError):
+        return value.strip()
+
+
+def _received_time(headers, fallback):
+    """Epoch time from the Date header, or `fallback` when it is missing, garbled or in the future."""
+    raw = headers.get("Date") if headers is not None else None
+    if raw:
+        try:
+            stamp = email.utils.parsedate_to_datetime(str(raw)).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            stamp = None
+        if stamp is not None and stamp <= fallback:
+            return stamp
+    return fallback
+
+
+class MessageIndex:
+    """
+    Searchable history of handled messages, shared by the GUI pipeline and the
+    accounts engine. Thread-safe; record() never blocks on the database.
+    Search: an address or Message-ID prefix ("bob@exa", "<CAF") is a range scan
+    of the index on those columns; anything else matches word prefixes of
+    sender, subject and outcome ("invoice fail" finds failed replies to invoices).
+    """
+
+    def __init__(self, path, batch_size=HISTORY_BATCH_SIZE, flush_seconds=HISTORY_FLUSH_SECONDS,
+                 retention_days=HISTORY_RETENTION_DAYS, log=None):
+        self.path = path
+        self.batch_size = max(1, int(batch_size))
+        self.flush_seconds = flush_seconds
+        self.retention_days = retention_days
+        self.log = log or (lambda text: None)
+        self._lock = threading.Lock()  # the connection
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY,"
+            " account TEXT NOT NULL,"
+            " folder TEXT NOT NULL,"
+            " uid INTEGER,"
+            " sender TEXT NOT NULL,"
+            " subject TEXT NOT NULL,"
+            " message_id TEXT NOT NULL,"
+            " received REAL NOT NULL,"
+            " handled REAL NOT NULL,"
+            " replied REAL,"
+            " outcome TEXT NOT NULL,"
+            " detail TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS messages_message_id ON messages (message_id)")
+        self.full_text = self._create_fts()
+        self._db.commit()
+        self._pending = deque(maxlen=HISTORY_MAX_PENDING)
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._dropped = 0
+        self._pruned_at = 0.0
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def _create_fts(self) -> bool:
+        """The FTS5 table and the triggers that keep it in step; False if this SQLite lacks FTS5 (LIKE search then)."""
+        try:
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                " sender, subject, outcome, content='messages', content_rowid='id', detail=column, columnsize=0)"
+            )
+        except sqlite3.OperationalError:
+            return False
+        self._db.execute(
+            "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN"
+            " INSERT INTO messages_fts (rowid, sender, subject, outcome)"
+            " VALUES (new.id, new.sender, new.subject, new.outcome); END"
+        )
+        self._db.execute(
+            "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN"
+            " INSERT INTO messages_fts (messages_fts, rowid, sender, subject, outcome)"
+            " VALUES ('delete', old.id, old.sender, old.subject, old.outcome); END"
+        )
+        return True
+
+    # ---- writing (any thread) ----
+    def record(self, account, folder, uid, sender, headers, outcome, detail="", replied=None):
+        """
+        Queue one handled message; `headers` (email.message.Message) are parsed on
+        the writer thread. `outcome`: one of synapse_pipeline's (REPLIED, FAILED, ...).
+        """
+        entry = (account.lower(), folder, uid, sender.lower(), headers, outcome, detail, time.time(), replied)
+        with self._cond:
+            if len(self._pending) == self._pending.maxlen:
+                self._dropped += 1
+            self._pending.append(entry)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self):
+        """Write everything recorded so far (the writer does this on its own every flush_seconds)."""
+        with self._cond:
+            batch = list(self._pending)
+            self._pending.clear()
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            self.log(f"⚠ History index fell behind — {dropped} message(s) not recorded")
+        if not batch:
+            return 0
+        rows = []
+        for account, folder, uid, sender, headers, outcome, detail, handled, replied in batch:
+            rows.append((account, folder, uid, sender, _header_text(headers, "Subject")[:HISTORY_SUBJECT_CHARS],
+                         _header_text(headers, "Message-ID"), _received_time(headers, handled), handled, replied,
+                         outcome, str(detail or "")[:500]))
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO messages (account, folder, uid, sender, subject, message_id, received, handled,"
+                " replied, outcome, detail) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows,
+            )
+            self._db.commit()
+        return len(rows)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_seconds)
+                stopping = self._stopping
+            try:
+                self.flush()
+                if time.time() - self._pruned_at >= HISTORY_PRUNE_SECONDS:
+                    self._pruned_at = time.time()
+                    self.prune()
+            except sqlite3.Error as e:
+                self.log(f"❌ History index error: {e}")
+            if stopping:
+                return
+
+    def prune(self, now=None) -> int:
+        """Delete rows older than retention_days; returns the number removed."""
+        if not self.retention_days:
+            return 0
+        cutoff = (now or time.time()) - self.retention_days * 86400
+        with self._lock:
+            removed = self._db.execute("DELETE FROM messages WHERE handled < ?", (cutoff,)).rowcount
+            self._db.commit()
+        return removed
+
+    # ---- searching (UI thread) ----
+    def _where(self, text, full_text=True):
+        """(SQL condition, params) for a search string; ("", ()) matches everything."""
+        text = (text or "").strip()
+        if not text:
+            return "", ()
+        if " " not in text and ("@" in text or text.startswith("<")):
+            # an address or Message-ID being typed: range scans on the two column indexes
+            message_id = text if text.startswith("<") else "<" + text
+            sender = text.lstrip("<").lower()
+            return ("(sender >= ? AND sender < ?) OR (message_id >= ? AND message_id < ?)",
+                    (sender, sender + "\uffff", message_id, message_id + "\uffff"))
+        words = _WORD_RE.findall(text)
+        if not words:
+            return "", ()
+        if full_text and self.full_text:
+            match = " ".join(f'"{word}"*' for word in words)
+            return "id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)", (match,)
+        conditions, params = [], []
+        for word in words:
+            conditions.append("(sender LIKE ? OR subject LIKE ? OR outcome LIKE ?)")
+            params.extend([f"%{word}%"] * 3)
+        return " AND ".join(conditions), tuple(params)
+
+    def last_id(self):
+        """Id of the newest row (None when empty); changes whenever a batch is written."""
+        with self._lock:
+            return self._db.execute("SELECT MAX(id) FROM messages").fetchone()[0]
+
+    def _select(self, head, text, tail="", extra=()):
+        """Run `head` [WHERE search] `tail`; a query FTS5 rejects is answered by the LIKE search instead."""
+        for full_text in (True, False):
+            where, params = self._where(text, full_text)
+            try:
+                with self._lock:
+                    return self._db.execute(f"{head}{' WHERE ' + where if where else ''}{tail}",
+                                            params + extra).fetchall()
+            except sqlite3.OperationalError:
+                if not full_text or not self.full_text:
+                    raise
+        return []
+
+    def count(self, text="") -> int:
+        return self._select("SELECT COUNT(*) FROM messages", text)[0][0]
+
+    def search(self, text="", limit=HISTORY_PAGE_SIZE, offset=0):
+        """Matching rows, most recently handled first."""
+        rows = self._select(f"SELECT {_COLUMNS} FROM messages", text, " ORDER BY id DESC LIMIT ? OFFSET ?",
+                            (int(limit), int(offset)))
+        return [HistoryRow(*row) for row in rows]
+
+    def close(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
+        with self._lock:
+            self._db.close()
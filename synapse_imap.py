@@ -0,0 +1,558 @@
+# -*- coding: utf-8 -*-
+"""
+IMAP helpers for Auto Mail Center.
+- ImapSession: long-lived, self-healing session reused across worker cycles
+- IDLE (RFC 2177) push support so the worker can react to new mail instead of polling
+- Batched, header-only UID FETCH and ranged UID STORE helpers
+- SyncCheckpoint: per-mailbox UIDVALIDITY / last UID / HIGHESTMODSEQ persisted to disk
+- ConnectionBudget: caps the IMAP connections one account opens across all its sessions
+"""
+
+import base64
+import imaplib
+import json
+import os
+import threading
+from email.parser import BytesHeaderParser
+import random
+import re
+import select
+import time
+
+from synapse_config import (  # re-exported (see __all__): the GUI shows these defaults without this module
+    AUTO_REPLIED_KEYWORD, DEFAULT_FETCH_CHUNK_SIZE, DEFAULT_MAX_IMAP_CONNECTIONS, SEEN_FLAG,
+)
+from synapse_metrics import METRICS
+
+__all__ = [  # with the synapse_config defaults above, which callers import from here
+    "AUTO_REPLIED_KEYWORD", "DEFAULT_FETCH_CHUNK_SIZE", "DEFAULT_MAX_IMAP_CONNECTIONS", "SEEN_FLAG",
+    "IDLE_REFRESH_SECONDS", "IDLE_STOP_POLL_SECONDS", "LIVENESS_CHECK_SECONDS", "RECONNECT_BACKOFF_BASE",
+    "RECONNECT_BACKOFF_CAP", "STABLE_SESSION_SECONDS", "IMAP_TIMEOUT", "CONNECTION_ERRORS", "HEADER_FIELDS",
+    "HEADER_FETCH_ITEMS", "THROTTLE_CODES", "BUDGET_POLL_SECONDS", "encode_mailbox", "mailbox_arg",
+    "ConnectionBudget", "ImapSession", "is_throttled", "SyncCheckpoint", "supports_idle", "has_new_mail",
+    "idle_wait", "chunked", "store_flag", "compress_uid_set", "fetch_literals", "parse_header_fetch"
+]
+
+# RFC 2177: servers may drop an idling client after 30 minutes, so re-issue well before that
+IDLE_REFRESH_SECONDS = 25 * 60
+# how often the idle wait re-checks the stop event (local select, no network traffic)
+IDLE_STOP_POLL_SECONDS = 1.0
+
+# liveness is re-checked with NOOP when the session has been quiet this long
+LIVENESS_CHECK_SECONDS = 30
+# reconnect backoff (full jitter): sleep U(0, min(cap, base * 2**failures))
+RECONNECT_BACKOFF_BASE = 1.0
+RECONNECT_BACKOFF_CAP = 120.0
+# a session that lived this long resets the failure streak
+STABLE_SESSION_SECONDS = 60
+IMAP_TIMEOUT = 60  # seconds; lets a dead peer surface as a socket error
+
+# errors after which the connection is unusable and must be rebuilt
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError)
+
+# only the headers the responder looks at; PEEK leaves \Seen untouched
+HEADER_FIELDS = ("FROM", "REPLY-TO", "SUBJECT", "TO", "CC", "DELIVERED-TO", "AUTO-SUBMITTED", "LIST-ID", "PRECEDENCE",
+                 "MESSAGE-ID", "REFERENCES", "IN-REPLY-TO", "DATE", "RETURN-PATH", "X-AUTOREPLY", "X-AUTORESPOND",
+                 "X-AUTO-RESPONSE-SUPPRESS")
+HEADER_FETCH_ITEMS = f"(UID BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})])"
+# response codes servers use to push back on a client that polls too hard
+THROTTLE_CODES = (b"[THROTTLED", b"[UNAVAILABLE", b"[LIMIT")
+# how often a session waiting for a free connection re-checks the stop event
+BUDGET_POLL_SECONDS = 1.0
+
+_UID_RE = re.compile(rb"\bUID (\d+)")
+_NEW_MAIL_RE = re.compile(rb"^\* \d+ (EXISTS|RECENT)\b", re.IGNORECASE)
+_ATOM_SPECIALS_RE = re.compile(r'[\s(){%*"\\\]]')
+
+
+# -----------------------
+# Mailbox names
+# -----------------------
+def encode_mailbox(name: str) -> str:
+    """RFC 3501 modified UTF-7, so labels such as "Kundenanfragen/Rückfragen" can be selected."""
+    out, pending = [], []
+
+    def flush():
+        if pending:
+            raw = "".join(pending).encode("utf-16-be")
+            out.append("&" + base64.b64encode(raw).decode("ascii").rstrip("=").replace("/", ",") + "-")
+            pending.clear()
+
+    for ch in name:
+        if " " <= ch <= "~":
+            flush()
+            out.append("&-" if ch == "&" else ch)
+        else:
+            pending.append(ch)
+    flush()
+    return "".join(out)
+
+
+def mailbox_arg(name: str) -> str:
+    """`name` as an imaplib command argument (imaplib sends arguments verbatim)."""
+    encoded = encode_mailbox(name)
+    if encoded and not _ATOM_SPECIALS_RE.search(encoded):
+        return encoded
+    return '"' + encoded.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+# -----------------------
+# Connection cap
+# -----------------------
+class ConnectionBudget:
+    """
+    At most `limit` IMAP connections for one account, whichever sessions hold
+    them; providers refuse logins beyond their per-account limit. An ImapSession
+    takes a slot before connecting and gives it back when its connection ends.
+    Thread-safe.
+    """
+
+    def __init__(self, limit=DEFAULT_MAX_IMAP_CONNECTIONS):
+        self.limit = max(1, int(limit))
+        self._slots = threading.BoundedSemaphore(self.limit)
+        self._lock = threading.Lock()
+        self.in_use = 0
+
+    def acquire(self, stop_event=None) -> bool:
+        """Wait for a free slot; False if `stop_event` fires first."""
+        while not self._slots.acquire(timeout=BUDGET_POLL_SECONDS):
+            if stop_event is not None and stop_event.is_set():
+                return False
+        with self._lock:
+            self.in_use += 1
+        return True
+
+    def try_acquire(self) -> bool:
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self.in_use += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+
+
+# -----------------------
+# Persistent session
+# -----------------------
+class ImapSession:
+    """
+    Owns one authenticated IMAP connection with `mailbox` selected and hands it
+    out to the worker cycle after cycle. Dead sessions (BYE, socket errors, failed
+    NOOP) are rebuilt with jittered exponential backoff. With a `budget`
+    (ConnectionBudget) it holds one of the account's connection slots while
+    connected. Not thread-safe: use it from one thread only; the counters may be
+    read from anywhere.
+    """
+
+    def __init__(self, host, user, password, mailbox="inbox", stop_event=None, log=None, metrics=None,
+                 port=993, ssl_context=None, budget=None):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context  # None: system defaults; False: plaintext (local test servers only)
+        self.user = user
+        self.password = password
+        self.mailbox = mailbox
+        self.stop_event = stop_event
+        self.log = log or (lambda text: None)
+        self.metrics = metrics or METRICS
+        self.budget = budget
+
+        self.mail = None
+        self.connected_at = None
+        # SELECT results of the current connection (None if the server did not report them)
+        self.uidvalidity = None
+        self.uidnext = None
+        self.highestmodseq = None
+        self.permanentflags = ()
+        self.fresh_select = False  # True until the first sync pass after a (re)connect
+        self.connects = 0
+        self.reconnects = 0
+        self._failures = 0
+        self._last_ok = 0.0
+        self._closed = False  # close() was asked for: the next connect is not a reconnect
+        self._budget_warned = False
+
+    def session_age(self) -> float:
+        if self.mail is None or self.connected_at is None:
+            return 0.0
+        return time.monotonic() - self.connected_at
+
+    def touch(self):
+        """Record that the connection just answered a command successfully."""
+        self._last_ok = time.monotonic()
+
+    def ensure(self):
+        """
+        Return a live, selected connection, reconnecting if needed.
+        Returns None if the stop event fires while waiting to reconnect.
+        """
+        if self.mail is not None:
+            if time.monotonic() - self._last_ok < LIVENESS_CHECK_SECONDS:
+                return self.mail
+            try:
+                typ, _ = self.mail.noop()
+                if typ == "OK":
+                    # unread untagged updates would otherwise pile up on a long-lived session
+                    for key in ("EXISTS", "RECENT", "EXPUNGE", "FETCH"):
+                        self.mail.untagged_responses.pop(key, None)
+                    self.touch()
+                    return self.mail
+            except CONNECTION_ERRORS:
+                pass
+            self.invalidate("NOOP failed")
+        return self._connect()
+
+    def accepts_keywords(self) -> bool:
+        """True if the selected mailbox lets clients create keywords such as $AutoReplied."""
+        return "\\*" in self.permanentflags
+
+    def switch(self, mailbox):
+        """
+        Select `mailbox` instead (a no-op if it already is); returns the live
+        connection, or None on stop. Raises imaplib.IMAP4.error if it cannot be
+        selected.
+        """
+        if mailbox == self.mailbox:
+            return self.ensure()
+        self.mailbox = mailbox
+        connects = self.connects
+        mail = self.ensure()
+        if mail is None or self.connects != connects:
+            return mail  # (re)connected: _connect() selected it
+        try:
+            self._select(mail)
+        except CONNECTION_ERRORS as e:
+            self.invalidate(str(e))
+            return self._connect()
+        except imaplib.IMAP4.error:
+            self.invalidate()
+            raise
+        self.fresh_select = True
+        self.touch()
+        return mail
+
+    def invalidate(self, reason=""):
+        """Drop the current connection; the next ensure() reconnects."""
+        if self.mail is None:
+            return
+        if self.session_age() >= STABLE_SESSION_SECONDS:
+            self._failures = 0
+        self._failures += 1
+        if reason:
+            self.log(f"⚠ IMAP session dropped: {reason}")
+        self._shutdown()
+
+    def close(self):
+        if self.mail is None:
+            return
+        self._closed = True
+        try:
+            self.mail.close()
+        except Exception:
+            pass
+        try:
+            self.mail.logout()
+        except Exception:
+            pass
+        self._release()
+
+    def _shutdown(self):
+        try:
+            self.mail.shutdown()
+        except Exception:
+            pass
+        self._release()
+
+    def _release(self):
+        self.mail = None
+        self.connected_at = None
+        if self.budget is not None:
+            self.budget.release()
+
+    def _backoff_delay(self) -> float:
+        if self._failures <= 0:
+            return 0.0
+        ceiling = min(RECONNECT_BACKOFF_CAP, RECONNECT_BACKOFF_BASE * (2 ** (self._failures - 1)))
+        return random.uniform(0, ceiling)
+
+    def _wait(self, seconds) -> bool:
+        """Sleep up to `seconds`; True if stop was requested meanwhile."""
+        if self.stop_event is None:
+            time.sleep(seconds)
+            return False
+        return self.stop_event.wait(seconds)
+
+    def _connect(self):
+        while True:
+            delay = self._backoff_delay()
+            if delay:
+                self.log(f"↻ Reconnecting to IMAP in {delay:.1f}s (attempt {self._failures + 1})")
+            if self._wait(delay):
+                return None
+            if self.budget is not None and not self.budget.try_acquire():
+                if not self._budget_warned:
+                    self._budget_warned = True
+                    self.log(f"⏳ All {self.budget.limit} IMAP connections in use — waiting for a free one")
+                if not self.budget.acquire(self.stop_event):
+                    return None
+
+            mail = None
+            try:
+                with self.metrics.timer("imap_connect"):
+                    if self.ssl_context is False:
+                        mail = imaplib.IMAP4(self.host, self.port, timeout=IMAP_TIMEOUT)
+                    else:
+                        mail = imaplib.IMAP4_SSL(self.host, self.port, ssl_context=self.ssl_context,
+                                                 timeout=IMAP_TIMEOUT)
+                with self.metrics.timer("imap_login"):
+                    mail.login(self.user, self.password)
+                    caps = _refresh_capabilities(mail)
+                    if "ENABLE" in caps and ("CONDSTORE" in caps or "QRESYNC" in caps):
+                        # makes SELECT report HIGHESTMODSEQ
+                        mail.enable("CONDSTORE")
+                self._select(mail)
+            except CONNECTION_ERRORS as e:
+                if mail is not None:
+                    try:
+                        mail.shutdown()
+                    except Exception:
+                        pass
+                if self.budget is not None:
+                    self.budget.release()
+                self._failures += 1
+                self.log(f"⚠ IMAP connect failed: {e}")
+                continue
+            except imaplib.IMAP4.error:
+                # authentication / mailbox errors will not fix themselves by retrying
+                try:
+                    mail.logout()
+                except Exception:
+                    pass
+                if self.budget is not None:
+                    self.budget.release()
+                raise
+
+            if self.connects and not self._closed:
+                self.reconnects += 1
+                self.metrics.inc("imap_reconnects")
+            self._closed = False
+            self.connects += 1
+            self.mail = mail
+            self.connected_at = time.monotonic()
+            self.fresh_select = True
+            self.touch()
+            return mail
+
+    def _select(self, mail):
+        with self.metrics.timer("imap_select"):
+            typ, _ = mail.select(mailbox_arg(self.mailbox))
+        if typ != "OK":
+            raise imaplib.IMAP4.error(f"cannot select {self.mailbox}")
+        self.uidvalidity = _response_int(mail, "UIDVALIDITY")
+        self.uidnext = _response_int(mail, "UIDNEXT")
+        self.highestmodseq = _response_int(mail, "HIGHESTMODSEQ")
+        self.permanentflags = _response_flags(mail, "PERMANENTFLAGS")
+
+
+def _refresh_capabilities(mail):
+    # many servers (Gmail included) only advertise extensions once authenticated
+    typ, data = mail.capability()
+    if typ == "OK" and data and data[-1]:
+        mail.capabilities = tuple(data[-1].decode("ascii", "replace").upper().split())
+    return mail.capabilities
+
+
+def _response_flags(mail, code):
+    _, data = mail.response(code)
+    if not data or not data[-1]:
+        return ()
+    return tuple(data[-1].decode("ascii", "replace").strip("()").split())
+
+
+def _response_int(mail, code):
+    _, data = mail.response(code)
+    try:
+        return int(data[-1])
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def is_throttled(response) -> bool:
+    """True if an IMAP error or NO/BAD response data carries a throttling response code."""
+    if isinstance(response, BaseException):
+        response = str(response)
+    if isinstance(response, (list, tuple)):
+        response = b" ".join(r if isinstance(r, bytes) else str(r).encode("utf-8", "replace") for r in response)
+    if isinstance(response, str):
+        response = response.encode("utf-8", "replace")
+    upper = (response or b"").upper()
+    return any(code in upper for code in THROTTLE_CODES)
+
+
+# -----------------------
+# Incremental sync checkpoint
+# -----------------------
+class SyncCheckpoint:
+    """
+    Incremental sync state per mailbox, persisted as JSON so restarts resume
+    where processing stopped:
+        {"user@example.com:inbox": {"uidvalidity": 1, "last_uid": 42, "highestmodseq": 900}}
+    Thread-safe; every update is written atomically (tmp file + rename).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            return state if isinstance(state, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._state.get(key)
+            return dict(entry) if entry else None
+
+    def update(self, key, **fields):
+        with self._lock:
+            self._state.setdefault(key, {}).update(fields)
+            self._save_locked()
+
+    def reset(self, key):
+        with self._lock:
+            if self._state.pop(key, None) is not None:
+                self._save_locked()
+
+    def _save_locked(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._state, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+# -----------------------
+# IDLE
+# -----------------------
+def supports_idle(mail) -> bool:
+    return "IDLE" in getattr(mail, "capabilities", ())
+
+
+def has_new_mail(responses) -> bool:
+    return any(_NEW_MAIL_RE.match(line) for line in responses)
+
+
+def _socket_readable(mail, timeout: float) -> bool:
+    sock = mail.socket()
+    # TLS may already hold a decrypted record that select() cannot see
+    pending = getattr(sock, "pending", None)
+    if pending is not None and pending():
+        return True
+    readable, _, _ = select.select([sock], [], [], timeout)
+    return bool(readable)
+
+
+def idle_wait(mail, timeout: float, stop_event):
+    """
+    Put a selected session into IDLE and block until the server pushes something,
+    `timeout` seconds pass or `stop_event` is set. IDLE is always terminated with
+    DONE before returning. Returns the raw untagged lines received meanwhile.
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b" IDLE\r\n")
+    line = mail._get_line()
+    if not line.startswith(b"+"):
+        mail.tagged_commands.pop(tag, None)
+        raise mail.error(f"IDLE rejected: {line!r}")
+
+    responses = []
+    deadline = time.monotonic() + timeout
+    try:
+        while not stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if _socket_readable(mail, min(IDLE_STOP_POLL_SECONDS, remaining)):
+                responses.append(mail._get_line())
+                break
+    finally:
+        mail.send(b"DONE\r\n")
+        # drain anything the server queued up to the tagged completion
+        while True:
+            line = mail._get_line()
+            if line.startswith(tag + b" "):
+                break
+            responses.append(line)
+        mail.tagged_commands.pop(tag, None)
+
+    if not line[len(tag) + 1:].upper().startswith(b"OK"):
+        raise mail.error(f"IDLE failed: {line!r}")
+    return responses
+
+
+# -----------------------
+# Batched header fetch / flag store
+# -----------------------
+def chunked(items, size: int):
+    size = max(1, int(size))
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def store_flag(mail, uids, flag=SEEN_FLAG):
+    """Add `flag` to all `uids` in one round trip: UID STORE 101:180,190 +FLAGS.SILENT (flag)."""
+    typ, data = mail.uid("STORE", compress_uid_set(uids), "+FLAGS.SILENT", f"({flag})")
+    if typ != "OK":
+        raise imaplib.IMAP4.error(f"UID STORE failed: {data!r}")
+
+
+def compress_uid_set(uids) -> str:
+    """[101, 102, 103, 190] -> '101:103,190' (RFC 3501 sequence-set)."""
+    ordered = sorted({int(u) for u in uids})
+    if not ordered:
+        return ""
+    ranges = []
+    start = prev = ordered[0]
+    for uid in ordered[1:]:
+        if uid == prev + 1:
+            prev = uid
+            continue
+        ranges.append(f"{start}:{prev}" if prev != start else str(start))
+        start = prev = uid
+    ranges.append(f"{start}:{prev}" if prev != start else str(start))
+    return ",".join(ranges)
+
+
+def fetch_literals(data):
+    """
+    (uid, literal bytes) for each message of a UID FETCH response that returns one
+    literal per message (a header block, a body section). Handles servers that
+    report UID before or after the literal.
+    """
+    found = []
+    for part in data or ():
+        if isinstance(part, tuple):
+            m = _UID_RE.search(part[0])
+            found.append([int(m.group(1)) if m else None, part[1]])
+        elif isinstance(part, bytes) and found and found[-1][0] is None:
+            m = _UID_RE.search(part)
+            if m:
+                found[-1][0] = int(m.group(1))
+    return [(uid, block) for uid, block in found if uid is not None]
+
+
+def parse_header_fetch(data):
+    """
+    Turn the response of a UID FETCH of HEADER_FETCH_ITEMS into (uid, headers)
+    pairs, where headers is an email.message.Message holding only the header block.
+    """
+    parser = BytesHeaderParser()
+    return [(uid, parser.parsebytes(block)) for uid, block in fetch_literals(data)]
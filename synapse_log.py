@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+System Log plumbing for Auto Mail Center.
+- LogBuffer: thread-safe bounded ring buffer that worker threads append to
+  without touching Tk; the UI drains it on a fixed tick in one batch
+- every line is also written to a size-rotated log file with the full history
+"""
+
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+LOG_FLUSH_MS = 200          # UI drains the buffer this often
+LOG_MAX_LINES = 2000        # lines kept in the System Log widget
+LOG_BUFFER_SIZE = 5000      # lines waiting for a flush; the oldest are dropped beyond this
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+
+
+class LogBuffer:
+    """Collects timestamped log lines from any thread until the UI drains them."""
+
+    def __init__(self, path=None, maxlen=LOG_BUFFER_SIZE, max_bytes=LOG_FILE_MAX_BYTES, backups=LOG_FILE_BACKUPS):
+        self._lines = deque(maxlen=max(1, int(maxlen)))
+        self._lock = threading.Lock()
+        self._dropped = 0
+        self._file = None
+        if path:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._file = logging.getLogger(f"synapsemail.file.{id(self)}")
+            self._file.propagate = False
+            self._file.setLevel(logging.INFO)
+            self._file.addHandler(handler)
+
+    def append(self, text: str):
+        line = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | {text}"
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self._dropped += 1
+            self._lines.append(line)
+        if self._file is not None:
+            self._file.info(line)
+
+    def drain(self):
+        """Return (lines, dropped) accumulated since the last drain."""
+        with self._lock:
+            lines = list(self._lines)
+            self._lines.clear()
+            dropped, self._dropped = self._dropped, 0
+        return lines, dropped
+
+    def close(self):
+        if self._file is not None:
+            for handler in list(self._file.handlers):
+                self._file.removeHandler(handler)
+                handler.close()
+            self._file = None
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation for Auto Mail Center.
+- Metrics: per-phase latency (p50/p95/p99 over a recent window, plus histogram
+  buckets), error counts, plain counters and gauges; thread-safe and cheap enough to
+  leave on everywhere
+- Prometheus text exposition through an optional local HTTP endpoint
+  (MetricsServer) or a periodically rewritten file (MetricsFileWriter)
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+METRICS_PREFIX = "synapsemail"
+# samples per phase kept for the quantiles
+METRICS_WINDOW = 1024
+# histogram bucket upper bounds, seconds
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_QUANTILES = (0.5, 0.95, 0.99)
+METRICS_FILE_INTERVAL = 15  # seconds between file exports
+
+# phases timed by the IMAP/SMTP code, in display order
+PHASES = ("imap_connect", "imap_login", "imap_select", "imap_search", "imap_fetch", "parse",
+          "smtp_connect", "smtp_login", "smtp_send", "imap_store")
+
+
+class _Phase:
+    __slots__ = ("window", "buckets", "count", "total", "errors")
+
+    def __init__(self):
+        self.window = deque(maxlen=METRICS_WINDOW)
+        self.buckets = [0] * (len(METRICS_BUCKETS) + 1)  # last one is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+
+def _quantile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class Metrics:
+    """Registry of phase timings and counters. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def observe(self, phase, seconds, error=False):
+        with self._lock:
+            p = self._phases.get(phase)
+            if p is None:
+                p = self._phases[phase] = _Phase()
+            p.window.append(seconds)
+            p.buckets[bisect_left(METRICS_BUCKETS, seconds)] += 1
+            p.count += 1
+            p.total += seconds
+            if error:
+                p.errors += 1
+
+    @contextmanager
+    def timer(self, phase):
+        """Time the enclosed block as `phase`; an exception counts as an error and propagates."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(phase, time.perf_counter() - start, error=True)
+            raise
+        self.observe(phase, time.perf_counter() - start)
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def snapshot(self):
+        """{"phases": {phase: {count, errors, error_rate, p50, p95, p99, mean}}, "counters": {...}, "gauges": {...}}"""
+        with self._lock:
+            phases = {name: (sorted(p.window), p.count, p.errors, p.total) for name, p in self._phases.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        out = {}
+        for name, (values, count, errors, total) in phases.items():
+            out[name] = {
+                "count": count,
+                "errors": errors,
+                "error_rate": errors / count if count else 0.0,
+                "mean": total / count if count else 0.0,
+                **{f"p{int(q * 100)}": _quantile(values, q) for q in METRICS_QUANTILES},
+            }
+        return {"phases": out, "counters": counters, "gauges": gauges}
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            phases = {name: (sorted(p.window), list(p.buckets), p.count, p.errors, p.total)
+                      for name, p in self._phases.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        name = f"{METRICS_PREFIX}_phase_seconds"
+        lines = [f"# HELP {name} Latency of each IMAP/SMTP phase.", f"# TYPE {name} histogram"]
+        for phase, (_, buckets, count, _, total) in sorted(phases.items()):
+            cumulative = 0
+            for bound, n in zip(METRICS_BUCKETS, buckets):
+                cumulative += n
+                lines.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{phase="{phase}",le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{phase="{phase}"}} {total:.6f}')
+            lines.append(f'{name}_count{{phase="{phase}"}} {count}')
+
+        name = f"{METRICS_PREFIX}_phase_recent_seconds"
+        lines += [f"# HELP {name} Latency quantiles over the last {METRICS_WINDOW} samples of each phase.",
+                  f"# TYPE {name} gauge"]
+        for phase, (values, *_rest) in sorted(phases.items()):
+            for q in METRICS_QUANTILES:
+                lines.append(f'{name}{{phase="{phase}",quantile="{q}"}} {_quantile(values, q):.6f}')
+
+        name = f"{METRICS_PREFIX}_phase_errors_total"
+        lines += [f"# HELP {name} Phase executions that raised.", f"# TYPE {name} counter"]
+        for phase, (_, _, _, errors, _) in sorted(phases.items()):
+            lines.append(f'{name}{{phase="{phase}"}} {errors}')
+
+        for counter, value in sorted(counters.items()):
+            name = f"{METRICS_PREFIX}_{counter}_total"
+            lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        for gauge, value in sorted(gauges.items()):
+            name = f"{METRICS_PREFIX}_{gauge}"
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+# process-wide registry used when no explicit one is passed in
+METRICS = Metrics()
+
+
+# -----------------------
+# Exporters
+# -----------------------
+class MetricsServer:
+    """Serves GET /metrics on host:port from a daemon thread (bind to localhost by default)."""
+
+    def __init__(self, metrics=None, host="127.0.0.1", port=9464):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # only loaded when exporting
+
+        metrics = metrics or METRICS
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self.address = self._httpd.server_address
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class MetricsFileWriter:
+    """Rewrites `path` with the Prometheus text every `interval` seconds (node_exporter textfile style)."""
+
+    def __init__(self, path, metrics=None, interval=METRICS_FILE_INTERVAL):
+        self.path = path
+        self.metrics = metrics or METRICS
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-file", daemon=True)
+        self._thread.start()
+
+    def write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.metrics.render_prometheus())
+        os.replace(tmp, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                pass
+
+    def close(self):
+        self._stop.set()
+        try:
+            self.write()
+        except OSError:
+            pass
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Staged processing pipeline for Auto Mail Center.
+Work flows through stages connected by bounded queues; each stage has its own
+worker threads. A full queue blocks the stage feeding it, so a slow stage (SMTP)
+pushes back all the way to the producer (IMAP fetch) instead of growing memory.
+"""
+
+import queue
+import threading
+
+PIPELINE_QUEUE_SIZE = 100  # items buffered in front of each stage
+# producer-side waits re-check the stop event this often
+_PUT_TIMEOUT = 0.5
+
+
+# -----------------------
+# Generic pipeline
+# -----------------------
+class Stage:
+    """
+    One pipeline step. `func(item)` returns the item (or a replacement) for the next
+    stage, or None to end the item's journey here.
+    """
+
+    def __init__(self, name, func, workers=1, maxsize=PIPELINE_QUEUE_SIZE):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(maxsize)))
+
+
+class Pipeline:
+    """
+    Runs `stages` in order. submit() feeds the first stage and blocks while its
+    queue is full (backpressure). If a stage raises, `on_error(stage_name, item, exc)`
+    is called and the item is dropped. Items still queued at stop() are discarded.
+    """
+
+    def __init__(self, stages, on_error=None, name="pipeline"):
+        self.stages = list(stages)
+        self.on_error = on_error or (lambda stage, item, exc: None)
+        self.name = name
+        self._stop = threading.Event()
+        self._threads = []
+        self._in_flight = 0
+        self._idle = threading.Condition()
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                t = threading.Thread(target=self._run, args=(index,), name=f"{self.name}-{stage.name}-{n}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        with self._idle:
+            self._idle.notify_all()
+
+    def submit(self, item, stop_event=None) -> bool:
+        """Queue an item for the first stage; False if stopped before it fit."""
+        with self._idle:
+            self._in_flight += 1
+        if self._put(self.stages[0].queue, item, stop_event):
+            return True
+        self._finished()
+        return False
+
+    def depths(self):
+        return {stage.name: stage.queue.qsize() for stage in self.stages}
+
+    def in_flight(self) -> int:
+        with self._idle:
+            return self._in_flight
+
+    def wait_idle(self, timeout=None) -> bool:
+        """Block until every submitted item has left the pipeline."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._in_flight == 0 or self._stop.is_set(), timeout)
+
+    # ---- internals ----
+    def _put(self, q, item, stop_event=None) -> bool:
+        while not self._stop.is_set() and not (stop_event is not None and stop_event.is_set()):
+            try:
+                q.put(item, timeout=_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _finished(self):
+        with self._idle:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.notify_all()
+
+    def _run(self, index):
+        stage = self.stages[index]
+        nxt = self.stages[index + 1].queue if index + 1 < len(self.stages) else None
+        while not self._stop.is_set():
+            try:
+                item = stage.queue.get(timeout=_PUT_TIMEOUT)
+            except queue.Empty:
+                continue
+            try:
+                out = stage.func(item)
+            except Exception as e:
+                self.on_error(stage.name, item, e)
+                self._finished()
+                continue
+            if out is None or nxt is None or not self._put(nxt, out):
+                self._finished()
+
+
+# -----------------------
+# Auto-responder items
+# -----------------------
+# what became of a message, as recorded in the history index (synapse_history)
+REPLIED = "replied"
+ALREADY_REPLIED = "already replied"
+COALESCED = "coalesced"
+SUPPRESSED = "suppressed"
+NO_REPLY_RULE = "rule: no reply"
+FAILED = "failed"
+
+
+class InboundMessage:
+    """One fetched message on its way through the auto-responder pipeline."""
+
+    __slots__ = ("uid", "headers", "tracker", "excerpt", "sender", "rule", "reply", "suppressed", "msg", "ok",
+                 "outcome", "detail", "replied_at")
+
+    def __init__(self, uid, headers, tracker, excerpt=""):
+        self.uid = uid
+        self.headers = headers
+        self.tracker = tracker  # UidTracker of the mailbox the message came from
+        self.excerpt = excerpt  # first lines of the text part, when the reply template quotes it
+        self.sender = ""
+        self.rule = None  # routing rule that applies (synapse_rules), if any
+        self.reply = False  # classify decided we should answer
+        self.suppressed = False  # bulk/automatic mail: never answered, left unflagged
+        self.msg = None     # rendered reply
+        self.ok = True      # False: leave unflagged and retry next cycle
+        self.outcome = ""   # for the history index (synapse_history), with an optional detail
+        self.detail = ""
+        self.replied_at = None
+
+
+class UidTracker:
+    """
+    Tracks which fetched UIDs are still in the pipeline so the persisted sync
+    checkpoint only ever covers fully handled messages.
+    - cursor: highest UID handed to the pipeline (the next search starts above it)
+    - watermark(): highest UID with everything at or below it handled
+    Failed UIDs are kept for retry on the next cycle. Thread-safe.
+    `key`/`mailbox`/`uidvalidity`/`modseq`/`saved` are bookkeeping for whoever persists it.
+    """
+
+    def __init__(self, cursor, key=None, uidvalidity=None, partial_ok=True, mailbox=None):
+        self.cursor = cursor
+        self.key = key
+        self.mailbox = mailbox     # folder the UIDs belong to
+        self.uidvalidity = uidvalidity
+        self.modseq = None         # HIGHESTMODSEQ to persist once settled
+        self.partial_ok = partial_ok  # False: only persist once settled (first sync)
+        self.saved = None          # last persisted watermark
+        self._pending = set()
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def submitted(self, uid):
+        with self._lock:
+            self._pending.add(uid)
+            self._failed.discard(uid)
+            if uid > self.cursor:
+                self.cursor = uid
+
+    def advance_cursor(self, uid):
+        with self._lock:
+            self.cursor = max(self.cursor, uid)
+
+    def finished(self, uid, ok=True):
+        with self._lock:
+            self._pending.discard(uid)
+            if not ok:
+                self._failed.add(uid)
+
+    def forget(self, uid):
+        """The server no longer has `uid` (expunged): stop waiting for it."""
+        with self._lock:
+            self._pending.discard(uid)
+            self._failed.discard(uid)
+
+    def retries(self):
+        with self._lock:
+            return sorted(self._failed)
+
+    def settled(self) -> bool:
+        """True when nothing is in flight and nothing awaits a retry."""
+        with self._lock:
+            return not self._pending and not self._failed
+
+    def watermark(self) -> int:
+        with self._lock:
+            open_uids = self._pending | self._failed
+            return (min(open_uids) - 1) if open_uids else self.cursor
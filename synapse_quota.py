@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Outgoing-mail quota for Auto Mail Center.
+- SendGovernor: per-account token buckets (per minute / hour / day) that every
+  send path draws from before talking to SMTP, so a flood of inbound mail slows
+  replies down instead of exhausting the provider's quota; auto-replies go
+  ahead of greetings, and bulk sends leave a reserve for them
+- governor_for(): the process-wide governor of an account (GUI, spool, bulk and
+  the multi-account engine share it); usage is persisted so a restart does not
+  hand out a fresh day's quota
+"""
+
+import json
+import os
+import threading
+import time
+
+from synapse_config import DEFAULT_SEND_LIMITS, data_path  # DEFAULT_SEND_LIMITS re-exported (see __all__)
+from synapse_metrics import METRICS
+
+__all__ = [  # DEFAULT_SEND_LIMITS is re-exported from synapse_config
+    "DEFAULT_SEND_LIMITS", "QUOTA_FILE", "QUOTA_WINDOWS", "PRIORITY_REPLY", "PRIORITY_GREETING", "PRIORITY_BULK",
+    "PRIORITY_BY_KIND", "BULK_RESERVE", "GOVERNOR_POLL_SECONDS", "QUOTA_SAVE_SECONDS", "parse_send_limits",
+    "format_duration", "TokenBucket", "SendGovernor", "governor_for"
+]
+
+QUOTA_FILE = "send_quota.json"
+# window name -> length in seconds
+QUOTA_WINDOWS = (("minute", 60), ("hour", 3600), ("day", 86400))
+# priorities, most urgent first
+PRIORITY_REPLY = 0
+PRIORITY_GREETING = 1
+PRIORITY_BULK = 2
+PRIORITY_BY_KIND = {"reply": PRIORITY_REPLY, "greeting": PRIORITY_GREETING, "bulk": PRIORITY_BULK}
+# share of every window bulk sends leave untouched, so auto-replies still go out at the limit
+BULK_RESERVE = 0.2
+# how often a waiting sender re-checks its stop event
+GOVERNOR_POLL_SECONDS = 1.0
+# usage is written at most this often (and on save(force=True))
+QUOTA_SAVE_SECONDS = 5.0
+
+_FILE_LOCK = threading.Lock()  # every governor of the process shares QUOTA_FILE
+
+
+def parse_send_limits(value):
+    """
+    {"minute": n, "hour": n, "day": n} from "20, 200, 500" (the sidebar field) or
+    a dict (accounts.json, missing windows keep their default). 0 or None: no limit.
+    """
+    if value is None:
+        return dict(DEFAULT_SEND_LIMITS)
+    if isinstance(value, str):
+        parts = [p.strip() for p in value.replace("/", ",").split(",")]
+        if len(parts) != len(QUOTA_WINDOWS):
+            raise ValueError("send limits are three numbers: per minute, per hour, per day")
+        value = dict(zip((name for name, _ in QUOTA_WINDOWS), parts))
+    elif not isinstance(value, dict):
+        raise ValueError(f"send limits must be a string or an object, not {value!r}")
+    unknown = set(value) - {name for name, _ in QUOTA_WINDOWS}
+    if unknown:
+        raise ValueError(f"unknown send limit windows {sorted(unknown)}")
+    limits = dict(DEFAULT_SEND_LIMITS)
+    for name, raw in value.items():
+        try:
+            limit = int(raw) if raw not in (None, "") else 0
+        except (TypeError, ValueError):
+            raise ValueError(f"send limit per {name} must be a whole number, not {raw!r}") from None
+        if limit < 0:
+            raise ValueError(f"send limit per {name} cannot be negative")
+        limits[name] = limit or None
+    return limits
+
+
+def format_duration(seconds) -> str:
+    seconds = int(seconds + 0.999)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+class TokenBucket:
+    """`capacity` tokens, refilled continuously at capacity per `period` seconds (wall clock, so it can be saved)."""
+
+    __slots__ = ("capacity", "rate", "tokens", "stamp")
+
+    def __init__(self, capacity, period, tokens=None, stamp=None):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.tokens = self.capacity if tokens is None else min(self.capacity, max(0.0, float(tokens)))
+        self.stamp = time.time() if stamp is None else float(stamp)
+
+    def refill(self, now):
+        if now > self.stamp:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, need) -> float:
+        """Seconds until `need` tokens are available (0: now); call refill() first."""
+        return max(0.0, need - self.tokens) / self.rate
+
+
+class SendGovernor:
+    """
+    Token buckets of one account, one per limited window. A send takes a token
+    from each; when any bucket is empty the sender waits for the refill. Waiting
+    auto-replies go ahead of waiting greetings and bulk sends, and bulk sends
+    also leave BULK_RESERVE of every window to the others. Bucket levels are
+    saved to `path` (shared JSON, keyed by account). Thread-safe.
+    """
+
+    def __init__(self, account, limits=None, path=None, reserve=BULK_RESERVE, log=None, metrics=None):
+        self.account = account.lower()
+        self.path = path
+        self.reserve = reserve
+        self.log = log or (lambda text: None)
+        self.metrics = metrics or METRICS
+        self._cond = threading.Condition()
+        self._buckets = {}
+        self._waiting = [0] * len(PRIORITY_BY_KIND)
+        self._saved_at = 0.0
+        self._dirty = False
+        self._deferred_logged = False
+        self.sent = 0  # tokens handed out by this process
+        self.deferred = 0  # sends that had to wait for quota
+        self.set_limits(limits, saved=self._load())
+
+    # ---- configuration ----
+    def set_limits(self, limits, saved=None):
+        """Apply new limits; current usage carries over (as a share of each window)."""
+        limits = parse_send_limits(limits) if not isinstance(limits, dict) else limits
+        with self._cond:
+            now = time.time()
+            buckets = {}
+            for name, period in QUOTA_WINDOWS:
+                limit = limits.get(name)
+                if not limit:
+                    continue
+                old = self._buckets.get(name)
+                if old is not None:
+                    old.refill(now)
+                    used = old.capacity - old.tokens
+                    buckets[name] = TokenBucket(limit, period, limit - used, now)
+                elif saved and name in saved:
+                    tokens, stamp = saved[name]
+                    bucket = TokenBucket(limit, period, tokens, min(stamp, now))
+                    bucket.refill(now)
+                    buckets[name] = bucket
+                else:
+                    buckets[name] = TokenBucket(limit, period, stamp=now)
+            self._buckets = buckets
+            self._dirty = True
+            self._cond.notify_all()
+
+    @property
+    def limits(self):
+        with self._cond:
+            return {name: int(b.capacity) for name, b in self._buckets.items()}
+
+    # ---- sending ----
+    def acquire(self, priority=PRIORITY_REPLY, stop_event=None, timeout=None) -> bool:
+        """
+        Take one send from every window, waiting as long as needed (or `timeout`
+        seconds). False if `stop_event` was set or the timeout ran out first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            delay = self._take_locked(priority)
+            if not delay:
+                return True
+            self._waiting[priority] += 1
+            self._on_deferred_locked(delay)
+            try:
+                while True:
+                    if stop_event is not None and stop_event.is_set():
+                        return False
+                    wait = delay
+                    if stop_event is not None:
+                        wait = min(wait, GOVERNOR_POLL_SECONDS)
+                    if deadline is not None:
+                        left = deadline - time.monotonic()
+                        if left <= 0:
+                            return False
+                        wait = min(wait, left)
+                    self._cond.wait(wait)
+                    self._waiting[priority] -= 1
+                    delay = self._take_locked(priority)
+                    self._waiting[priority] += 1
+                    if not delay:
+                        return True
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()  # lower priorities may go now
+
+    def try_acquire(self, priority=PRIORITY_REPLY, retry=False) -> float:
+        """
+        Take one send if allowed now (returns 0.0); otherwise seconds until it
+        may be (nothing taken). For callers that sleep themselves (asyncio);
+        `retry`: this send was already deferred once, do not count it again.
+        """
+        with self._cond:
+            delay = self._take_locked(priority)
+            if delay and not retry:
+                self._on_deferred_locked(delay)
+            return delay
+
+    def _take_locked(self, priority) -> float:
+        if any(self._waiting[:priority]):
+            return GOVERNOR_POLL_SECONDS  # a more urgent sender is waiting; it is notified first
+        now = time.time()
+        delay = 0.0
+        for bucket in self._buckets.values():
+            bucket.refill(now)
+            need = 1.0
+            if priority >= PRIORITY_BULK:
+                need = min(bucket.capacity, need + self.reserve * bucket.capacity)
+            delay = max(delay, bucket.wait_time(need))
+        if delay:
+            return delay
+        for bucket in self._buckets.values():
+            bucket.tokens -= 1.0
+        self.sent += 1
+        self._dirty = True
+        if self._deferred_logged:
+            self._deferred_logged = False
+            self.log("▶ Send quota available again")
+        self._save_locked(now)
+        return 0.0
+
+    def _on_deferred_locked(self, delay):
+        self.deferred += 1
+        self.metrics.inc("sends_deferred")
+        if not self._deferred_logged:
+            self._deferred_logged = True
+            full = ", ".join(f"{name} {int(b.capacity)}" for name, b in self._buckets.items() if b.tokens < 1.0)
+            self.log(f"⏳ Send quota reached ({full or 'reserved for auto-replies'}) — "
+                     f"sending resumes in about {format_duration(delay)}")
+
+    def exhausted(self, window="day"):
+        """The provider refused a send for quota: treat `window` (or the largest) as used up."""
+        with self._cond:
+            bucket = self._buckets.get(window)
+            if bucket is None and self._buckets:
+                bucket = list(self._buckets.values())[-1]
+            if bucket is not None:
+                bucket.refill(time.time())
+                bucket.tokens = 0.0
+                self._dirty = True
+                self._save_locked(force=True)
+
+    # ---- reporting ----
+    def usage(self):
+        """{window: {"limit": n, "used": n, "available": n}} plus "waiting" (per priority) and counters."""
+        with self._cond:
+            now = time.time()
+            windows = {}
+            for name, bucket in self._buckets.items():
+                bucket.refill(now)
+                available = int(bucket.tokens)
+                windows[name] = {"limit": int(bucket.capacity), "used": int(bucket.capacity) - available,
+                                 "available": available}
+            return {"windows": windows, "waiting": sum(self._waiting), "sent": self.sent, "deferred": self.deferred}
+
+    def describe(self) -> str:
+        """One line for the Dashboard, e.g. "minute 3/20 · hour 41/200 · day 120/500"."""
+        usage = self.usage()
+        parts = [f"{name} {w['used']}/{w['limit']}" for name, w in usage["windows"].items()] or ["no limits"]
+        if usage["waiting"]:
+            parts.append(f"{usage['waiting']} waiting")
+        return " · ".join(parts)
+
+    # ---- persistence ----
+    def _load(self):
+        if not self.path:
+            return None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f).get(self.account)
+            return {name: (float(v[0]), float(v[1])) for name, v in state.items()} if isinstance(state, dict) else None
+        except (OSError, ValueError, AttributeError, TypeError, IndexError):
+            return None
+
+    def save(self, force=True):
+        with self._cond:
+            self._save_locked(force=force)
+
+    def _save_locked(self, now=None, force=False):
+        now = now or time.time()
+        if not self.path or not self._dirty or (not force and now - self._saved_at < QUOTA_SAVE_SECONDS):
+            return
+        mine = {name: [round(b.tokens, 3), b.stamp] for name, b in self._buckets.items()}
+        with _FILE_LOCK:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                if not isinstance(state, dict):
+                    state = {}
+            except (OSError, ValueError):
+                state = {}
+            state[self.account] = mine
+            tmp = self.path + ".tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(state, f, indent=1, sort_keys=True)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                self.log(f"⚠ Cannot save send quota usage: {e}")
+                return
+        self._saved_at = now
+        self._dirty = False
+
+
+_GOVERNORS = {}
+_GOVERNORS_LOCK = threading.Lock()
+
+
+def governor_for(account, limits=None, log=None, metrics=None) -> SendGovernor:
+    """The process-wide SendGovernor of `account` (created on first use); `limits` replaces its limits if given."""
+    key = account.lower()
+    with _GOVERNORS_LOCK:
+        governor = _GOVERNORS.get(key)
+        if governor is None:
+            governor = _GOVERNORS[key] = SendGovernor(key, limits, path=data_path(QUOTA_FILE), log=log, metrics=metrics)
+            return governor
+    if limits is not None:
+        governor.set_limits(limits)
+    return governor
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Routing rules for Auto Mail Center's auto-replies: which template, which
+cooldown, or no reply at all, by sender address / domain, recipient alias and
+subject pattern.
+- RuleSet: rules compiled into hash indexes (sender address, sender domain and
+  its parents, recipient alias) plus one Aho-Corasick automaton over the literal
+  text each subject pattern requires, so a message costs about the same with
+  ten rules or ten thousand
+- load_rules(): read a rules file (JSON)
+"""
+
+import email.utils
+import json
+import os
+import re
+from collections import Counter
+
+try:
+    import re._parser as sre_parse
+    from re._constants import AT, BRANCH, LITERAL, SUBPATTERN
+except ImportError:  # Python < 3.11
+    import sre_parse
+    from sre_constants import AT, BRANCH, LITERAL, SUBPATTERN
+
+from synapse_config import data_path
+from synapse_templates import header_text
+
+RULES_FILE = "rules.json"
+# headers a recipient alias is looked up in
+RECIPIENT_HEADERS = ("To", "Cc", "Delivered-To")
+# shortest literal worth indexing a subject pattern by; shorter ones match too much
+MIN_INDEX_LITERAL = 3
+RULE_KEYS = ("from", "domain", "to", "subject", "template", "cooldown", "reply", "name")
+
+
+class Rule:
+    """
+    One routing rule. Conditions (all given ones must hold): `sender` exact
+    address, `domain` (also matches its subdomains), `recipient` alias (To / Cc /
+    Delivered-To, "+tag" ignored) and `subject` regex (case-insensitive, searched).
+    Actions: `template` name, `cooldown` seconds, or `reply=False`.
+    """
+
+    __slots__ = ("index", "name", "sender", "domain", "recipient", "subject", "template", "cooldown", "reply",
+                 "_subject_re")
+
+    def __init__(self, index, sender=None, domain=None, recipient=None, subject=None, template=None,
+                 cooldown=None, reply=True, name=None):
+        self.index = index  # earlier rules win
+        self.name = name or f"rule {index + 1}"
+        self.sender = sender.lower() if sender else None
+        self.domain = domain.lower().lstrip("@.") if domain else None
+        self.recipient = recipient.lower() if recipient else None
+        self.subject = subject
+        self.template = template
+        self.cooldown = None if cooldown is None else float(cooldown)
+        self.reply = bool(reply)
+        self._subject_re = re.compile(subject, re.IGNORECASE) if subject else None
+
+    def matches(self, sender, domains, recipients, subject) -> bool:
+        """`domains`: the sender's domain and its parents; `recipients`: normalized aliases."""
+        if self.sender is not None and self.sender != sender:
+            return False
+        if self.domain is not None and self.domain not in domains:
+            return False
+        if self.recipient is not None and self.recipient not in recipients:
+            return False
+        if self._subject_re is not None and not self._subject_re.search(subject):
+            return False
+        return True
+
+    def describe(self) -> str:
+        if not self.reply:
+            return f"{self.name}: no reply"
+        actions = [f"template {self.template}"] if self.template else []
+        if self.cooldown is not None:
+            actions.append(f"cooldown {self.cooldown:g}s")
+        return f"{self.name}: {', '.join(actions) or 'default reply'}"
+
+
+# -----------------------
+# Subject index
+# -----------------------
+def _literal_runs(items, ignore_case):
+    """Literal strings that every match of the parsed sequence `items` contains."""
+    runs, current = [], []
+    for op, av in items:
+        if op is LITERAL:
+            current.append(chr(av).lower() if ignore_case else chr(av))
+            continue
+        if op is AT:
+            continue  # anchors and \b take no characters
+        if current:
+            runs.append("".join(current))
+            current = []
+        if op is SUBPATTERN:
+            runs.extend(_literal_runs(av[-1], ignore_case))
+    if current:
+        runs.append("".join(current))
+    return runs
+
+
+def required_literals(pattern):
+    """
+    For each top-level alternative of `pattern`, the lower-case literals every
+    match of it contains (any one of them is enough to index by), or None if some
+    alternative has none of useful length.
+    """
+    items = list(sre_parse.parse(pattern, re.IGNORECASE))
+    branches = [items]
+    if len(items) == 1 and items[0][0] is BRANCH:
+        branches = [list(branch) for branch in items[0][1][1]]
+    found = []
+    for branch in branches:
+        runs = sorted({run for run in _literal_runs(branch, True) if len(run) >= MIN_INDEX_LITERAL})
+        if not runs:
+            return None
+        found.append(runs)
+    return found
+
+
+class _Automaton:
+    """Aho-Corasick over lower-case literals: search() is linear in the text, whatever the number of literals."""
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+    def add(self, word, value):
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(value)
+
+    def build(self):
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def search(self, text):
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        found = []
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.extend(out[state])
+        return found
+
+
+# -----------------------
+# Rule set
+# -----------------------
+def _domains(address):
+    domain = address.rpartition("@")[2]
+    labels = domain.split(".")
+    return [".".join(labels[i:]) for i in range(len(labels))] if domain else []
+
+
+def _alias(address):
+    local, at, domain = address.lower().partition("@")
+    return local.partition("+")[0] + at + domain
+
+
+class RuleSet:
+    """
+    Rules compiled for constant-time dispatch. Each rule is indexed by its most
+    selective condition: exact sender, recipient alias, domain, or a literal its
+    subject pattern requires (per alternative, the one fewest other rules use; one
+    automaton for all of them). match() only
+    verifies the candidates those lookups return and picks the earliest matching
+    rule. Rules with nothing to index by (a catch-all, or a subject pattern with
+    no literal of MIN_INDEX_LITERAL characters) are checked one by one; `unindexed`
+    counts them.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self._by_sender = {}
+        self._by_recipient = {}
+        self._by_domain = {}
+        self._automaton = _Automaton()
+        self._scan = []
+        by_subject = []
+        for rule in self.rules:
+            choices = self._index(rule)
+            if choices:
+                by_subject.append((rule, choices))
+        # a literal shared by many rules makes a poor key: index each alternative by its rarest one
+        usage = Counter(run for _, choices in by_subject for runs in choices for run in runs)
+        for rule, choices in by_subject:
+            for literal in {min(runs, key=lambda run: (usage[run], -len(run))) for runs in choices}:
+                self._automaton.add(literal, rule)
+        self._automaton.build()
+        for bucket in (*self._by_sender.values(), *self._by_recipient.values(), *self._by_domain.values()):
+            bucket.sort(key=lambda r: r.index)
+        self.unindexed = len(self._scan)
+        self.templates = sorted({r.template for r in self.rules if r.template})
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _index(self, rule):
+        """Files `rule` under a hash index; returns its subject literals if it needs the automaton."""
+        if rule.sender is not None:
+            self._by_sender.setdefault(rule.sender, []).append(rule)
+        elif rule.recipient is not None:
+            self._by_recipient.setdefault(rule.recipient, []).append(rule)
+        elif rule.domain is not None:
+            self._by_domain.setdefault(rule.domain, []).append(rule)
+        else:
+            choices = required_literals(rule.subject) if rule.subject else None
+            if choices:
+                return choices
+            self._scan.append(rule)
+        return None
+
+    def match_message(self, headers, sender):
+        """match() for a fetched header block (see synapse_imap.HEADER_FIELDS)."""
+        if not self.rules:
+            return None
+        fields = []
+        for name in RECIPIENT_HEADERS:
+            fields.extend(headers.get_all(name, []))
+        recipients = [addr for _, addr in email.utils.getaddresses(fields) if addr]
+        return self.match(sender, recipients, header_text(headers.get("Subject")))
+
+    def match(self, sender, recipients=(), subject=""):
+        """The first rule (in file order) that applies to the message, or None."""
+        if not self.rules:
+            return None
+        sender = (sender or "").lower()
+        domains = _domains(sender)
+        aliases = {_alias(r) for r in recipients}
+        aliases.update(r.lower() for r in recipients)
+        subject = subject or ""
+        best = None
+        buckets = [self._by_sender.get(sender)]
+        buckets.extend(self._by_recipient.get(alias) for alias in aliases)
+        buckets.extend(self._by_domain.get(domain) for domain in domains)
+        for bucket in buckets:
+            for rule in bucket or ():
+                if best is not None and rule.index >= best.index:
+                    break
+                if rule.matches(sender, domains, aliases, subject):
+                    best = rule
+                    break
+        candidates = self._automaton.search(subject.lower()) if subject else []
+        for rule in candidates + self._scan:
+            if (best is None or rule.index < best.index) and rule.matches(sender, domains, aliases, subject):
+                best = rule
+        return best
+
+
+def rule_from_dict(index, raw):
+    unknown = set(raw) - set(RULE_KEYS)
+    if unknown:
+        raise ValueError(f"rule {index + 1}: unknown keys {sorted(unknown)}")
+    try:
+        return Rule(index, sender=raw.get("from"), domain=raw.get("domain"), recipient=raw.get("to"),
+                    subject=raw.get("subject"), template=raw.get("template"), cooldown=raw.get("cooldown"),
+                    reply=raw.get("reply", True), name=raw.get("name"))
+    except re.error as e:
+        raise ValueError(f"rule {index + 1}: bad subject pattern: {e}") from None
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"rule {index + 1}: {e}") from None
+
+
+def load_rules(path=None) -> RuleSet:
+    """
+    Read a rules file (default: RULES_FILE in the data directory; missing: no rules):
+        {"rules": [{"domain": "bigcustomer.com", "template": "vip"},
+                   {"subject": "invoice|receipt", "template": "billing", "cooldown": 86400},
+                   {"from": "boss@example.com", "reply": false},
+                   {"to": "sales@example.com", "template": "sales"}]}
+    """
+    path = path or data_path(RULES_FILE)
+    if not os.path.exists(path):
+        return RuleSet()
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    entries = raw.get("rules") if isinstance(raw, dict) else raw
+    if not isinstance(entries, list):
+        raise ValueError("rules file has no 'rules' list")
+    return RuleSet(rule_from_dict(i, entry) for i, entry in enumerate(entries))
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Polling schedule for Auto Mail Center's inbox worker (used when IDLE is off
+or unsupported).
+- CheckScheduler: sleeps on a condition until the next check is due, wakes
+  early for stop / "check now" / interval changes, and adapts the interval to
+  the arrival rate and to server throttling within [min, max]
+- parse_interval_bounds(): the [min, max] range from the sidebar's "5, 600"
+"""
+
+import threading
+import time
+
+from synapse_metrics import METRICS
+
+# default range the adaptive interval moves in (seconds); the sidebar can change it
+SCHEDULER_MIN_INTERVAL = 5
+SCHEDULER_MAX_INTERVAL = 600
+# weight of the newest sample in the arrival-rate average
+SCHEDULER_RATE_ALPHA = 0.3
+# a busy inbox is checked often enough to find about this many new messages per check
+SCHEDULER_TARGET_BATCH = 1.0
+# an empty check stretches the interval by this factor; a throttling response by the other
+SCHEDULER_GROWTH = 1.5
+SCHEDULER_THROTTLE_FACTOR = 2.0
+# empty checks stretch the interval to at most this many times the user's (a quiet inbox still gets checked)
+SCHEDULER_MAX_STRETCH = 4.0
+
+# wait() results
+WAKE_TIMER = "timer"
+WAKE_MANUAL = "manual"
+WAKE_STOP = "stop"
+
+
+def parse_interval_bounds(value):
+    """(min, max) seconds from "5, 600" (the sidebar field); empty: the defaults."""
+    if value is None or not str(value).strip():
+        return SCHEDULER_MIN_INTERVAL, SCHEDULER_MAX_INTERVAL
+    parts = [p.strip() for p in str(value).split(",")]
+    if len(parts) != 2:
+        raise ValueError("the adaptive range is two numbers: shortest, longest interval in seconds")
+    try:
+        low, high = int(parts[0]), int(parts[1])
+    except ValueError:
+        raise ValueError(f"the adaptive range must be whole seconds, not {value!r}") from None
+    if low < 1:
+        raise ValueError("the shortest interval must be at least 1 second")
+    if high < low:
+        raise ValueError("the longest interval cannot be shorter than the shortest")
+    return low, high
+
+
+class CheckScheduler:
+    """
+    Decides when the polling worker checks next. `interval` is the user's
+    setting; with `adaptive` on, record() moves the effective interval:
+    - new mail: down towards SCHEDULER_TARGET_BATCH / arrival rate
+    - an empty check: up by SCHEDULER_GROWTH, to at most max_stretch times the
+      user's interval (and back down to that after throttling)
+    - a throttling response: at least the user's interval, times SCHEDULER_THROTTLE_FACTOR
+    always clamped to [min_interval, max_interval]. Checks that run earlier than
+    the fixed interval would have, and fixed-interval checks that were skipped,
+    are counted in the metrics (checks_accelerated / checks_skipped), and the
+    effective interval is exported as the check_interval_seconds gauge.
+    Thread-safe; wait() is meant for the worker thread.
+    """
+
+    def __init__(self, interval, min_interval=SCHEDULER_MIN_INTERVAL, max_interval=SCHEDULER_MAX_INTERVAL,
+                 adaptive=True, stop_event=None, metrics=None, max_stretch=SCHEDULER_MAX_STRETCH):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.max_stretch = max(1.0, max_stretch)
+        self.adaptive = adaptive
+        self.stop_event = stop_event
+        self.metrics = metrics or METRICS
+        self.rate = 0.0  # new messages per second, moving average
+        self._cond = threading.Condition()
+        self._manual = False
+        self._last_check = None
+        self._skipped = 0.0  # fractional fixed-interval checks skipped so far
+        self.base = self._clamp(interval)
+        self.interval = self.base
+        self.metrics.set_gauge("check_interval_seconds", self.interval)
+
+    def _clamp(self, seconds):
+        return min(self.max_interval, max(self.min_interval, float(seconds)))
+
+    # ---- control (any thread) ----
+    def set_interval(self, seconds):
+        """New user interval; a waiting worker re-evaluates its deadline right away."""
+        with self._cond:
+            self.base = self._clamp(seconds)
+            self.interval = self.base  # adapting restarts from the user's choice
+            self.metrics.set_gauge("check_interval_seconds", self.interval)
+            self._cond.notify_all()
+
+    def set_adaptive(self, adaptive):
+        with self._cond:
+            self.adaptive = bool(adaptive)
+            if not self.adaptive:
+                self.interval = self.base
+                self.rate = 0.0
+            self.metrics.set_gauge("check_interval_seconds", self.interval)
+            self._cond.notify_all()
+
+    def check_now(self):
+        with self._cond:
+            self._manual = True
+            self._cond.notify_all()
+
+    def wake(self):
+        """Re-check the stop event (call after setting it)."""
+        with self._cond:
+            self._cond.notify_all()
+
+    # ---- worker thread ----
+    def wait(self):
+        """Block until the next check is due; returns WAKE_TIMER, WAKE_MANUAL or WAKE_STOP."""
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                if self.stop_event is not None and self.stop_event.is_set():
+                    return WAKE_STOP
+                if self._manual:
+                    self._manual = False
+                    self.metrics.inc("checks_manual")
+                    return WAKE_MANUAL
+                interval = self.interval
+                remaining = started + interval - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if interval < self.base:
+                self.metrics.inc("checks_accelerated")
+            elif interval > self.base:
+                self._skipped += interval / self.base - 1
+                skipped = int(self._skipped)
+                if skipped:
+                    self._skipped -= skipped
+                    self.metrics.inc("checks_skipped", skipped)
+        return WAKE_TIMER
+
+    def record(self, new_messages, throttled=False):
+        """Feed back the outcome of a check: how many new messages it found, and whether the server pushed back."""
+        now = time.monotonic()
+        with self._cond:
+            elapsed = now - self._last_check if self._last_check is not None else None
+            self._last_check = now
+            if not self.adaptive:
+                return
+            if throttled:
+                interval = max(self.interval, self.base) * SCHEDULER_THROTTLE_FACTOR
+                self.metrics.inc("checks_throttled")
+            elif new_messages and elapsed:
+                sample = new_messages / elapsed
+                self.rate = sample if not self.rate else SCHEDULER_RATE_ALPHA * sample + (1 - SCHEDULER_RATE_ALPHA) * self.rate
+                interval = min(self.interval, SCHEDULER_TARGET_BATCH / self.rate)
+            elif new_messages:
+                interval = self.interval  # first check of a run: a backlog says nothing about the rate
+            else:
+                self.rate *= 1 - SCHEDULER_RATE_ALPHA
+                cap = self.base * self.max_stretch
+                if self.interval > cap:
+                    interval = max(cap, self.interval / SCHEDULER_GROWTH)  # easing off after throttling
+                else:
+                    interval = min(self.interval * SCHEDULER_GROWTH, cap)
+            self.interval = self._clamp(interval)
+            self.metrics.set_gauge("check_interval_seconds", self.interval)
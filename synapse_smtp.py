@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+SMTP helpers for Auto Mail Center.
+- SmtpPool: bounded pool of authenticated SMTP_SSL sessions shared by every send path
+"""
+
+import re
+import smtplib
+import threading
+import time
+
+from synapse_config import DEFAULT_SMTP_POOL_SIZE  # re-exported (see __all__); the GUI reads it from synapse_config
+from synapse_metrics import METRICS
+
+__all__ = [  # DEFAULT_SMTP_POOL_SIZE is re-exported from synapse_config
+    "DEFAULT_SMTP_POOL_SIZE", "SMTP_TIMEOUT", "SMTP_MAX_MESSAGES_PER_CONN", "SMTP_KEEPALIVE_SECONDS",
+    "SMTP_MAX_IDLE_SECONDS", "connection_lost", "quota_exceeded", "SmtpPool"
+]
+
+SMTP_TIMEOUT = 20  # seconds
+# retire a connection after this many messages (providers cap messages per session)
+SMTP_MAX_MESSAGES_PER_CONN = 100
+# idle connections are NOOP'ed this often, and closed once idle for SMTP_MAX_IDLE_SECONDS
+SMTP_KEEPALIVE_SECONDS = 60
+SMTP_MAX_IDLE_SECONDS = 300
+# enhanced status code (RFC 3463) in a reply, and the words of a policy reply about the account's sending limit
+_STATUS_RE = re.compile(r"\b[245]\.\d{1,3}\.\d{1,3}\b")
+_SENDING_LIMIT_WORDS = ("sending limit", "send limit", "sending quota", "limit exceeded", "rate limit",
+                        "too many messages", "daily user sending")
+
+
+def connection_lost(exc) -> bool:
+    """True if `exc` means the SMTP connection can no longer be used (421, disconnect, socket error)."""
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code == 421
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(exc, smtplib.SMTPException):
+        return False
+    return isinstance(exc, OSError)
+
+
+def quota_exceeded(exc) -> bool:
+    """
+    True if the server refused the send because the account's sending limit is
+    used up: 5.4.5 (Gmail), or a 4.7.x / 5.7.x policy reply about sending
+    limits. A recipient's full mailbox (5.2.2 "over quota") is that recipient's
+    failure, not the account's.
+    """
+    if not isinstance(exc, smtplib.SMTPResponseException):
+        return False
+    text = exc.smtp_error.decode("utf-8", "replace") if isinstance(exc.smtp_error, bytes) else str(exc.smtp_error)
+    text = text.lower()
+    status = _STATUS_RE.search(text)
+    if status is None:
+        return False
+    if status.group(0) == "5.4.5":
+        return True
+    return status.group(0)[1:3] == ".7" and any(word in text for word in _SENDING_LIMIT_WORDS)
+
+
+class _PooledConnection:
+    __slots__ = ("smtp", "created", "last_used", "sent")
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.created = self.last_used = time.monotonic()
+        self.sent = 0
+
+
+# -----------------------
+# Connection pool
+# -----------------------
+class SmtpPool:
+    """
+    Keeps up to `size` logged-in SMTP sessions and reuses them across messages.
+    A reused session is RSET before each message (which doubles as a liveness
+    check), retired after `max_messages` messages or `max_idle` seconds idle, and
+    replaced transparently on 421 / disconnect. A daemon thread NOOPs idle
+    sessions so they are not dropped by the server between bursts. Thread-safe.
+    """
+
+    def __init__(self, host, port, user, password, size=DEFAULT_SMTP_POOL_SIZE,
+                 max_messages=SMTP_MAX_MESSAGES_PER_CONN, max_idle=SMTP_MAX_IDLE_SECONDS,
+                 keepalive=SMTP_KEEPALIVE_SECONDS, timeout=SMTP_TIMEOUT, metrics=None, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.size = max(1, int(size))
+        self.max_messages = max_messages
+        self.max_idle = max_idle
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.metrics = metrics or METRICS
+        self.ssl_context = ssl_context  # None: system defaults; False: plaintext (local test servers only)
+
+        self._idle = []  # LIFO: the most recently used session is the most likely alive
+        self._open = 0   # sessions checked out + idle (+ slots being connected)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stop = threading.Event()
+        self._reaper = None
+
+        # stats
+        self.connects = 0
+        self.sent = 0
+
+    # ---- public API ----
+    def send(self, msg):
+        """
+        Send an email.message.Message (or anything with envelope()), retrying once
+        on a fresh session if the connection was lost.
+        """
+        for attempt in (1, 2):
+            conn = self._acquire()
+            try:
+                with self.metrics.timer("smtp_send"):
+                    if hasattr(msg, "envelope"):
+                        # pre-encoded (synapse_templates.StampedMessage): no re-flattening
+                        conn.smtp.sendmail(*msg.envelope())
+                    else:
+                        conn.smtp.send_message(msg)
+            except Exception as e:
+                if connection_lost(e):
+                    self._discard(conn)
+                    if attempt == 1:
+                        continue
+                else:
+                    self._release(conn)
+                raise
+            conn.sent += 1
+            self._release(conn)
+            with self._cond:
+                self.sent += 1
+            return
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        self._stop.set()
+        for conn in idle:
+            self._quit(conn)
+
+    def stats(self):
+        with self._cond:
+            return {"open": self._open, "idle": len(self._idle), "connects": self.connects, "sent": self.sent}
+
+    # ---- internals ----
+    def _acquire(self):
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise smtplib.SMTPServerDisconnected("SMTP pool closed")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    conn = None
+                    break
+                self._cond.wait()
+
+        if conn is not None:
+            if time.monotonic() - conn.last_used <= self.max_idle:
+                try:
+                    code, _ = conn.smtp.rset()
+                    if code == 250:
+                        return conn
+                except Exception:
+                    pass
+            # stale or dead: reuse its slot for a fresh session
+            self._quit(conn)
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def _connect(self):
+        with self.metrics.timer("smtp_connect"):
+            if self.ssl_context is False:
+                smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            else:
+                smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=self.ssl_context)
+        try:
+            with self.metrics.timer("smtp_login"):
+                smtp.login(self.user, self.password)
+        except Exception:
+            self._quit(_PooledConnection(smtp))
+            raise
+        with self._cond:
+            self.connects += 1
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_loop, name="smtp-pool-keepalive", daemon=True)
+                self._reaper.start()
+        return _PooledConnection(smtp)
+
+    def _release(self, conn):
+        conn.last_used = time.monotonic()
+        with self._cond:
+            if not self._closed and conn.sent < self.max_messages:
+                self._idle.append(conn)
+                self._cond.notify()
+                return
+            self._open -= 1
+            self._cond.notify()
+        self._quit(conn)
+
+    def _discard(self, conn):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+        self._quit(conn)
+
+    @staticmethod
+    def _quit(conn):
+        try:
+            conn.smtp.quit()
+        except Exception:
+            try:
+                conn.smtp.close()
+            except Exception:
+                pass
+
+    def _reap_loop(self):
+        while not self._stop.wait(self.keepalive):
+            now = time.monotonic()
+            with self._cond:
+                # take quiet sessions out of the pool while we talk to them
+                quiet = [c for c in self._idle if now - c.last_used >= self.keepalive]
+                self._idle = [c for c in self._idle if now - c.last_used < self.keepalive]
+            for conn in quiet:
+                if now - conn.last_used > self.max_idle:
+                    self._discard(conn)
+                    continue
+                try:
+                    code, _ = conn.smtp.noop()
+                    alive = code == 250
+                except Exception:
+                    alive = False
+                if not alive:
+                    self._discard(conn)
+                    continue
+                with self._cond:
+                    if self._closed:
+                        self._open -= 1
+                    else:
+                        # keep last_used: NOOP keeps the socket alive, not the session "busy"
+                        self._idle.insert(0, conn)
+                        self._cond.notify()
+                        continue
+                self._quit(conn)
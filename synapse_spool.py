@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+Durable outbound mail for Auto Mail Center.
+- OutboundSpool: SQLite (WAL) outbox that auto-replies and Composer greetings
+  are written to before anything talks to SMTP; failed sends stay in it with a
+  retry schedule, and messages that keep failing move to a dead-letter state
+- SpoolSender: worker threads that drain the spool through a send callable
+  (SmtpPool.send), with exponential backoff and permanent/transient triage;
+  with a SendGovernor each send waits for the account's quota first
+"""
+
+import email.utils
+import json
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+from email.policy import SMTP as SMTP_POLICY
+
+from synapse_metrics import METRICS
+from synapse_quota import PRIORITY_BY_KIND, PRIORITY_REPLY
+from synapse_smtp import DEFAULT_SMTP_POOL_SIZE, connection_lost, quota_exceeded
+
+# retry schedule: SPOOL_RETRY_BASE * 2^(attempt-1) seconds (jittered), capped
+SPOOL_RETRY_BASE = 30
+SPOOL_RETRY_CAP = 3600
+# a message that failed this many times goes to the dead-letter queue
+SPOOL_MAX_ATTEMPTS = 8
+# senders re-check the spool at least this often even without a wake-up
+SPOOL_POLL_SECONDS = 30
+
+QUEUED = "queued"
+SENDING = "sending"
+DEAD = "dead"
+
+
+def permanent_failure(exc) -> bool:
+    """
+    True if retrying cannot help: a 5xx reply to the message, or to every
+    recipient, or a message that cannot be serialized. Authentication errors
+    and 4xx / connection problems are transient.
+    """
+    if isinstance(exc, smtplib.SMTPAuthenticationError):
+        return False  # fix the credentials and the queue drains again
+    if quota_exceeded(exc):
+        return False  # the sending limit resets; the message goes out then
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return bool(exc.recipients) and all(code >= 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 500 <= exc.smtp_code < 600
+    return not isinstance(exc, (smtplib.SMTPException, OSError))
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds to wait after the `attempts`-th failure (equal jitter)."""
+    ceiling = min(SPOOL_RETRY_CAP, SPOOL_RETRY_BASE * (2 ** max(0, attempts - 1)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class SpoolEntry:
+    """One spooled message; envelope() makes it directly sendable by SmtpPool."""
+
+    __slots__ = ("id", "kind", "from_addr", "rcpts", "raw", "queued", "attempts", "last_error")
+
+    def __init__(self, id, kind, from_addr, rcpts, raw, queued, attempts, last_error):
+        self.id = id
+        self.kind = kind
+        self.from_addr = from_addr
+        self.rcpts = rcpts
+        self.raw = raw
+        self.queued = queued
+        self.attempts = attempts
+        self.last_error = last_error
+
+    def envelope(self):
+        return self.from_addr, list(self.rcpts), self.raw
+
+
+def _envelope_of(msg):
+    if hasattr(msg, "envelope"):
+        from_addr, rcpts, raw = msg.envelope()
+    else:
+        from_addr = email.utils.parseaddr(msg["From"])[1]
+        rcpts = [addr for _, addr in email.utils.getaddresses(msg.get_all("To", []) + msg.get_all("Cc", []))]
+        raw = msg.as_bytes(policy=SMTP_POLICY)
+    if not rcpts:
+        raise ValueError("message has no recipients")
+    return from_addr, list(rcpts), bytes(raw)
+
+
+# -----------------------
+# On-disk outbox
+# -----------------------
+class OutboundSpool:
+    """
+    Outgoing messages of `account` as encoded bytes plus envelope, one row each.
+    enqueue() returns only after the row is committed, so a message accepted
+    here survives crashes and restarts. Rows being sent when the process died
+    are picked up again on open (delivery is at-least-once). Thread-safe.
+    """
+
+    def __init__(self, path, account, max_attempts=SPOOL_MAX_ATTEMPTS):
+        self.path = path
+        self.account = account.lower()
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY,"
+            " account TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " from_addr TEXT NOT NULL,"
+            " rcpts TEXT NOT NULL,"
+            " raw BLOB NOT NULL,"
+            " queued REAL NOT NULL,"
+            " state TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt REAL NOT NULL,"
+            " last_error TEXT NOT NULL DEFAULT '')"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (account, state, next_attempt)")
+        self._db.execute("UPDATE outbox SET state = ? WHERE account = ? AND state = ?", (QUEUED, self.account, SENDING))
+        self._db.commit()
+
+    def enqueue(self, msg, kind="reply", now=None) -> int:
+        """Persist an email.message.Message (or anything with envelope()); returns its spool id."""
+        from_addr, rcpts, raw = _envelope_of(msg)
+        now = now or time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO outbox (account, kind, from_addr, rcpts, raw, queued, state, next_attempt)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.account, kind, from_addr, json.dumps(rcpts), raw, now, QUEUED, now),
+            )
+            self._db.commit()
+            return cur.lastrowid
+
+    def claim(self, now=None):
+        """Mark the earliest due message (auto-replies first) as being sent and return it (None if nothing is due)."""
+        with self._lock:
+            while True:
+                row = self._db.execute(
+                    "SELECT id, kind, from_addr, rcpts, raw, queued, attempts, last_error FROM outbox"
+                    " WHERE account = ? AND state = ? AND next_attempt <= ?"
+                    " ORDER BY kind != 'reply', next_attempt, id LIMIT 1",
+                    (self.account, QUEUED, now or time.time()),
+                ).fetchone()
+                if row is None:
+                    return None
+                # the GUI and the accounts engine may drain one account's outbox: only one of them wins the row
+                claimed = self._db.execute("UPDATE outbox SET state = ? WHERE id = ? AND state = ?",
+                                           (SENDING, row[0], QUEUED)).rowcount
+                self._db.commit()
+                if claimed:
+                    break
+        id, kind, from_addr, rcpts, raw, queued, attempts, last_error = row
+        return SpoolEntry(id, kind, from_addr, json.loads(rcpts), raw, queued, attempts, last_error)
+
+    def next_due(self):
+        """Epoch time of the next scheduled attempt, or None if nothing is queued."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT MIN(next_attempt) FROM outbox WHERE account = ? AND state = ?", (self.account, QUEUED),
+            ).fetchone()[0]
+
+    def delivered(self, entry):
+        with self._lock:
+            self._db.execute("DELETE FROM outbox WHERE id = ?", (entry.id,))
+            self._db.commit()
+
+    def failed(self, entry, error, permanent=False, now=None) -> bool:
+        """Record a failed attempt; returns True if the message was dead-lettered."""
+        entry.attempts += 1
+        entry.last_error = str(error)[:500]
+        dead = permanent or entry.attempts >= self.max_attempts
+        now = now or time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET state = ?, attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                (DEAD if dead else QUEUED, entry.attempts, now + (0 if dead else retry_delay(entry.attempts)),
+                 entry.last_error, entry.id),
+            )
+            self._db.commit()
+        return dead
+
+    def release(self, entry):
+        """Put a claimed message back unchanged (sender stopping before it was tried)."""
+        with self._lock:
+            self._db.execute("UPDATE outbox SET state = ? WHERE id = ? AND state = ?", (QUEUED, entry.id, SENDING))
+            self._db.commit()
+
+    def dead_letters(self, limit=200):
+        """Dead-lettered messages, newest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, kind, from_addr, rcpts, raw, queued, attempts, last_error FROM outbox"
+                " WHERE account = ? AND state = ? ORDER BY id DESC LIMIT ?",
+                (self.account, DEAD, limit),
+            ).fetchall()
+        return [SpoolEntry(id, kind, f, json.loads(r), raw, q, a, err) for id, kind, f, r, raw, q, a, err in rows]
+
+    def requeue_dead(self, ids=None, now=None) -> int:
+        """Give dead letters (all, or just `ids`) a fresh set of attempts; returns how many."""
+        return self._update_dead("UPDATE outbox SET state = ?, attempts = 0, next_attempt = ?"
+                                 " WHERE account = ? AND state = ?", (QUEUED, now or time.time()), ids)
+
+    def discard_dead(self, ids=None) -> int:
+        return self._update_dead("DELETE FROM outbox WHERE account = ? AND state = ?", (), ids)
+
+    def _update_dead(self, sql, params, ids):
+        params = params + (self.account, DEAD)
+        if ids is not None:
+            ids = list(ids)
+            if not ids:
+                return 0
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            params += tuple(ids)
+        with self._lock:
+            cur = self._db.execute(sql, params)
+            self._db.commit()
+            return cur.rowcount
+
+    def counts(self):
+        """{"queued": n, "sending": n, "dead": n}"""
+        out = {QUEUED: 0, SENDING: 0, DEAD: 0}
+        with self._lock:
+            for state, n in self._db.execute(
+                    "SELECT state, COUNT(*) FROM outbox WHERE account = ? GROUP BY state", (self.account,)):
+                out[state] = n
+        return out
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# -----------------------
+# Spool drain
+# -----------------------
+class SpoolSender:
+    """
+    Drains an OutboundSpool with `workers` threads, each handing one message at
+    a time to `send(entry)`. Success deletes the row and calls on_sent(entry);
+    a permanent failure (see permanent_failure) or the last allowed attempt
+    moves it to the dead-letter queue and calls on_dead(entry); anything else
+    is retried with exponential backoff. A lost connection or rejected login also pauses every
+    worker, for longer after each consecutive one, so an SMTP outage costs one
+    attempt per backoff step instead of one per queued message (new mail does
+    not cut the pause short; resume() does). Idle workers sleep until enqueue()
+    / wake() or the next scheduled retry. With a `governor` (SendGovernor) a
+    claimed message waits for the account's send quota before it is sent.
+    """
+
+    def __init__(self, spool, send, workers=DEFAULT_SMTP_POOL_SIZE, log=None, metrics=None,
+                 on_sent=None, on_dead=None, governor=None):
+        self.spool = spool
+        self.send = send
+        self.workers = max(1, int(workers))
+        self.log = log or (lambda text: None)
+        self.metrics = metrics or METRICS
+        self.on_sent = on_sent or (lambda entry: None)
+        self.on_dead = on_dead or (lambda entry: None)
+        self.governor = governor
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._stopped = threading.Event()  # ends a wait for quota
+        self._paused_until = 0.0
+        self._outages = 0  # consecutive connection-level failures, across workers
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"spool-sender-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def enqueue(self, msg, kind="reply") -> int:
+        """Spool `msg` durably and wake a worker; returns the spool id."""
+        spool_id = self.spool.enqueue(msg, kind)
+        self.metrics.inc("spool_enqueued")
+        self.wake()
+        return spool_id
+
+    def wake(self):
+        """Let idle workers look at the spool again; a paused sender stays paused."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def resume(self):
+        """End an outage pause now (the user asked for the queue to be retried)."""
+        with self._cond:
+            self._paused_until = 0.0
+            self._cond.notify_all()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._stopped.set()
+
+    def join(self, timeout=None) -> bool:
+        """Wait for the workers to exit; False if one is still sending when `timeout` runs out."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for t in self._threads:
+            t.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not any(t.is_alive() for t in self._threads)
+
+    def _wait(self, seconds):
+        with self._cond:
+            if not self._stopping:
+                self._cond.wait(max(0.05, seconds))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                paused = self._paused_until - time.monotonic()
+            if paused > 0:
+                self._wait(paused)
+                continue
+            try:
+                entry = self.spool.claim()
+            except sqlite3.Error as e:
+                self.log(f"❌ Outbox error: {e}")
+                self._wait(SPOOL_POLL_SECONDS)
+                continue
+            if entry is None:
+                due = self.spool.next_due()
+                self._wait(SPOOL_POLL_SECONDS if due is None else min(SPOOL_POLL_SECONDS, due - time.time()))
+                continue
+            with self._cond:
+                stopping = self._stopping
+            if stopping:
+                self.spool.release(entry)
+                return
+            if self.governor is not None:
+                if not self.governor.acquire(PRIORITY_BY_KIND.get(entry.kind, PRIORITY_REPLY), self._stopped):
+                    self.spool.release(entry)
+                    return
+            self._deliver(entry)
+
+    def _deliver(self, entry):
+        to = ", ".join(entry.rcpts)
+        try:
+            self.send(entry)
+        except Exception as e:
+            permanent = permanent_failure(e)
+            if entry.kind == "reply":
+                self.metrics.inc("reply_errors")
+            if self.spool.failed(entry, e, permanent):
+                self.metrics.inc("spool_dead_letters")
+                why = "rejected" if permanent else f"failed {entry.attempts} times"
+                self.log(f"❌ {entry.kind.capitalize()} to {to} {why} — moved to dead letters: {e}")
+                self.on_dead(entry)
+                return
+            self.metrics.inc("spool_retries")
+            self.log(f"⚠ {entry.kind.capitalize()} to {to} failed (attempt {entry.attempts}), will retry: {e}")
+            if quota_exceeded(e) and self.governor is not None:
+                self.governor.exhausted()
+            elif connection_lost(e) or isinstance(e, smtplib.SMTPAuthenticationError):
+                with self._cond:
+                    self._outages += 1
+                    self._paused_until = time.monotonic() + retry_delay(self._outages)
+            return
+        with self._cond:
+            self._outages = 0
+        self.spool.delivered(entry)
+        self.on_sent(entry)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Startup profiling for Auto Mail Center (python SynapseMail.py --profile-startup).
+- STARTUP: process-wide StartupProfile; mark() records milestones (imports done,
+  window built, login dialog shown) and section() times a block of construction
+- enable() also times every module imported from then on, so report() can name
+  the imports that dominate time-to-login-dialog
+Imported first by SynapseMail: its clock starts with the app.
+"""
+
+import builtins
+import sys
+import time
+from contextlib import contextmanager
+
+# slowest imports listed in the report
+STARTUP_REPORT_TOP = 15
+# importers whose imports are itemized (the app's own modules)
+APP_MODULE_PREFIXES = ("synapse", "__main__", "SynapseMail")
+
+
+class StartupProfile:
+    """Milestones and per-module import times since this module was loaded; inert until enable()."""
+
+    def __init__(self):
+        self.enabled = False
+        self.started = time.perf_counter()
+        self.marks = []  # (label, seconds since start)
+        self.sections = []  # (label, seconds, depth)
+        self.imports = []  # (module, seconds including its own imports, importer)
+        self.import_seconds = 0.0  # all imports, nested ones counted once
+        self._depth = 0
+        self._import_depth = 0
+        self._import = None
+
+    def enable(self):
+        """Start recording; installs an import hook until report()."""
+        if self.enabled:
+            return
+        self.enabled = True
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def disable(self):
+        """Removes the import hook; marks and sections are no longer recorded."""
+        self.enabled = False
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+        importer = (globals or {}).get("__name__", "?")
+        self._import_depth += 1
+        start = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            seconds = time.perf_counter() - start
+            self._import_depth -= 1
+            if not self._import_depth:
+                self.import_seconds += seconds
+            if importer.startswith(APP_MODULE_PREFIXES):
+                self.imports.append((name, seconds, importer))
+
+    def mark(self, label):
+        if self.enabled:
+            self.marks.append((label, time.perf_counter() - self.started))
+
+    @contextmanager
+    def section(self, label):
+        """Times the block as one line of the construction breakdown (nested sections indent)."""
+        if not self.enabled:
+            yield
+            return
+        entry = [label, 0.0, self._depth]
+        self.sections.append(entry)
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry[1] = time.perf_counter() - start
+            self._depth -= 1
+
+    def report(self) -> str:
+        """The breakdown as text; stops recording (call once startup is over)."""
+        self.disable()
+        lines = ["⏱ Startup profile (ms since SynapseMail started loading)"]
+        lines.extend(f"  {at * 1000:>8.1f}  {label}" for label, at in self.marks)
+        if self.sections:
+            lines.append("Construction (ms):")
+            lines.extend(f"  {seconds * 1000:>8.1f}  {'  ' * depth}{label}" for label, seconds, depth in self.sections)
+        if self.imports:
+            lines.append(f"Slowest imports (ms, including what they import; {self.import_seconds * 1000:.1f} ms "
+                         "importing in all):")
+            top = sorted(self.imports, key=lambda entry: entry[1], reverse=True)[:STARTUP_REPORT_TOP]
+            lines.extend(f"  {seconds * 1000:>8.1f}  {name:<28} from {importer}" for name, seconds, importer in top)
+        return "\n".join(lines)
+
+
+STARTUP = StartupProfile()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent local stores for Auto Mail Center.
+- RepliedStore: durable "who did we already answer" set (SQLite WAL) with
+  per-sender cooldowns and a Bloom filter in front for the common never-seen case
+"""
+
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+
+from synapse_config import DEFAULT_REPLY_COOLDOWN_SECONDS  # re-exported (see __all__)
+
+__all__ = [  # DEFAULT_REPLY_COOLDOWN_SECONDS is re-exported from synapse_config
+    "DEFAULT_REPLY_COOLDOWN_SECONDS", "BLOOM_INITIAL_CAPACITY", "BLOOM_ERROR_RATE", "BloomFilter", "RepliedStore"
+]
+
+# Bloom filter sizing; it is rebuilt twice as large when the account outgrows it
+BLOOM_INITIAL_CAPACITY = 100_000
+BLOOM_ERROR_RATE = 0.01
+
+
+# -----------------------
+# Bloom filter
+# -----------------------
+class BloomFilter:
+    """Fixed-size Bloom filter over str keys (double hashing of one blake2b digest)."""
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        self.capacity = max(1, int(capacity))
+        self.nbits = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.nhashes = max(1, round(self.nbits / self.capacity * math.log(2)))
+        self.bits = bytearray((self.nbits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.nhashes):
+            yield (h1 + i * h2) % self.nbits
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+# -----------------------
+# Replied-to store
+# -----------------------
+class RepliedStore:
+    """
+    Senders already answered by `account`, kept in SQLite (WAL) so the record
+    survives logout and restarts. Each row remembers when we last replied and an
+    optional per-sender cooldown; a sender is due again once the cooldown has
+    passed (no cooldown: never again). Lookups are O(1): a Bloom filter rejects
+    never-seen senders without touching the database, and only the filter
+    (a few bytes per sender) is held in memory. Thread-safe.
+    """
+
+    def __init__(self, path, account, default_cooldown=DEFAULT_REPLY_COOLDOWN_SECONDS):
+        self.path = path
+        self.account = account.lower()
+        self.default_cooldown = default_cooldown
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS replied ("
+            " account TEXT NOT NULL,"
+            " sender TEXT NOT NULL,"
+            " last_replied REAL NOT NULL,"
+            " cooldown REAL,"
+            " replies INTEGER NOT NULL DEFAULT 1,"
+            " PRIMARY KEY (account, sender)) WITHOUT ROWID"
+        )
+        self._db.commit()
+        self._bloom = None
+        self._rebuild_bloom()
+
+    def _rebuild_bloom(self, min_capacity=0):
+        total = self._db.execute("SELECT COUNT(*) FROM replied WHERE account = ?", (self.account,)).fetchone()[0]
+        capacity = BLOOM_INITIAL_CAPACITY
+        while capacity < max(total, min_capacity) * 2:
+            capacity *= 2
+        bloom = BloomFilter(capacity)
+        for (sender,) in self._db.execute("SELECT sender FROM replied WHERE account = ?", (self.account,)):
+            bloom.add(sender)
+        self._bloom = bloom
+
+    def recently_replied(self, sender: str, now=None) -> bool:
+        """True if `sender` was answered and is still inside its cooldown window."""
+        key = sender.lower()
+        with self._lock:
+            if key not in self._bloom:
+                return False
+            row = self._db.execute(
+                "SELECT last_replied, cooldown FROM replied WHERE account = ? AND sender = ?",
+                (self.account, key),
+            ).fetchone()
+        if row is None:
+            return False
+        last_replied, cooldown = row
+        if cooldown is None:
+            return True
+        return ((now or time.time()) - last_replied) < cooldown
+
+    def last_replied(self, sender: str):
+        """Epoch time of the last reply to `sender`, or None if never answered."""
+        key = sender.lower()
+        with self._lock:
+            if key not in self._bloom:
+                return None
+            row = self._db.execute(
+                "SELECT last_replied FROM replied WHERE account = ? AND sender = ?", (self.account, key),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def mark_replied(self, sender: str, cooldown=None, now=None):
+        """Record a reply to `sender`; `cooldown` (seconds) overrides the store default."""
+        key = sender.lower()
+        cooldown = self.default_cooldown if cooldown is None else cooldown
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO replied (account, sender, last_replied, cooldown) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(account, sender) DO UPDATE SET"
+                " last_replied = excluded.last_replied, cooldown = excluded.cooldown, replies = replies + 1",
+                (self.account, key, now or time.time(), cooldown),
+            )
+            self._db.commit()
+            if key not in self._bloom:
+                self._bloom.add(key)
+                if self._bloom.count > self._bloom.capacity:
+                    self._rebuild_bloom(self._bloom.count)
+
+    def prune(self, now=None) -> int:
+        """Delete rows whose cooldown has expired; returns the number removed."""
+        with self._lock:
+            cur = self._db.execute(
+                "DELETE FROM replied WHERE account = ? AND cooldown IS NOT NULL AND last_replied + cooldown <= ?",
+                (self.account, now or time.time()),
+            )
+            self._db.commit()
+            removed = cur.rowcount
+            if removed:
+                self._rebuild_bloom()
+            return removed
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM replied WHERE account = ?", (self.account,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""
+Message templates for Auto Mail Center, shared by the GUI and the engines.
+- CompiledTemplate: subject / plain / HTML parsed once, rendered with str.format
+- TemplateLibrary: templates from TEMPLATES_DIR, reloaded live when a file changes
+- build_auto_reply / build_greeting: email.message objects; auto-replies carry
+  Auto-Submitted: auto-replied (RFC 3834) and thread under the message answered
+- AutoReplyCache: auto-reply bodies encoded once, stamped per recipient
+"""
+
+import email.utils
+import html
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from email.header import decode_header, make_header
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.policy import SMTP as SMTP_POLICY
+from email.utils import formatdate, make_msgid
+
+from synapse_config import TEMPLATES_DIR
+
+# Built-in greetings (plain text; the HTML part is derived from it)
+GREETING_TEMPLATES = {
+    "Friendly 🌈": "Hi {name}! 🎉\nJust wanted to drop in and say hello! Hope you're having an amazing day.\n\n",
+    "Professional 📄": "Greetings {name},\nThank you for contacting us. We appreciate your time.\n\n",
+    "Tech Nerd 🤖": "[SYSTEM ONLINE] Greetings, {name} 🤖\n$ ssh connection@established\nQuantum entanglement confirmed. Handshake protocol: SUCCESS ✓\n\n",
+    "Casual ☕": "What's up {name}? ☕\nJust checking in! Hope everything's going well on your end.\n\n",
+    "Enthusiastic 🚀": "HELLO {name}!! 🚀\nSuper excited to connect with you! Let's make something awesome happen!\n\n",
+    "Funny 😄": "Yo {name}! 😄\n*Dramatically enters inbox* Hello there! Just sliding into your emails like a pro.\n\n",
+    "AI Assistant 🤖": "[AI] Hello {name}! 🤖\n*beep boop* Human detected! My neural networks are pleased to make your acquaintance.\n\n",
+    "Sci-Fi Commander 🛸": "Commander {name}, 🛸\n[INCOMING TRANSMISSION]\nThis is Starship Alpha-7. We've detected your signal.\n\n",
+}
+
+# Built-in auto-reply HTML; placeholders are TEMPLATE_VARIABLES, e.g. {phone}
+AUTO_REPLY_HTML_TEMPLATE = """\
+<!DOCTYPE html>
+<html>
+  <body style="margin:0; padding:0; background: linear-gradient(to bottom right, #111827, #0f172a); font-family: Inter, Arial, sans-serif; color:#f8fafc">
+    <div style="max-width:560px; margin:60px auto; background:#0b1220; padding:20px; border-radius:12px; box-shadow: 0 8px 30px rgba(0,0,0,0.6);">
+      <h3 style="color:#60a5fa; margin-top:0;">Thanks for reaching out 👋</h3>
+      <p>We received your message. This is an automatic reply to confirm receipt. We'll get back to you as soon as possible.</p>
+      <p style="font-size:13px; color:#9ca3af;">If it's urgent, please call: <strong>{phone}</strong></p>
+      <hr style="border:none; border-top:1px solid rgba(255,255,255,0.04); margin:10px 0;">
+      <p style="font-size:12px; color:#94a3b8;">Automated system message — no action required.</p>
+    </div>
+  </body>
+</html>
+"""
+
+AUTO_REPLY_SUBJECT = "Auto Reply"
+AUTO_REPLY_PLAIN_TEXT = ("Hi,\n\nThanks for your message – this is an automated reply "
+                         "to confirm we've received it.\n\nBest,\nA.Apiwish")
+DEFAULT_REPLY_PHONE = "000-000-0000"
+GREETING_SUBJECT = "Greeting from A.Apiwish"
+# distinct (account, template, values) bodies kept encoded
+AUTO_REPLY_CACHE_SIZE = 16
+# a cached template re-checks its files' mtimes at most this often (seconds)
+TEMPLATE_CHECK_SECONDS = 1.0
+# placeholders a template can use; {{ and }} are literal braces
+TEMPLATE_VARIABLES = ("name", "email", "sender", "phone", "subject", "excerpt", "date", "time")
+# {identifier} is a placeholder; any other brace (CSS, JSON) is kept as written
+_TOKEN_RE = re.compile(r"(\{\{|\}\}|\{[A-Za-z_][A-Za-z0-9_]*\})")
+_SUBJECT_PREFIX = "subject:"
+# RFC 3834 5.2: lets other responders recognise our replies and not answer them (greetings are not auto-replies)
+AUTO_REPLY_HEADERS = (("Auto-Submitted", "auto-replied"),)
+# message ids kept from the answered message's References (keeps the stamped header line short)
+REFERENCES_KEPT = 10
+
+
+# -----------------------
+# Compiled templates
+# -----------------------
+def _compile(text, to_html=False):
+    """`text` -> (str.format string with positional fields, field names in index order)."""
+    out, fields = [], {}
+    for i, token in enumerate(_TOKEN_RE.split(text)):
+        if i % 2 == 0:
+            if to_html:
+                token = html.escape(token, quote=False).replace("\n", "<br>")
+            out.append(token.replace("{", "{{").replace("}", "}}"))
+        elif token in ("{{", "}}"):
+            out.append(token)
+        else:
+            out.append("{%d}" % fields.setdefault(token[1:-1], len(fields)))
+    return "".join(out), tuple(fields)
+
+
+def _split_subject(text, default):
+    """A template file may start with a "Subject: ..." line (then a blank line)."""
+    first, nl, rest = text.partition("\n")
+    if first.lower().startswith(_SUBJECT_PREFIX):
+        return first[len(_SUBJECT_PREFIX):].strip(), rest[1:] if rest.startswith("\n") else rest
+    return default, text
+
+
+def header_text(value) -> str:
+    """A header value as display text: RFC 2047 words decoded, whitespace collapsed."""
+    try:
+        text = str(make_header(decode_header(value or "")))
+    except (ValueError, LookupError):
+        text = value or ""
+    return " ".join(text.split())
+
+
+_clock = [None, "", ""]  # minute, {date}, {time}: strftime once a minute, not per message
+
+
+def template_values(name="", email="", sender="", phone="", subject="", excerpt="", now=None) -> dict:
+    if now is None:
+        minute = int(time.time() // 60)
+        if _clock[0] != minute:
+            stamp = datetime.now()
+            _clock[:] = [minute, stamp.strftime("%Y-%m-%d"), stamp.strftime("%H:%M")]
+        date, clock = _clock[1], _clock[2]
+    else:
+        date, clock = now.strftime("%Y-%m-%d"), now.strftime("%H:%M")
+    return {"name": name, "email": email, "sender": sender, "phone": phone, "subject": subject,
+            "excerpt": excerpt, "date": date, "time": clock}
+
+
+def thread_headers(headers):
+    """In-Reply-To / References that put a reply under the message it answers; () without a Message-ID."""
+    if headers is None:
+        return ()
+    message_id = " ".join(str(headers.get("Message-ID") or "").split())
+    if not message_id:
+        return ()
+    references = str(headers.get("References") or headers.get("In-Reply-To") or "").split()
+    return (("In-Reply-To", message_id),
+            ("References", " ".join(references[-(REFERENCES_KEPT - 1):] + [message_id])))
+
+
+def reply_values(headers, excerpt="") -> dict:
+    """Values taken from the message being answered: the sender's display name, its subject and text."""
+    name = email.utils.parseaddr(headers.get("From", ""))[0]
+    return {"name": header_text(name) or "there", "subject": header_text(headers.get("Subject")),
+            "excerpt": excerpt}
+
+
+class CompiledTemplate:
+    """
+    A message template parsed once into str.format strings for the subject, the
+    plain text and the HTML part; without an HTML source the plain text is escaped
+    and its line breaks become <br>. render() only fills in values (escaped for
+    HTML); a placeholder without a value is left as written so the typo shows.
+    """
+
+    __slots__ = ("name", "sources", "fields", "_subject", "_plain", "_html")
+
+    def __init__(self, plain, html_source=None, subject=GREETING_SUBJECT, name=""):
+        self.name = name
+        self.sources = (subject, plain, html_source)
+        self._subject = _compile(subject)
+        self._plain = _compile(plain)
+        self._html = _compile(html_source) if html_source is not None else _compile(plain, to_html=True)
+        self.fields = tuple(sorted(set(self._subject[1] + self._plain[1] + self._html[1])))
+
+    def render(self, values):
+        """(subject, plain text, HTML) for `values` (see TEMPLATE_VARIABLES)."""
+        subject_fmt, subject_fields = self._subject
+        plain_fmt, plain_fields = self._plain
+        html_fmt, html_fields = self._html
+        subject = subject_fmt.format(*[" ".join(str(values[f]).split()) if f in values else "{%s}" % f
+                                       for f in subject_fields])
+        plain = plain_fmt.format(*[values[f] if f in values else "{%s}" % f for f in plain_fields])
+        html_body = html_fmt.format(*[html.escape(str(values[f])) if f in values else "{%s}" % f
+                                      for f in html_fields])
+        return subject, plain, html_body
+
+    def build(self, from_addr, to_addr, values, headers=()):
+        subject, plain, html_body = self.render(values)
+        msg = MIMEMultipart("alternative")
+        msg['Subject'] = subject
+        msg['From'] = from_addr
+        if to_addr is not None:
+            msg['To'] = to_addr
+        for name, value in headers:
+            msg[name] = value
+        msg.attach(MIMEText(plain, "plain"))
+        msg.attach(MIMEText(html_body, "html"))
+        return msg
+
+
+DEFAULT_AUTO_REPLY = CompiledTemplate(AUTO_REPLY_PLAIN_TEXT, AUTO_REPLY_HTML_TEMPLATE, AUTO_REPLY_SUBJECT, "auto-reply")
+DEFAULT_GREETINGS = {name: CompiledTemplate(text, name=name) for name, text in GREETING_TEMPLATES.items()}
+
+
+def _signature(path):
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class TemplateLibrary:
+    """
+    Templates read from a directory, compiled once and recompiled when a file
+    changes, so edits apply to the next message without a restart:
+      greetings/<Name>.txt  plain text (may start with "Subject: ..."), optional <Name>.html
+      auto_reply.html       auto-reply HTML, optional auto_reply.txt (plain text / subject)
+      replies/<Name>.txt    named auto-replies picked by routing rules (.html optional too)
+    Built-in templates cover whatever the directory does not provide. Files are
+    stat'ed at most every `check_seconds`, so a bulk send's lookups are dict hits.
+    A file that cannot be read keeps the previous version. Thread-safe.
+    """
+
+    def __init__(self, directory=TEMPLATES_DIR, check_seconds=TEMPLATE_CHECK_SECONDS, log=None):
+        self.directory = directory
+        self.check_seconds = check_seconds
+        self.log = log or (lambda text: None)
+        self.reloads = 0
+        self._entries = {}  # key -> [checked_at, signature, CompiledTemplate]
+        self._lock = threading.Lock()
+
+    # ---- lookups ----
+    def greeting_names(self):
+        """Built-in greetings first, then the directory's (in name order)."""
+        names = list(DEFAULT_GREETINGS)
+        try:
+            files = sorted(os.listdir(os.path.join(self.directory, "greetings")))
+        except OSError:
+            files = []
+        for filename in files:
+            stem, ext = os.path.splitext(filename)
+            if ext in (".txt", ".html") and stem not in names:
+                names.append(stem)
+        return names
+
+    def has_greeting(self, name) -> bool:
+        return bool(name) and (name in DEFAULT_GREETINGS or self._greeting_paths(name) != (None, None))
+
+    def greeting(self, name) -> CompiledTemplate:
+        """Greeting `name`; an unknown name gets the first built-in one."""
+        fallback = DEFAULT_GREETINGS.get(name) or next(iter(DEFAULT_GREETINGS.values()))
+        if not name or os.sep in name or (os.altsep and os.altsep in name):
+            return fallback
+        return self._get(("greeting", name), lambda: self._greeting_paths(name, existing=False), fallback)
+
+    def auto_reply(self, html_path=None) -> CompiledTemplate:
+        """The auto-reply from `html_path` (plus a .txt beside it) or from the directory."""
+        def paths():
+            path = html_path or os.path.join(self.directory, "auto_reply.html")
+            return os.path.splitext(path)[0] + ".txt", path
+        return self._get(("auto_reply", html_path), paths, DEFAULT_AUTO_REPLY)
+
+    def has_reply(self, name) -> bool:
+        return bool(name) and self._named_paths("replies", name) != (None, None)
+
+    def reply(self, name, html_path=None) -> CompiledTemplate:
+        """Named auto-reply from replies/; missing files fall back to auto_reply(html_path)."""
+        fallback = self.auto_reply(html_path)
+        if not name or os.sep in name or (os.altsep and os.altsep in name):
+            return fallback
+        return self._get(("reply", name, html_path), lambda: self._named_paths("replies", name, existing=False),
+                         fallback)
+
+    # ---- loading ----
+    def _greeting_paths(self, name, existing=True):
+        return self._named_paths("greetings", name, existing)
+
+    def _named_paths(self, kind, name, existing=True):
+        base = os.path.join(self.directory, kind, name)
+        paths = (base + ".txt", base + ".html")
+        if not existing:
+            return paths
+        return tuple(p if os.path.isfile(p) else None for p in paths)
+
+    def _get(self, key, paths, fallback):
+        """`paths()` -> (txt, html) file names; only called when the files are due for a check."""
+        now = time.monotonic()
+        entry = self._entries.get(key)  # fast path without the lock; entries are replaced, not mutated in place
+        if entry is not None and now - entry[0] < self.check_seconds:
+            return entry[2]
+        txt_path, html_path = paths()
+        signature = (_signature(txt_path), _signature(html_path))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == signature:
+                # no files: follow the fallback, which may itself have been reloaded
+                template = fallback if signature == (None, None) else entry[2]
+                self._entries[key] = [now, signature, template]
+                return template
+        previous = entry[2] if entry is not None else fallback
+        if signature == (None, None):
+            template = fallback
+        else:
+            template = self._load(key[1] or "auto_reply", txt_path if signature[0] else None,
+                                  html_path if signature[1] else None, fallback, previous)
+        with self._lock:
+            if entry is not None and template is not entry[2]:
+                self.reloads += 1
+            self._entries[key] = [now, signature, template]
+        if entry is not None and template is not entry[2]:
+            self.log(f"📝 Template reloaded: {template.name}")
+        return template
+
+    def _load(self, name, txt_path, html_path, fallback, previous):
+        default_subject, default_plain, default_html = fallback.sources
+        try:
+            subject, plain = default_subject, default_plain
+            if txt_path:
+                with open(txt_path, "r", encoding="utf-8") as f:
+                    subject, plain = _split_subject(f.read(), default_subject)
+            if html_path:
+                with open(html_path, "r", encoding="utf-8") as f:
+                    html_source = f.read()
+            else:
+                # a new plain text gets its own HTML; the built-in HTML would not match it
+                html_source = None if txt_path else default_html
+        except (OSError, UnicodeDecodeError) as e:
+            self.log(f"⚠ Template {name}: {e} — keeping the previous version")
+            return previous
+        return CompiledTemplate(plain, html_source, subject, name)
+
+
+TEMPLATES = TemplateLibrary()
+
+
+# -----------------------
+# Builders
+# -----------------------
+def build_auto_reply(from_addr, to_addr, phone=None, template=DEFAULT_AUTO_REPLY, values=None, original=None):
+    """`original`: headers of the message being answered (for In-Reply-To / References)."""
+    values = dict(values or (), email=to_addr or "", sender=from_addr, phone=phone or DEFAULT_REPLY_PHONE)
+    return template.build(from_addr, to_addr, template_values(**values),
+                          AUTO_REPLY_HEADERS + tuple(thread_headers(original)))
+
+
+def build_greeting(from_addr, to_addr, recipient_name, template_name, phone="", templates=None):
+    template = (templates or TEMPLATES).greeting(template_name)
+    return template.build(from_addr, to_addr, template_values(recipient_name, to_addr, from_addr, phone))
+
+
+# -----------------------
+# Pre-rendered auto-replies
+# -----------------------
+class StampedMessage:
+    """
+    One recipient's copy of a cached auto-reply: the shared encoded body plus its
+    own To/Date/Message-ID lines. Send paths use envelope() instead of re-flattening.
+    """
+
+    __slots__ = ("from_addr", "to_addr", "_head", "_body")
+
+    def __init__(self, from_addr, to_addr, head, body):
+        self.from_addr = from_addr
+        self.to_addr = to_addr
+        self._head = head
+        self._body = body
+
+    def as_bytes(self) -> bytes:
+        return self._head + self._body
+
+    def envelope(self):
+        """(from_addr, [to_addr], RFC 5322 bytes with CRLF line endings)."""
+        return self.from_addr, [self.to_addr], self._head + self._body
+
+
+class AutoReplyCache:
+    """
+    Renders and MIME-encodes the auto-reply once per (from address, compiled
+    template, values of the placeholders it uses); each send only prepends
+    To/Date/Message-ID (and In-Reply-To/References) to the cached bytes, which
+    carry AUTO_REPLY_HEADERS. A template that uses per-message
+    values ({email}, {subject}, ...) is encoded per message, as it must be.
+    Editing the phone or reloading a template changes the key, so a stale body
+    is never sent; the least recently used entries are evicted. Thread-safe.
+    """
+
+    def __init__(self, maxsize=AUTO_REPLY_CACHE_SIZE):
+        self.maxsize = max(1, int(maxsize))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, from_addr, to_addr, phone=None, template=DEFAULT_AUTO_REPLY, values=None,
+               original=None) -> StampedMessage:
+        """
+        `values`: extra template values such as reply_values() of the message
+        being answered; `original`: its headers, for In-Reply-To / References.
+        """
+        values = template_values(**dict(values or (), email=to_addr, sender=from_addr,
+                                        phone=phone or DEFAULT_REPLY_PHONE))
+        key = (from_addr, template) + tuple(values.get(f) for f in template.fields)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if cached is None:
+            cached = self._encode(from_addr, template, values)
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = cached
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        head, body, domain = cached
+        stamp = (f"To: {to_addr}\r\nDate: {formatdate(localtime=True)}\r\n"
+                 f"Message-ID: {make_msgid(domain=domain)}\r\n"
+                 + "".join(f"{name}: {value}\r\n" for name, value in thread_headers(original))).encode("utf-8")
+        return StampedMessage(from_addr, to_addr, stamp + head, body)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _encode(from_addr, template, values):
+        raw = template.build(from_addr, None, values, AUTO_REPLY_HEADERS).as_bytes(policy=SMTP_POLICY)
+        head, _, body = raw.partition(b"\r\n\r\n")
+        domain = from_addr.rpartition("@")[2] or "localhost"
+        return head + b"\r\n", b"\r\n" + body, domain